@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Measure what dSQBatch costs each array task on top of the job itself: the
+# python start up, and starting the job with or without a shell in between.
+# Runs the wrapper the way an array task would, on a job file of `true`:
+#
+#   python3 benchmarks/bench_batch.py --tasks 100
+from __future__ import print_function
+from os import path
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import dSQBatch
+
+BATCH_SCRIPT = path.join(
+    path.dirname(path.dirname(path.abspath(__file__))), "dSQBatch.py"
+)
+
+
+def time_commands(commands, env=None):
+    # seconds per command, run one after another
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        for command in commands:
+            subprocess.check_call(command, env=env, stdout=devnull)
+    return (time.time() - start) / len(commands)
+
+
+def time_tasks(job_file_name, status_dir, num_tasks, extra_args):
+    # seconds per array task of dSQBatch running one line of the job file
+    env = dict(os.environ, SLURM_ARRAY_JOB_ID="1000")
+    start = time.time()
+    for task_id in range(num_tasks):
+        env["SLURM_ARRAY_TASK_ID"] = str(task_id)
+        subprocess.check_call(
+            [
+                sys.executable,
+                BATCH_SCRIPT,
+                "--job-file",
+                job_file_name,
+                "--status-dir",
+                status_dir,
+            ]
+            + extra_args,
+            env=env,
+        )
+    return (time.time() - start) / num_tasks
+
+
+def time_spawns(job_str, num_spawns):
+    # seconds to start and wait for a job from inside the wrapper
+    start = time.time()
+    for i in range(num_spawns):
+        dSQBatch.wait_job(dSQBatch.spawn_job(job_str))
+    return (time.time() - start) / num_spawns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dSQBatch overhead.")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument(
+        "--max-overhead",
+        type=float,
+        default=50,
+        help="Fail if the wrapper adds more than this many ms per task to a bare python start up.",
+    )
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        direct_file = path.join(work_dir, "direct.txt")
+        shell_file = path.join(work_dir, "shell.txt")
+        with open(direct_file, "w") as job_file:
+            job_file.write("true\n" * args.tasks)
+        with open(shell_file, "w") as job_file:
+            # the ; makes dSQBatch go through /bin/sh
+            job_file.write("true;\n" * args.tasks)
+
+        python = time_commands([[sys.executable, "-c", "pass"]] * args.tasks)
+        startup = time_commands(
+            [[sys.executable, BATCH_SCRIPT, "--version"]] * args.tasks
+        )
+        rows = [
+            ("python -c pass", python),
+            ("dSQBatch --version", startup),
+            ("task, via /bin/sh", time_tasks(shell_file, work_dir, args.tasks, [])),
+            ("task, direct", time_tasks(direct_file, work_dir, args.tasks, [])),
+            (
+                "task, direct --exec",
+                time_tasks(direct_file, work_dir, args.tasks, ["--exec"]),
+            ),
+        ]
+        spawns = [
+            ("spawn via /bin/sh", time_spawns("true;", args.tasks)),
+            ("spawn direct", time_spawns("true", args.tasks)),
+        ]
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("{:>22} {:>10} {:>18}".format("", "ms", "ms over python"))
+    for name, seconds in rows:
+        print(
+            "{:>22} {:>10.2f} {:>18.2f}".format(
+                name, seconds * 1000, (seconds - python) * 1000
+            )
+        )
+    for name, seconds in spawns:
+        print("{:>22} {:>10.2f}".format(name, seconds * 1000))
+    overhead = (min(seconds for name, seconds in rows[2:]) - python) * 1000
+    print("dSQBatch adds {:.2f} ms per task to starting python.".format(overhead))
+    if overhead > args.max_overhead:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Time how dSQAutopsy's state tally and job file rewrite scale with the size of
+# the array, using synthetic sacct output. Run from anywhere:
+#
+#   python3 benchmarks/bench_dsqa.py --sizes 10000 100000 1000000
+from __future__ import print_function
+from collections import defaultdict
+from os import path
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import dSQAutopsy
+
+
+def fake_sacct_lines(job_id, num_tasks):
+    # every third task failed and every seventh was preempted, which leaves lots
+    # of small ranges. the last tenth of the array is still pending as one range
+    num_done = num_tasks - num_tasks // 10
+    for i in range(num_done):
+        if i % 3 == 0:
+            state = "FAILED"
+        elif i % 7 == 0:
+            state = "PREEMPTED"
+        else:
+            state = "COMPLETED"
+        yield "{}_{}|{}\n".format(job_id, i, state)
+    if num_done < num_tasks:
+        yield "{}_[{}-{}%50]|PENDING\n".format(job_id, num_done, num_tasks - 1)
+
+
+def run_once(num_tasks, job_file_name):
+    sacct_lines = list(fake_sacct_lines(1000, num_tasks))
+    tally = {
+        "summary": defaultdict(lambda: 0),
+        "states": defaultdict(lambda: []),
+        "reruns": [],
+        "rerun_states": ["FAILED", "PREEMPTED", "PENDING"],
+        "lines_read": 0,
+    }
+    start = time.time()
+    dSQAutopsy.tally_states(sacct_lines, {}, tally)
+    for state in tally["states"]:
+        ",".join(dSQAutopsy.collapse_ranges(tally["states"][state]))
+    reruns = dSQAutopsy.merge_intervals(tally["reruns"])
+    tally_time = time.time() - start
+
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            dSQAutopsy.print_reruns(reruns, job_file_name)
+    rewrite_time = time.time() - start
+    return tally_time, rewrite_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dSQAutopsy scaling.")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[10000, 100000, 1000000],
+        help="Array sizes to time.",
+    )
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="dsq-bench-")
+    job_file_name = path.join(tmp_dir, "jobs.txt")
+    with open(job_file_name, "w") as job_file:
+        for i in range(max(args.sizes)):
+            print("./my_analysis --sample {}".format(i), file=job_file)
+
+    print(
+        "{:>10} {:>10} {:>10} {:>12}".format(
+            "Tasks", "Tally_s", "Rewrite_s", "us_per_task"
+        )
+    )
+    per_task = []
+    for num_tasks in sorted(args.sizes):
+        tally_time, rewrite_time = run_once(num_tasks, job_file_name)
+        per_task.append((tally_time + rewrite_time) / num_tasks * 1e6)
+        print(
+            "{:>10} {:>10.3f} {:>10.3f} {:>12.3f}".format(
+                num_tasks, tally_time, rewrite_time, per_task[-1]
+            )
+        )
+    os.remove(job_file_name)
+    os.rmdir(tmp_dir)
+
+    # linear scaling means the cost per task stays about the same as the array grows
+    growth = per_task[-1] / per_task[0]
+    print(
+        "Cost per task grew {:.2f}x from the smallest to the largest array.".format(
+            growth
+        )
+    )
+    if growth > 3:
+        print("That doesn't look linear.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Compare the makespan of a skewed job file run as a fixed array against the
+# same job file pulled from a --dynamic queue, with jobs replaced by sleeps so it
+# runs anywhere in a few seconds:
+#
+#   python3 benchmarks/bench_dynamic.py --jobs 400 --workers 8
+from __future__ import print_function
+from os import path
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from dSQQueue import claim_chunk, close_queue, finish_chunk, open_queue
+
+
+def skewed_runtimes(num_jobs, seed):
+    # most jobs are quick, one in twenty takes 50 times as long
+    rand = random.Random(seed)
+    return [0.5 if rand.random() < 0.05 else 0.01 for i in range(num_jobs)]
+
+
+def run_workers(num_workers, work):
+    start = time.time()
+    threads = [threading.Thread(target=work, args=(w,)) for w in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def static_makespan(runtimes, num_workers):
+    # each worker runs a fixed share of the job file, like an array with --pack
+    # and one job per slot
+    pack = (len(runtimes) + num_workers - 1) // num_workers
+
+    def work(w):
+        for runtime in runtimes[w * pack : (w + 1) * pack]:
+            time.sleep(runtime)
+
+    return run_workers(num_workers, work)
+
+
+def dynamic_makespan(runtimes, num_workers, pack, status_dir):
+    num_chunks = (len(runtimes) + pack - 1) // pack
+
+    def work(w):
+        queue = open_queue(status_dir, 1000, num_chunks)
+        while True:
+            chunk = claim_chunk(queue, "worker{}".format(w))
+            if chunk is None:
+                break
+            for runtime in runtimes[chunk * pack : (chunk + 1) * pack]:
+                time.sleep(runtime)
+            finish_chunk(queue, chunk)
+        close_queue(queue)
+
+    return run_workers(num_workers, work)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark --dynamic scheduling.")
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pack", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=1.5,
+        help="Fail if the dynamic makespan is more than this many times the ideal.",
+    )
+    args = parser.parse_args()
+
+    runtimes = skewed_runtimes(args.jobs, args.seed)
+    # no schedule can beat the longest job or perfectly even work
+    ideal = max(max(runtimes), sum(runtimes) / args.workers)
+    status_dir = tempfile.mkdtemp()
+    try:
+        static = static_makespan(runtimes, args.workers)
+        dynamic = dynamic_makespan(runtimes, args.workers, args.pack, status_dir)
+    finally:
+        shutil.rmtree(status_dir)
+
+    print("{:>10} {:>10}".format("schedule", "makespan"))
+    print("{:>10} {:>10.3f}".format("ideal", ideal))
+    print("{:>10} {:>10.3f}".format("static", static))
+    print("{:>10} {:>10.3f}".format("dynamic", dynamic))
+    ratio = dynamic / ideal
+    print("Dynamic makespan is {:.2f}x the ideal.".format(ratio))
+    if ratio > args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# Measure how dsq, dSQBatch and dsqa scale with the size of the job file, with
+# the stand-ins for scontrol, sbatch and sacct in benchmarks/fake_slurm on the
+# PATH so it runs anywhere:
+#
+#   python3 benchmarks/bench_scaling.py --sizes 1000 10000 100000 1000000
+#
+# every phase runs in its own python, which reports its peak memory and its read
+# and write calls (from /proc/self/io, so not those of the jobs it starts). the
+# results are checked against benchmarks/thresholds.json, where every limit is
+# a base plus an amount per job file line.
+from __future__ import print_function
+from os import path
+import argparse
+import json
+import os
+import random
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = path.dirname(path.abspath(__file__))
+REPO_DIR = path.dirname(BENCH_DIR)
+FAKE_SLURM_DIR = path.join(BENCH_DIR, "fake_slurm")
+
+
+def read_proc_io():
+    io = {}
+    try:
+        with open("/proc/self/io", "r") as io_file:
+            for l in io_file:
+                key, value = l.split(":")
+                io[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return io
+
+
+def measure_main(argv):
+    # bench_scaling.py --measure results.jsonl script args...: run script as if
+    # it was started on its own, then add a line about what it used to results
+    results_name, script = argv[:2]
+    sys.argv = [script] + argv[2:]
+    sys.path[0] = path.dirname(path.abspath(script))
+    exit_code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (e.code is not None)
+    sys.stdout.flush()
+    io = read_proc_io()
+    result = {
+        "exit_code": exit_code,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "syscalls": io.get("syscr", 0) + io.get("syscw", 0),
+    }
+    fd = os.open(results_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(result) + "\n").encode())
+    finally:
+        os.close(fd)
+    sys.exit(exit_code)
+
+
+def measured_cmd(results_name, script, args):
+    return [
+        sys.executable,
+        path.abspath(__file__),
+        "--measure",
+        results_name,
+        path.join(REPO_DIR, script),
+    ] + args
+
+
+def read_results(results_name):
+    with open(results_name, "r") as results_file:
+        results = [json.loads(l) for l in results_file]
+    os.remove(results_name)
+    return results
+
+
+def write_job_file(job_file_name, num_lines):
+    with open(job_file_name, "w") as job_file:
+        for i in range(num_lines):
+            print("true --sample {}".format(i), file=job_file)
+
+
+def write_sacct_fixture(fixture_name, job_id, num_tasks, seed):
+    # a large sparse array: mostly completed, a few failed or preempted tasks
+    # spread all over it, and the end of the array still pending as one range
+    rand = random.Random(seed)
+    num_done = num_tasks - num_tasks // 10
+    with open(fixture_name, "w") as fixture:
+        for i in range(num_done):
+            r = rand.random()
+            if r < 0.01:
+                state = "FAILED"
+            elif r < 0.02:
+                state = "PREEMPTED"
+            else:
+                state = "COMPLETED"
+            fixture.write("{}_{}|{}\n".format(job_id, i, state))
+        if num_done < num_tasks:
+            fixture.write(
+                "{}_[{}-{}%50]|PENDING\n".format(job_id, num_done, num_tasks - 1)
+            )
+
+
+def run_phase(results_name, script, args, env, cwd):
+    start = time.time()
+    proc = subprocess.Popen(
+        measured_cmd(results_name, script, args),
+        env=env,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    # dsqa prints its summary to stderr, only show it if something went wrong
+    stderr = proc.communicate()[1]
+    seconds = time.time() - start
+    result = read_results(results_name)[0]
+    if proc.returncode != 0:
+        sys.stderr.write(stderr)
+        raise RuntimeError(
+            "{} {} exited {}".format(script, " ".join(args), proc.returncode)
+        )
+    return {
+        "seconds": seconds,
+        "max_rss_mb": result["max_rss_kb"] / 1024.0,
+        "syscalls": result["syscalls"],
+    }
+
+
+def run_batch_tasks(results_name, job_file_name, num_lines, args, env, cwd):
+    # num_tasks array tasks of dSQBatch, concurrency at a time, on random lines of
+    # the job file, all saving their stats to the same status dir
+    rand = random.Random(num_lines)
+    task_ids = [rand.randrange(num_lines) for i in range(args.tasks)]
+    batch_args = ["--job-file", job_file_name, "--status-dir", cwd]
+    running = {}
+    start = time.time()
+    while len(task_ids) > 0 or len(running) > 0:
+        while len(task_ids) > 0 and len(running) < args.concurrency:
+            task_env = dict(env, SLURM_ARRAY_TASK_ID=str(task_ids.pop()))
+            proc = subprocess.Popen(
+                measured_cmd(results_name, "dSQBatch.py", batch_args),
+                env=task_env,
+                cwd=cwd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+            )
+            running[proc.pid] = proc
+        pid, wait_status = os.wait()
+        if wait_status != 0:
+            raise RuntimeError("dSQBatch exited {}".format(wait_status))
+        running.pop(pid, None)
+    seconds = time.time() - start
+    results = read_results(results_name)
+    status_name = path.join(cwd, "job_{}_status.tsv".format(env["SLURM_ARRAY_JOB_ID"]))
+    with open(status_name, "r") as status_file:
+        num_rows = sum(1 for l in status_file)
+    os.remove(status_name)
+    if num_rows != args.tasks:
+        raise RuntimeError(
+            "{} tasks saved {} status lines".format(args.tasks, num_rows)
+        )
+    return {
+        "seconds": seconds,
+        "ms_per_task": seconds * 1000 / args.tasks,
+        "max_rss_mb": max(r["max_rss_kb"] for r in results) / 1024.0,
+        "syscalls_per_task": sum(r["syscalls"] for r in results) / float(len(results)),
+    }
+
+
+def check_thresholds(phase, num_lines, result, thresholds):
+    # the limits this result is over
+    failures = []
+    for key, limit in sorted(thresholds.get(phase, {}).items()):
+        allowed = limit.get("base", 0) + limit.get("per_line", 0) * num_lines
+        if result.get(key, 0) > allowed:
+            failures.append(
+                "{} with {} lines: {} is {:.4g}, over {:.4g}".format(
+                    phase, num_lines, key, result[key], allowed
+                )
+            )
+    return failures
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        measure_main(sys.argv[2:])
+    parser = argparse.ArgumentParser(description="Benchmark dSQ against a fake Slurm.")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[1000, 10000, 100000, 1000000],
+        help="Job file sizes to run, in lines.",
+    )
+    parser.add_argument(
+        "--tasks",
+        type=int,
+        default=200,
+        help="Array tasks of dSQBatch to run for each size.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Array tasks of dSQBatch running at once.",
+    )
+    parser.add_argument(
+        "--thresholds",
+        default=path.join(BENCH_DIR, "thresholds.json"),
+        help="Fail if a result is over a limit in this file.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as json."
+    )
+    args = parser.parse_args()
+    with open(args.thresholds, "r") as thresholds_file:
+        thresholds = json.load(thresholds_file)
+
+    work_dir = tempfile.mkdtemp(prefix="dsq-bench-")
+    env = dict(
+        os.environ,
+        PATH=FAKE_SLURM_DIR + os.pathsep + os.environ.get("PATH", ""),
+        DSQ_FAKE_SLURM=work_dir,
+        SLURM_ARRAY_JOB_ID="1000",
+        # keep the fake slurm's limits out of the real cache
+        XDG_CACHE_HOME=work_dir,
+    )
+    results_name = path.join(work_dir, "results.jsonl")
+    rows = []
+    try:
+        for num_lines in sorted(args.sizes):
+            job_file_name = path.join(work_dir, "jobs_{}.txt".format(num_lines))
+            write_job_file(job_file_name, num_lines)
+            rows.append(
+                (
+                    "dsq",
+                    num_lines,
+                    run_phase(
+                        results_name,
+                        "dSQ.py",
+                        ["--job-file", job_file_name, "--submit"],
+                        env,
+                        work_dir,
+                    ),
+                )
+            )
+            rows.append(
+                (
+                    "dSQBatch",
+                    num_lines,
+                    run_batch_tasks(
+                        results_name, job_file_name, num_lines, args, env, work_dir
+                    ),
+                )
+            )
+            job_id = 2000 + len(rows)
+            write_sacct_fixture(
+                path.join(work_dir, "sacct_{}.txt".format(job_id)),
+                job_id,
+                num_lines,
+                num_lines,
+            )
+            rows.append(
+                (
+                    "dsqa",
+                    num_lines,
+                    run_phase(
+                        results_name,
+                        "dSQAutopsy.py",
+                        [
+                            "-j",
+                            str(job_id),
+                            "-f",
+                            job_file_name,
+                            "-s",
+                            "FAILED,PREEMPTED,PENDING",
+                        ],
+                        env,
+                        work_dir,
+                    ),
+                )
+            )
+            os.remove(job_file_name)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.json:
+        print(
+            json.dumps(
+                [dict(phase=p, lines=n, **result) for p, n, result in rows], indent=2
+            )
+        )
+    else:
+        # dSQBatch rows are per array task
+        print(
+            "{:>9} {:>9} {:>9} {:>11} {:>11} {:>11}".format(
+                "Phase", "Lines", "Seconds", "ms_per_task", "Max_RSS_MB", "Syscalls"
+            )
+        )
+        for phase, num_lines, result in rows:
+            print(
+                "{:>9} {:>9} {:>9.3f} {:>11} {:>11.1f} {:>11.0f}".format(
+                    phase,
+                    num_lines,
+                    result["seconds"],
+                    "{:.1f}".format(result["ms_per_task"])
+                    if "ms_per_task" in result
+                    else "",
+                    result["max_rss_mb"],
+                    result.get("syscalls", result.get("syscalls_per_task")),
+                )
+            )
+    failures = []
+    for phase, num_lines, result in rows:
+        failures.extend(check_thresholds(phase, num_lines, result, thresholds))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
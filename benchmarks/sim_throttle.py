@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Run the dsq throttle controller against a simulated cluster, with the stand-in
+# for scontrol in benchmarks/fake_slurm on the PATH so every change goes through
+# scontrol update like it would on a real one:
+#
+#   python3 benchmarks/sim_throttle.py --windows 120
+#
+# in the model, jobs take the same time until more than --knee of them run at
+# once. past that they share a saturated filesystem, so each one slows down more
+# than in proportion, status writes get slower and more of them fail. the most
+# jobs finish a second at --knee tasks at once. the controller doesn't know that
+# and has to find it from the windows it sees. fails if, on average, it doesn't
+# get close to that throughput, starting from too few and from too many tasks.
+from __future__ import print_function
+from os import path
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+BENCH_DIR = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(BENCH_DIR))
+from dSQThrottle import (
+    array_throttle,
+    new_throttle_state,
+    set_array_throttle,
+    throttle_step,
+)
+
+
+def expected_finished(tasks, args):
+    # jobs a window finishes on average with tasks running at once
+    load = tasks / float(args.knee)
+    return tasks * args.window / (args.runtime * max(1.0, load) ** args.slowdown)
+
+
+def simulate_window(tasks, args, rand):
+    # what a window of args.window seconds looks like with tasks running at once
+    load = tasks / float(args.knee)
+    runtime = args.runtime * max(1.0, load) ** args.slowdown
+    expected = expected_finished(tasks, args)
+    finished = max(0, int(round(rand.gauss(expected, expected**0.5))))
+    fail_rate = 0.01 + 0.2 * max(0.0, load - 1.3)
+    failed = sum(1 for i in range(finished) if rand.random() < fail_rate)
+    return {
+        "seconds": args.window,
+        "finished": finished,
+        "failed": failed,
+        "mean_runtime": runtime * rand.uniform(0.95, 1.05),
+        "write_latency": 0.05 * load**3 * rand.uniform(0.8, 1.2),
+    }
+
+
+def run_scenario(job_id, start, args):
+    rand = random.Random(start)
+    state = new_throttle_state(start, 1, args.max)
+    set_array_throttle(job_id, start)
+    limits = []
+    finished = []
+    for window in range(args.windows):
+        # what slurm has, not what we think we set
+        tasks = array_throttle(job_id)[0]
+        sample = simulate_window(tasks, args, rand)
+        limits.append(tasks)
+        finished.append(expected_finished(tasks, args))
+        limit, reason = throttle_step(state, sample)
+        if limit != tasks:
+            set_array_throttle(job_id, limit)
+    return limits, finished
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the dsq throttle controller against a simulated load."
+    )
+    parser.add_argument(
+        "--knee", type=int, default=60, help="Tasks at once that finish the most jobs."
+    )
+    parser.add_argument(
+        "--runtime", type=float, default=60, help="Seconds a job takes below the knee."
+    )
+    parser.add_argument(
+        "--slowdown",
+        type=float,
+        default=1.5,
+        help="How much faster than the load jobs slow down past the knee.",
+    )
+    parser.add_argument(
+        "--window", type=float, default=120, help="Seconds in each window."
+    )
+    parser.add_argument("--windows", type=int, default=120, help="Windows to simulate.")
+    parser.add_argument(
+        "--max", type=int, default=None, help="The most tasks at once allowed."
+    )
+    parser.add_argument(
+        "--starts",
+        nargs="+",
+        type=int,
+        default=[4, 10, 500],
+        help="Tasks at once to start from, one simulation each.",
+    )
+    args = parser.parse_args()
+
+    fixture_dir = tempfile.mkdtemp(prefix="dsq-throttle-sim-")
+    os.environ["DSQ_FAKE_SLURM"] = fixture_dir
+    # keep the fake slurm's limits out of the real cache
+    os.environ["XDG_CACHE_HOME"] = fixture_dir
+    os.environ["PATH"] = (
+        path.join(BENCH_DIR, "fake_slurm") + os.pathsep + os.environ.get("PATH", "")
+    )
+    best = expected_finished(
+        args.knee if args.max is None else min(args.knee, args.max), args
+    )
+    failures = []
+    print(
+        "{:>6} {:>11} {:>11} {:>11}".format(
+            "Start", "Final_Limit", "Mean_Limit", "Throughput"
+        )
+    )
+    try:
+        for i, start in enumerate(args.starts):
+            limits, finished = run_scenario(1000 + i, start, args)
+            # judge it once it had time to get there
+            half = len(limits) // 2
+            mean_limit = sum(limits[half:]) / float(len(limits) - half)
+            throughput = sum(finished[half:]) / float(len(finished) - half) / best
+            print(
+                "{:>6} {:>11} {:>11.1f} {:>10.0f}%".format(
+                    start, limits[-1], mean_limit, 100 * throughput
+                )
+            )
+            if throughput < 0.85:
+                failures.append(
+                    "starting at {}, only {:.0f}% of the best throughput".format(
+                        start, 100 * throughput
+                    )
+                )
+    finally:
+        shutil.rmtree(fixture_dir)
+    print("(throughput is of the most jobs a window can finish on average)")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,57 @@
 from __future__ import print_function
 from datetime import datetime
 from os import path
-from subprocess import call, check_output
+from subprocess import CalledProcessError, check_output
 from textwrap import fill
+from dSQCache import CACHE_BY, compact_cache, find_cached, job_key, record_jobs
+from dSQJobFile import (
+    MAP_NO_LINE,
+    compress_job_file,
+    count_jobs,
+    open_job_file,
+    read_lines,
+    scan_job_file,
+    write_line_map,
+)
+from dSQLogs import LOG_STDOUT, iter_task_output
+from dSQSlurm import slurm_limits
+from dSQStatus import (
+    STATUS_BACKENDS,
+    command_key,
+    elapsed_by_command,
+    merge_status,
+    succeeded_lines,
+)
+from dSQSweep import load_sweep, sweep_lines, sweep_size
+from dSQThrottle import array_throttle, new_throttle_state, run_throttle
+from dSQTrace import TRACE_DIR, format_trace_summary, merge_trace, trace_files
+from dSQWatch import (
+    find_total_jobs,
+    format_summary,
+    new_watch_state,
+    read_new_status,
+    summarize,
+)
 import argparse
+import heapq
 import itertools
+import json
 import os
 import re
+import shlex
+import shutil
 import sys
+import tempfile
+import threading
+import time
 
 __version__ = 1.05
 
+# longest --array string to give sbatch before splitting the array in more parts.
+# long ones are slow for slurmctld to parse, and can be rejected outright.
+# DSQ_MAX_ARRAY_STRING changes it
+MAX_ARRAY_STRING = 10000
+
 
 def safe_fill(text, wrap_width):
     if sys.__stdin__.isatty():
@@ -23,36 +64,22 @@ def safe_fill(text, wrap_width):
 # Check if dSQ is being run interactively
 if sys.__stdin__.isatty():
     # get terminal columns for wrapping
-    term_rows, term_columns = [int(x) for x in check_output(["stty", "size"]).split()]
-    if term_columns < 25:
-        term_columns = 25
-# non-interactive use will throw this error, but that is ok
+    term_columns = max(shutil.get_terminal_size().columns, 25)
+# piped, run from a script or imported, there is no terminal to fit text to
 else:
     term_columns = 25
 
-# get slurm info
-try:
-    # get max configured array index
-    slurm_conf = check_output(
-        ["scontrol", "show", "conf"], universal_newlines=True
-    ).split("\n")[:-1]
-    max_array_size = [
-        int(x.split("=")[1]) for x in slurm_conf if x.startswith("MaxArraySize")
-    ][0]
-
-except FileNotFoundError as e:
-    print("You don't appear to have slurm available. Exiting!")
-    sys.exit(1)
-
 desc = """Dead Simple Queue v{}
 https://github.com/ycrc/dSQ
 A simple utility for submitting a list of jobs as a job array using sbatch. The job file should specify one independent job you want to run per line. Empty lines or lines that begin with # will be ignored. Without specifying any additional sbatch arguments, some defaults will be set. Once the submission script is generated, you can run it as instructed.
 
 dSQ will output a job_jobid_status.tsv file will contain the following tab-separated columns about your jobs:
-Job_ID, Exit_Code, Hostname, Time_Started, Time_Ended, Time_Elapsed, Job
+Job_ID, Exit_Code, Hostname, Time_Started, Time_Ended, Time_Elapsed, Job, Max_RSS_HWM_KB, CPU_User, CPU_Sys, Blocks_In, Blocks_Out, Cgroup_Mem_Peak_KB, Cgroup_CPU, Time_Elapsed_Mono, Attempt, State
 
 To generate a list of the jobs that didn't run or failed, use dSQAutopsy, or dsqa for short. 
 
+If you save job stats with --status-backend shard or sqlite, run dsq merge jobid to add them to job_jobid_status.tsv.
+
 Run sbatch --help or man sbatch for more slurm options. NOTE: The sbatch arguments you specify are for each individual job in your jobfile, NOT the entire job array.
 
 Some useful sbatch arguments:
@@ -68,7 +95,11 @@ desc = "\n".join([safe_fill(x, term_columns - 1) for x in str.splitlines(desc)])
 
 
 # argument parsing
-def parse_args():
+def _raise_value_error(message):
+    raise ValueError(message)
+
+
+def parse_args(argv=None, exit_on_error=True):
     parser = argparse.ArgumentParser(
         description=desc,
         add_help=False,
@@ -133,7 +164,117 @@ def parse_args():
         "--max-jobs",
         metavar="number",
         nargs=1,
-        help="Maximum number of simultaneously running jobs from the job array.",
+        help="Maximum number of simultaneously running jobs from the job array. If your job file has to be split into several job arrays, they are chained so this stays the limit for all of them.",
+    )
+    optional_dsq.add_argument(
+        "--sweep",
+        action="store_true",
+        help=safe_fill(
+            "Your job file is a sweep spec: a json file with a command and the values of the parameters in it to run every combination of, instead of one job per line. See the README.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--pack",
+        "--tasks-per-job",
+        metavar="K",
+        nargs=1,
+        type=int,
+        dest="pack",
+        help=safe_fill(
+            "Run K lines of your job file in each job of the array, side by side on the cpus requested with -c. Useful for many short jobs.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--exec",
+        action="store_true",
+        help=safe_fill(
+            "Start each job with fork and exec straight from the dSQ wrapper, which then only waits for it and saves its stats. For arrays with one job per array index.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--stage",
+        action="store_true",
+        help=safe_fill(
+            "Copy your job file to node-local storage once per node and have jobs read their lines from there, instead of every job reading it from the shared filesystem.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--stage-dir",
+        metavar="dir",
+        nargs=1,
+        help=safe_fill(
+            "With --stage, the directory on the compute nodes to keep the copy in. Defaults to /dev/shm, then $TMPDIR, then /tmp.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--task-timeout",
+        metavar="time",
+        nargs=1,
+        help=safe_fill(
+            "Stop any job of your job file that runs longer than this many seconds, or [HH:]MM:SS. It and everything it started get SIGTERM, then SIGKILL if they are still running 10 seconds later, and it is saved with exit code 124.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--stall-timeout",
+        metavar="time",
+        nargs=1,
+        help=safe_fill(
+            "Stop any job of your job file whose processes haven't used any cpu or read or written anything for this many seconds, or [HH:]MM:SS, e.g. because it is stuck on a dead network filesystem. It is stopped like with --task-timeout, and saved with exit code 125 and state STALLED.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--retries",
+        metavar="number",
+        nargs=1,
+        type=int,
+        help=safe_fill(
+            "Run a job that failed again, up to this many more times, in the same allocation. Every attempt gets its own line in job_jobid_status.tsv.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--retry-on",
+        metavar="codes",
+        nargs=1,
+        help=safe_fill(
+            "With --retries, only retry jobs that exited with one of these comma separated exit codes, e.g. 75,timeout. timeout means jobs stopped by --task-timeout, and stalled jobs stopped by --stall-timeout. Defaults to any failure.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--retry-delay",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        help=safe_fill(
+            "With --retries, wait this long before the first retry of a job and twice as long before every one after. Defaults to 1.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--dynamic",
+        action="store_true",
+        help=safe_fill(
+            "Instead of running a fixed part of your job file, each job of the array keeps taking the next lines that haven't started yet until none are left. Useful when some jobs take much longer than others.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--workers",
+        metavar="number",
+        nargs=1,
+        type=int,
+        help=safe_fill(
+            "With --dynamic, the number of jobs in the array. Defaults to one per line (or per K lines with --pack).",
+            term_columns - 24,
+        ),
     )
     optional_dsq.add_argument(
         "-o",
@@ -145,6 +286,22 @@ def parse_args():
             term_columns - 24,
         ),
     )
+    optional_dsq.add_argument(
+        "--aggregate-output",
+        action="store_true",
+        help=safe_fill(
+            "Instead of one slurm out file per line in your job file, save the output of all jobs that ran on the same node to one log in job_jobid_logs/. Use dsq logs jobid line to see the output of a job. Slurm out files go to /dev/null unless you set -o.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--trace",
+        action="store_true",
+        help=safe_fill(
+            "Save how long the dSQ wrapper took to start, find, start and wait for each job and save its stats to job_jobid_trace/. Use dsq trace jobid to see where the time went.",
+            term_columns - 24,
+        ),
+    )
     optional_dsq.add_argument(
         "--status-dir",
         metavar="dir",
@@ -156,6 +313,59 @@ def parse_args():
         action="store_true",
         help="Don't save job stats to job_jobid_status.tsv",
     )
+    optional_dsq.add_argument(
+        "--chain",
+        action="store_true",
+        help=safe_fill(
+            "If your job file has to be split into several job arrays, start each one only after the previous one has finished. Always done with --max-jobs.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--status-backend",
+        nargs=1,
+        choices=STATUS_BACKENDS,
+        help=safe_fill(
+            "How to save job stats. tsv (default) appends to job_jobid_status.tsv. shard appends to a file of its own in every job of the array and sqlite saves to a database, both avoid many jobs writing to the same file at once. Run dsq merge jobid to turn them into job_jobid_status.tsv.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--resume-from",
+        metavar="job_jobid_status.tsv",
+        nargs="+",
+        help=safe_fill(
+            "Only submit the jobs that didn't finish with exit code 0 according to these status files from previous runs of this job file.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--order-by-history",
+        metavar="job_jobid_status.tsv",
+        nargs="+",
+        help=safe_fill(
+            "Start the jobs that took longest in these status files from earlier runs first, so they don't hold up the end of the array. With --pack, lines are spread so each job has about the same amount of work.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--cache",
+        metavar="dir",
+        nargs=1,
+        help=safe_fill(
+            "Remember every job that succeeds in this cache directory, and leave out jobs that already succeeded with the same command and inputs. Declare the input files of a job at the end of its line with # dsq-inputs: file1 file2. See the README.",
+            term_columns - 24,
+        ),
+    )
+    optional_dsq.add_argument(
+        "--cache-by",
+        nargs=1,
+        choices=CACHE_BY,
+        help=safe_fill(
+            "With --cache, tell if inputs changed by their size and modification time (stat, the default) or by reading them (content).",
+            term_columns - 24,
+        ),
+    )
     optional_dsq.add_argument("--stdout", action="store_true", help=argparse.SUPPRESS)
     optional_dsq.add_argument(
         "--submit",
@@ -164,25 +374,211 @@ def parse_args():
     )
     # silently allow overriding --array, otherwise we calculate that
     optional_dsq.add_argument("-a", "--array", nargs=1, help=argparse.SUPPRESS)
-    return parser.parse_known_args()
+    if not exit_on_error:
+        # the python api raises instead of printing usage and exiting
+        parser.error = _raise_value_error
+    return parser.parse_known_args(argv)
+
+
+# MaxArraySize and MaxJobCount, only looked up when we need them
+def get_slurm_limits():
+    try:
+        limits = slurm_limits()
+    except OSError:
+        raise RuntimeError("You don't appear to have slurm available. Exiting!")
+    except (CalledProcessError, KeyError, ValueError):
+        raise RuntimeError(
+            "Couldn't read MaxArraySize and MaxJobCount from scontrol show conf. You can set them with DSQ_MAX_ARRAY_SIZE and DSQ_MAX_JOB_COUNT."
+        )
+    return limits["MaxArraySize"], limits["MaxJobCount"]
 
 
 # helper functions for array range formatting
 # collapse job numbers in job file to ranges
 def _collapse_ranges(jobnums):
-    # takes a list of numbers, returns tuples of numbers that specify representative ranges
-    # inclusive
-    for i, t in itertools.groupby(enumerate(jobnums), lambda tx: tx[1] - tx[0]):
-        t = list(t)
-        yield t[0][1], t[-1][1]
+    # takes a sorted list of numbers, returns (first, last, step) tuples that
+    # specify representative ranges, inclusive. evenly spaced numbers, like every
+    # other index of a rerun, become one range with a step
+    if isinstance(jobnums, range):
+        if len(jobnums) > 0:
+            yield jobnums[0], jobnums[-1], jobnums.step
+        return
+    first = None
+    for n in jobnums:
+        if first is None:
+            first, last, step, count = n, n, 1, 1
+        elif count == 1:
+            last, step, count = n, n - first, 2
+        elif n - last == step:
+            last, count = n, count + 1
+        elif count == 2 and step > 1:
+            # a,b,c is shorter than a-b:s,c, so only start a stepped range with
+            # the second number of this one
+            yield first, first, 1
+            first, last, step = last, n, n - last
+        else:
+            yield first, last, step
+            first, last, step, count = n, n, 1, 1
+    if first is None:
+        return
+    if count == 2 and step > 1:
+        yield first, first, 1
+        yield last, last, 1
+    else:
+        yield first, last, step
+
+
+def _format_range_token(first, last, step):
+    if first == last:
+        return str(first)
+    elif step == 1:
+        return "{}-{}".format(first, last)
+    return "{}-{}:{}".format(first, last, step)
 
 
 # format job ranges
 def format_range(jobnums):
-    ranges = list(_collapse_ranges(jobnums))
-    return ",".join(
-        ["{}-{}".format(x[0], x[1]) if x[0] != x[1] else str(x[0]) for x in ranges]
-    )
+    return ",".join(_format_range_token(*x) for x in _collapse_ranges(jobnums))
+
+
+def _split_long_range(offset, task_ids, max_range_length):
+    # split the array indices of one job array so that each part's --array string
+    # is at most max_range_length long (or one range, if that is longer)
+    parts = []
+    length = 0
+    for first, last, step in _collapse_ranges(task_ids):
+        token_length = len(_format_range_token(first, last, step)) + 1
+        if len(parts) == 0 or length + token_length > max_range_length + 1:
+            parts.append((offset + first, []))
+            length = 0
+        length += token_length
+        start = offset + first - parts[-1][0]
+        parts[-1][1].extend(range(start, start + last - first + 1, step))
+    return parts
+
+
+# split array indices that don't fit in one job array
+def split_array(task_ids, max_array_size, max_job_count, max_range_length=None):
+    # takes a sorted list of array indices, returns tuples of an offset and the
+    # indices relative to it, each small enough to submit as one job array
+    if isinstance(task_ids, range) and task_ids.step == 1:
+        # consecutive indices, e.g. from a sweep, can be split without a loop
+        part_size = min(max_array_size, max_job_count)
+        return [
+            (offset, range(min(part_size, task_ids.stop - offset)))
+            for offset in range(task_ids.start, task_ids.stop, part_size)
+        ]
+    parts = []
+    for task_id in task_ids:
+        if (
+            len(parts) == 0
+            or task_id - parts[-1][0] >= max_array_size
+            or len(parts[-1][1]) >= max_job_count
+        ):
+            parts.append((task_id, []))
+        parts[-1][1].append(task_id - parts[-1][0])
+    if max_range_length is not None:
+        parts = [
+            part
+            for offset, part_ids in parts
+            for part in _split_long_range(offset, part_ids, max_range_length)
+        ]
+    return parts
+
+
+# order the lines so the ones expected to take longest start first
+def order_by_history(job_file_name, line_nums, elapsed, pack):
+    # predict each line's run time from earlier runs of the same command. lines
+    # we haven't seen before are expected to take as long as the typical one
+    wanted = set(line_nums)
+    predicted = {}
+    with open_job_file(job_file_name, "rt") as job_file:
+        for i, line in enumerate(job_file):
+            if i in wanted:
+                predicted[i] = elapsed.get(command_key(line))
+    known = sorted(t for t in predicted.values() if t is not None)
+    typical = known[len(known) // 2] if len(known) > 0 else 0
+    costs = [typical if predicted[i] is None else predicted[i] for i in line_nums]
+    # longest first, sorted() keeps file order among equals
+    order = sorted(range(len(line_nums)), key=lambda j: -costs[j])
+    if pack == 1:
+        return [line_nums[j] for j in order]
+    # give each line, longest first, to the chunk with the least work that still
+    # has room, then run the chunks with the most work first. chunks that end up
+    # short a line are padded
+    num_chunks = (len(line_nums) + pack - 1) // pack
+    chunks = [[] for c in range(num_chunks)]
+    loads = [0] * num_chunks
+    heap = [(0, c) for c in range(num_chunks)]
+    for j in order:
+        load, c = heapq.heappop(heap)
+        chunks[c].append(line_nums[j])
+        loads[c] = load + costs[j]
+        if len(chunks[c]) < pack:
+            heapq.heappush(heap, (loads[c], c))
+    line_map = []
+    for c in sorted(range(num_chunks), key=lambda c: -loads[c]):
+        line_map.extend(chunks[c] + [MAP_NO_LINE] * (pack - len(chunks[c])))
+    return line_map
+
+
+# seconds in a time given as seconds or [HH:]MM:SS
+def parse_duration(duration):
+    seconds = 0.0
+    for part in duration.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+# dSQBatch options for --task-timeout, --stall-timeout and --retries
+def retry_opts(args):
+    opts = []
+    for option, value in [
+        ("--task-timeout", args.task_timeout),
+        ("--stall-timeout", args.stall_timeout),
+    ]:
+        if value is None:
+            continue
+        try:
+            timeout = parse_duration(value[0])
+        except ValueError:
+            timeout = 0
+        if timeout <= 0 or value[0].count(":") > 2:
+            raise ValueError(
+                "{} should be a number of seconds or [HH:]MM:SS.".format(option)
+            )
+        opts.append("{} {:g}".format(option, timeout))
+    if args.retries is None:
+        if args.retry_on is not None or args.retry_delay is not None:
+            raise ValueError("--retry-on and --retry-delay need --retries.")
+        return opts
+    if args.retries[0] < 0:
+        raise ValueError("--retries can't be negative.")
+    opts.append("--retries {}".format(args.retries[0]))
+    if args.retry_on is not None:
+        codes = [c.strip().lower() for c in args.retry_on[0].split(",")]
+        if not all(
+            c in ["timeout", "stalled"] or c.lstrip("-").isdigit() for c in codes
+        ):
+            raise ValueError(
+                "--retry-on should be comma separated exit codes, timeout or stalled."
+            )
+        opts.append("--retry-on {}".format(",".join(codes)))
+    if args.retry_delay is not None:
+        if args.retry_delay[0] < 0:
+            raise ValueError("--retry-delay can't be negative.")
+        opts.append("--retry-delay {:g}".format(args.retry_delay[0]))
+    return opts
+
+
+# job file lines of commands whose job already succeeded according to the cache
+def cached_lines(cache_dir, commands, cache_by):
+    by = CACHE_BY[0] if cache_by is None else cache_by[0]
+    keys = dict((i, job_key(cmd, by)) for i, cmd in commands.items() if cmd != "")
+    found = find_cached(cache_dir, list(keys.values()))
+    # they were just used, so keep them in the cache
+    record_jobs(cache_dir, os.uname()[1], list(found))
+    return [i for i, key in keys.items() if key in found]
 
 
 def handle_user_slurm_args(arg_list):
@@ -202,12 +598,34 @@ def handle_user_slurm_args(arg_list):
 def get_job_info(args, user_slurm_args):
     # organize job info into a dict
     job_info = {}
-    job_info["max_array_size"] = max_array_size
     job_info["max_jobs"] = args.max_jobs
     job_info["num_jobs"] = 0
     job_info["job_id_list"] = []
+    job_info["pack"] = 1 if args.pack is None else args.pack[0]
+    job_info["run_opts"] = []
+    if job_info["pack"] < 1:
+        raise ValueError("--pack must be at least 1.")
+    elif job_info["pack"] > 1:
+        job_info["run_opts"].append("--pack {}".format(job_info["pack"]))
+    if args.sweep and args.order_by_history is not None:
+        raise ValueError("--order-by-history doesn't work with --sweep.")
+    if args.cache is not None:
+        job_info["cache_dir"] = path.abspath(args.cache[0])
+        try:
+            if not path.isdir(job_info["cache_dir"]):
+                os.makedirs(job_info["cache_dir"])
+        except OSError as e:
+            raise RuntimeError("Could not make cache directory: {}".format(e))
+        job_info["run_opts"].append("--cache {}".format(job_info["cache_dir"]))
+        if args.cache_by is not None:
+            job_info["run_opts"].append("--cache-by {}".format(args.cache_by[0]))
+    elif args.cache_by is not None:
+        raise ValueError("--cache-by needs --cache.")
+    if args.workers is not None and (not args.dynamic or args.workers[0] < 1):
+        raise ValueError("--workers needs --dynamic and must be at least 1.")
+    # next to this file, which isn't sys.argv[0] when dSQ is imported
     job_info["run_script"] = path.join(
-        path.dirname(path.abspath(sys.argv[0])), "dSQBatch.py"
+        path.dirname(path.abspath(__file__)), "dSQBatch.py"
     )
     job_info["job_file_name"] = path.abspath(args.job_file[0].name)
     job_info["job_file_arg"] = "--job-file {}".format(job_info["job_file_name"])
@@ -220,39 +638,161 @@ def get_job_info(args, user_slurm_args):
 
     # allow explicit setting of --array
     if args.array is not None:
-        job_info["array_range"] = args.array
+        job_info["array_range"] = args.array[0]
         job_info["array_fmt_width"] = 2
         job_info["num_jobs"] = 1
+        job_info["parts"] = [{"offset": 0, "array_range": job_info["array_range"]}]
     else:
-        # otherwise set it based on job file
-        for i, line in enumerate(args.job_file[0]):
-            if not (line.startswith("#") or line.rstrip() == ""):
-                job_info["job_id_list"].append(i)
-                job_info["num_jobs"] += 1
-        job_info["max_array_idx"] = job_info["job_id_list"][-1]
-        job_info["array_range"] = format_range(job_info["job_id_list"])
-
-        # quit if we have too many array jobs
-        if job_info["max_array_idx"] > job_info["max_array_size"]:
-            print(
-                safe_fill(
-                    "Your job file would result in a job array with a maximum index of {max_array_idx}. This exceeds allowed array size of {max_array_size}. Split the jobs into chunks that are smaller than {max_array_size}, or do more per job.".format(
-                        **job_info
+        # otherwise set it based on job file, indexing line offsets for dSQBatch
+        sweep = None
+        if args.sweep:
+            # every line of a sweep is a job, no need to read through it
+            try:
+                sweep = load_sweep(job_info["job_file_name"])
+            except (IOError, OSError, ValueError) as e:
+                raise ValueError("Could not read sweep: {}".format(e))
+            job_info["job_id_list"] = range(sweep_size(sweep))
+            job_info["run_opts"].append("--sweep")
+        else:
+            try:
+                job_info["job_id_list"] = scan_job_file(job_info["job_file_name"])
+            except ValueError as e:
+                raise ValueError("Could not read job file: {}".format(e))
+        job_info["num_jobs"] = len(job_info["job_id_list"])
+        # make sure there are jobs to submit
+        if job_info["num_jobs"] == 0:
+            raise ValueError("No jobs found in {job_file_name}".format(**job_info))
+        positions = job_info["job_id_list"]
+        map_lines = None
+        if args.resume_from is not None or args.cache is not None:
+            # leave out the jobs that already succeeded
+            succeeded = bytearray()
+            if args.resume_from is not None:
+                succeeded = succeeded_lines(args.resume_from)
+            if args.cache is not None:
+                if sweep is not None:
+                    commands = sweep_lines(sweep, job_info["job_id_list"])
+                else:
+                    commands = read_lines(
+                        job_info["job_file_name"], job_info["job_id_list"]
+                    )
+                for i in cached_lines(job_info["cache_dir"], commands, args.cache_by):
+                    if i >= len(succeeded):
+                        succeeded.extend(bytearray(i + 1 - len(succeeded)))
+                    succeeded[i] = 1
+            job_info["job_id_list"] = [
+                i
+                for i in job_info["job_id_list"]
+                if i >= len(succeeded) or succeeded[i] == 0
+            ]
+            if len(job_info["job_id_list"]) == 0:
+                # nothing to submit
+                job_info["num_jobs"] = 0
+                job_info["parts"] = []
+                return job_info
+            skipped = len(job_info["job_id_list"]) < job_info["num_jobs"]
+            positions = job_info["job_id_list"]
+            if (job_info["pack"] > 1 or args.dynamic) and skipped:
+                # packed and dynamic jobs run consecutive entries of a map of the
+                # lines left
+                map_lines = positions
+            job_info["num_jobs"] = len(job_info["job_id_list"])
+        if args.order_by_history is not None:
+            map_lines = order_by_history(
+                job_info["job_file_name"],
+                job_info["job_id_list"],
+                elapsed_by_command(args.order_by_history),
+                job_info["pack"],
+            )
+        if map_lines is not None:
+            # array indices run the lines in this map instead of by line number.
+            # job files with the same name can be submitted in the same second,
+            # so every map gets a name of its own
+            map_dir = path.abspath(
+                "./" if args.status_dir is None else args.status_dir[0]
+            )
+            map_prefix = "dsq-{}-{}-".format(
+                job_info["job_file_no_ext"], datetime.now().strftime("%Y-%m-%d-%H%M%S")
+            )
+            try:
+                map_fd, job_info["line_map"] = tempfile.mkstemp(
+                    suffix=".map", prefix=map_prefix, dir=map_dir
+                )
+                os.close(map_fd)
+                write_line_map(job_info["line_map"], map_lines)
+            except (IOError, OSError) as e:
+                raise RuntimeError("Could not save line map: {}".format(e))
+            if args.stdout:
+                # the printed script needs it too, say where it is
+                print(
+                    "Saved the line map this script runs from to {}".format(
+                        job_info["line_map"]
                     ),
-                    term_columns - 1,
+                    file=sys.stderr,
                 )
+            job_info["run_opts"].append("--line-map {}".format(job_info["line_map"]))
+            positions = range(len(map_lines))
+        # each array index runs the jobs at positions idx*pack to idx*pack+pack-1
+        if isinstance(positions, range):
+            job_info["task_id_list"] = range(
+                positions[0] // job_info["pack"],
+                positions[-1] // job_info["pack"] + 1,
             )
-            sys.exit(1)
-        job_info["array_fmt_width"] = len(str(job_info["max_array_idx"]))
+        else:
+            job_info["task_id_list"] = [
+                k
+                for k, _ in itertools.groupby(i // job_info["pack"] for i in positions)
+            ]
+        if args.dynamic:
+            # the array is made of workers that pull those chunks from a queue
+            job_info["num_chunks"] = job_info["task_id_list"][-1] + 1
+            job_info["run_opts"].append("--dynamic {num_chunks}".format(**job_info))
+            num_workers = len(job_info["task_id_list"])
+            if args.workers is not None:
+                num_workers = min(args.workers[0], num_workers)
+            job_info["task_id_list"] = range(num_workers)
+        # for dsq watch and dsq throttle, which can't tell from the job file
+        job_info["run_opts"].append("--num-jobs {num_jobs}".format(**job_info))
+        job_info["max_array_idx"] = job_info["task_id_list"][-1]
+        job_info["array_range"] = format_range(job_info["task_id_list"])
+        job_info["parts"] = [{"offset": 0, "array_range": job_info["array_range"]}]
 
-    # make sure there are jobs to submit
-    if job_info["num_jobs"] == 0:
-        print("No jobs found in {job_file_name}".format(**job_info), file=sys.stderr)
-        sys.exit(1)
+        # split into several job arrays if we have too many array jobs
+        job_info["max_array_size"], job_info["max_job_count"] = get_slurm_limits()
+        try:
+            max_array_string = int(
+                os.environ.get("DSQ_MAX_ARRAY_STRING", MAX_ARRAY_STRING)
+            )
+        except ValueError:
+            raise ValueError("DSQ_MAX_ARRAY_STRING must be a number.")
+        if (
+            job_info["max_array_idx"] >= job_info["max_array_size"]
+            or len(job_info["task_id_list"]) > job_info["max_job_count"]
+            or len(job_info["array_range"]) > max_array_string
+        ):
+            job_info["parts"] = [
+                {
+                    "offset": offset,
+                    "array_range": format_range(task_ids),
+                    "max_array_idx": task_ids[-1],
+                }
+                for offset, task_ids in split_array(
+                    job_info["task_id_list"],
+                    job_info["max_array_size"],
+                    job_info["max_job_count"],
+                    max_array_string,
+                )
+            ]
+            job_info["max_array_idx"] = max(
+                part["max_array_idx"] for part in job_info["parts"]
+            )
+        job_info["array_fmt_width"] = len(str(job_info["max_array_idx"]))
 
     # set output file format
     if args.output is not None:
         job_info["slurm_args"]["--output"] = args.output[0]
+    elif args.aggregate_output:
+        job_info["slurm_args"]["--output"] = "/dev/null"
     else:
         job_info["slurm_args"][
             "--output"
@@ -267,14 +807,37 @@ def get_job_info(args, user_slurm_args):
         else:
             job_info["status_dir"] = path.abspath("./")
         if not os.access(job_info["status_dir"], os.W_OK | os.X_OK):
-            print(
+            raise ValueError(
                 "{status_dir} does not appear to be a writeable directory.".format(
                     **job_info
-                ),
-                file=sys.stderr,
+                )
             )
-            sys.exit(1)
         job_info["status_dir_arg"] = "--status-dir {}".format(job_info["status_dir"])
+        if args.status_backend is not None and args.status_backend[0] != "tsv":
+            job_info["run_opts"].append(
+                "--status-backend {}".format(args.status_backend[0])
+            )
+
+    if args.aggregate_output:
+        job_info["run_opts"].append("--aggregate-output")
+    if args.exec:
+        job_info["run_opts"].append("--exec")
+    if args.trace:
+        job_info["run_opts"].append("--trace")
+    if args.stage_dir is not None:
+        job_info["run_opts"].append("--stage --stage-dir {}".format(args.stage_dir[0]))
+    elif args.stage:
+        job_info["run_opts"].append("--stage")
+    job_info["run_opts"] += retry_opts(args)
+
+    job_info["run_cmd"] = " ".join(
+        [
+            job_info["run_script"],
+            job_info["job_file_arg"],
+            job_info["status_dir_arg"],
+        ]
+        + job_info["run_opts"]
+    )
 
     # set array range string
     if job_info["max_jobs"] == None:
@@ -292,24 +855,147 @@ def get_job_info(args, user_slurm_args):
         job_info["slurm_args"]["--job-name"] = "dsq-{job_file_no_ext}".format(
             **job_info
         )
+
+    # every array would get its own %max_jobs, so arrays running side by side
+    # would run more jobs at once than asked for. run them one after the other
+    job_info["chain"] = args.chain or (
+        job_info["max_jobs"] is not None and len(job_info["parts"]) > 1
+    )
+
+    # each job array gets the same slurm arguments, apart from its range
+    for part in job_info["parts"]:
+        part["slurm_args"] = dict(job_info["slurm_args"])
+        if job_info["max_jobs"] == None:
+            part["slurm_args"]["--array"] = part["array_range"]
+        else:
+            part["slurm_args"]["--array"] = "{}%{}".format(
+                part["array_range"], job_info["max_jobs"]
+            )
     return job_info
 
 
-def submit_or_print_job(job_info, submit, stdout):
-    # submit or print the job script
-    if submit:
+def format_batch_script(slurm_args, user_slurm_args, run_cmd):
+    batch_script = ["#!/bin/bash"]
+    for option, value in slurm_args.items():
+        batch_script.append("#SBATCH {} {}".format(option, value))
+    if len(user_slurm_args) > 0:
+        batch_script.append("#SBATCH {}".format(user_slurm_args))
+    batch_script.append("\n# DO NOT EDIT LINE BELOW")
+    batch_script.append("{}\n".format(run_cmd))
+    return "\n".join(batch_script)
 
-        job_info["cli_args"] = ""
 
-        for option, value in job_info["slurm_args"].items():
-            job_info["cli_args"] += " %s=%s" % (option, value)
+def format_part_run_cmd(job_info, part, run_id):
+    # arrays after the first offset their indices and report to the first one's
+    # status file, so they all look like one run
+    run_cmd = "{} --index-offset {}".format(job_info["run_cmd"], part["offset"])
+    if run_id is not None:
+        run_cmd += " --run-id {}".format(run_id)
+    return run_cmd
 
-        cmd = "sbatch {cli_args} {user_slurm_args} {run_script} {job_file_arg} {status_dir_arg}".format(
-            **job_info
+
+def sbatch_argv(job_info, part, run_id=None, dependency=None):
+    # the sbatch command for one job array, as a list so no shell is needed
+    argv = ["sbatch", "--parsable"]
+    for option, value in part["slurm_args"].items():
+        argv.append("{}={}".format(option, value))
+    if dependency is not None:
+        argv.append("--dependency=afterany:{}".format(dependency))
+    argv += shlex.split(job_info["user_slurm_args"])
+    if len(job_info["parts"]) > 1:
+        argv += shlex.split(format_part_run_cmd(job_info, part, run_id))
+    else:
+        argv += shlex.split(job_info["run_cmd"])
+    return argv
+
+
+def submit_job(job_info, chain=False, log=None, throttle=None):
+    # submit each job array in turn, passing the first one's job id on to the
+    # rest, and return their job ids. log is called with what is going on, and
+    # throttle before every call to sbatch. raises CalledProcessError if sbatch
+    # fails
+    chain = chain or job_info.get("chain", False)
+    job_ids = []
+    for part in job_info["parts"]:
+        dependency = job_ids[-1] if chain and len(job_ids) > 0 else None
+        argv = sbatch_argv(
+            job_info, part, job_ids[0] if len(job_ids) > 0 else None, dependency
         )
-        print("submitting:\n {}".format(cmd))
-        ret = call(cmd, shell=True)
-        sys.exit(ret)
+        if log is not None:
+            log("submitting:\n {}".format(" ".join(shlex.quote(a) for a in argv)))
+        if throttle is not None:
+            throttle()
+        job_id = check_output(argv, universal_newlines=True)
+        job_ids.append(job_id.strip().split(";")[0])
+        if log is not None:
+            log("Submitted batch job {}".format(job_ids[-1]))
+    return job_ids
+
+
+def format_parts_script(job_info, chain):
+    # a bash script that submits each job array with sbatch, passing the first
+    # one's job id on to the rest
+    chain = chain or job_info.get("chain", False)
+    run_id_var = "@DSQ_RUN_ID@"
+    parts_script = [
+        "#!/bin/bash",
+        "# Your jobs were split into {} job arrays to stay within this cluster's limits.".format(
+            len(job_info["parts"])
+        ),
+        "# Run this script with bash (not sbatch) to submit all of them.",
+        "set -e",
+        "DSQ_RUN_ID=",
+        "DSQ_LAST_ID=",
+    ]
+    for i, part in enumerate(job_info["parts"]):
+        batch_script = format_batch_script(
+            part["slurm_args"],
+            job_info["user_slurm_args"],
+            format_part_run_cmd(job_info, part, None if i == 0 else run_id_var),
+        )
+        # escape the batch script so the shell only fills in the run id
+        for char in ["\\", "$", "`"]:
+            batch_script = batch_script.replace(char, "\\" + char)
+        batch_script = batch_script.replace(run_id_var, "${DSQ_RUN_ID}")
+        dependency = ""
+        if chain and i > 0:
+            dependency = " --dependency=afterany:${DSQ_LAST_ID}"
+        parts_script += [
+            "",
+            "# job array {} of {}".format(i + 1, len(job_info["parts"])),
+            "DSQ_LAST_ID=$(sbatch --parsable{} <<DSQ_BATCH_SCRIPT".format(dependency),
+            batch_script,
+            "DSQ_BATCH_SCRIPT",
+            ")",
+            "DSQ_LAST_ID=${DSQ_LAST_ID%%;*}",
+            "DSQ_RUN_ID=${DSQ_RUN_ID:-$DSQ_LAST_ID}",
+            'echo "Submitted batch job ${DSQ_LAST_ID}"',
+        ]
+    parts_script += [
+        "",
+        'echo "All job arrays will save their job stats to job_${DSQ_RUN_ID}_status.tsv. Check on them with: dsqa -j ${DSQ_RUN_ID}"',
+        "",
+    ]
+    return "\n".join(parts_script)
+
+
+def submit_or_print_job(job_info, submit, stdout, chain=False, batch_file=None):
+    # submit or print the job script
+    if submit:
+        try:
+            job_ids = submit_job(job_info, chain, log=print)
+        except CalledProcessError as e:
+            sys.exit(e.returncode)
+        if len(job_ids) > 1:
+            print(
+                safe_fill(
+                    "Your jobs were split into {} job arrays, which will all save their job stats to job_{}_status.tsv. Check on all of them with: dsqa -j {}".format(
+                        len(job_ids), job_ids[0], job_ids[0]
+                    ),
+                    term_columns - 1,
+                )
+            )
+        sys.exit(0)
 
     else:
         # set batch script name
@@ -317,8 +1003,8 @@ def submit_or_print_job(job_info, submit, stdout):
             job_info["batch_script_out"] = sys.stdout
         else:
             try:
-                if args.batch_file is not None:
-                    job_info["batch_script_out"] = open(args.batch_file[0], "w")
+                if batch_file is not None:
+                    job_info["batch_script_out"] = open(batch_file[0], "w")
                 else:
                     job_info["batch_script_out"] = open(
                         "dsq-{job_file_no_ext}-{today}.sh".format(**job_info), "w"
@@ -331,33 +1017,613 @@ def submit_or_print_job(job_info, submit, stdout):
                     e,
                 )
 
-        print("#!/bin/bash", file=job_info["batch_script_out"])
-        for option, value in job_info["slurm_args"].items():
+        if len(job_info["parts"]) > 1:
             print(
-                "#SBATCH {} {}".format(option, value), file=job_info["batch_script_out"]
+                format_parts_script(job_info, chain),
+                file=job_info["batch_script_out"],
             )
-        if len(job_info["user_slurm_args"]) > 0:
+            submit_cmd = "bash"
+        else:
             print(
-                "#SBATCH {user_slurm_args}".format(**job_info),
+                format_batch_script(
+                    job_info["slurm_args"],
+                    job_info["user_slurm_args"],
+                    job_info["run_cmd"],
+                ),
                 file=job_info["batch_script_out"],
             )
+            submit_cmd = "sbatch"
+        if not stdout:
+            print(
+                "Batch script generated. To submit your jobs, run:\n {} {}".format(
+                    submit_cmd, job_info["batch_script_out"].name
+                )
+            )
+
+
+# using dSQ from python: import dSQ, then
+#
+#   job_info = dSQ.prepare_job(
+#       ("./align {}".format(s) for s in samples),
+#       "align.txt",
+#       ["--pack", "4", "-t", "1:00:00"],
+#   )
+#   job_ids = dSQ.submit_job(job_info)
+#
+# the arguments are the same as dsq's. instead of printing what is wrong and
+# exiting like dsq, these raise ValueError for bad arguments or job files and
+# RuntimeError if slurm or the filesystem get in the way. submit_job raises
+# CalledProcessError if sbatch fails. if all the jobs already succeeded, the job
+# info has no parts and submit_job submits nothing
+def write_job_file(job_file_name, commands):
+    # save an iterable of commands as a job file, one per line
+    with open(job_file_name, "w") as job_file:
+        for command in commands:
+            if "\n" in command:
+                raise ValueError("A job can't span lines: {!r}".format(command))
+            job_file.write(command + "\n")
+
+
+def build_job_info(argv):
+    # the job info dsq would submit for this command line
+    args, user_slurm_args = parse_args(argv, exit_on_error=False)
+    try:
+        return get_job_info(args, user_slurm_args)
+    finally:
+        args.job_file[0].close()
+
+
+def prepare_job(commands, job_file_name, argv=()):
+    # write commands to job_file_name and return the job info to submit them
+    write_job_file(job_file_name, commands)
+    return build_job_info(["--job-file", job_file_name] + list(argv))
+
+
+class RateLimit(object):
+    # makes callers wait so that no more than per_second of them get through a
+    # second, across threads
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            now = time.time()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def submit_job_files(job_file_names, argv=(), parallel=1, per_second=None, log=None):
+    # submit many job files with the same dsq arguments, running up to parallel
+    # sbatch at once and starting at most per_second of them a second. returns
+    # the job ids of each job file, or the exception that stopped it
+    from concurrent.futures import ThreadPoolExecutor
+
+    throttle = None if per_second is None else RateLimit(per_second)
+    chain = "--chain" in argv
+    results = [None] * len(job_file_names)
+    job_infos = []
+    # slurm's limits are looked up for the first job file and reused after
+    for i, job_file_name in enumerate(job_file_names):
+        try:
+            job_infos.append(
+                (i, build_job_info(["--job-file", job_file_name] + list(argv)))
+            )
+        except Exception as e:
+            results[i] = e
+
+    def submit(job_info):
+        return submit_job(job_info, chain, log, throttle)
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [(i, pool.submit(submit, job_info)) for i, job_info in job_infos]
+        for i, future in futures:
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+    return results
+
+
+def parse_merge_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Add job stats saved with --status-backend shard or sqlite to job_jobid_status.tsv.",
+        usage="%(prog)s merge jobid [--status-dir dir]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_id", metavar="jobid", help="Job ID of your dSQ array.")
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job stats were saved to. Defaults to working directory.",
+    )
+    return parser.parse_args(argv)
+
+
+def merge_main(argv):
+    merge_args = parse_merge_args(argv)
+    num_merged = merge_status(merge_args.status_dir[0], merge_args.job_id)
+    print(
+        "Added {} jobs to {}".format(
+            num_merged,
+            path.join(
+                merge_args.status_dir[0],
+                "job_{}_status.tsv".format(merge_args.job_id),
+            ),
+        )
+    )
+
+
+def parse_logs_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Print the output of one job saved with --aggregate-output. stdout goes to stdout and stderr to stderr.",
+        usage="%(prog)s logs jobid line [--attempt N] [--status-dir dir]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_id", metavar="jobid", help="Job ID of your dSQ array.")
+    parser.add_argument(
+        "line",
+        type=int,
+        help="Zero-indexed line of the job in your job file, as in job_jobid_status.tsv.",
+    )
+    parser.add_argument(
+        "--attempt",
+        metavar="N",
+        nargs=1,
+        type=int,
+        help="Only print the output of this attempt at the job, as in the Attempt column of job_jobid_status.tsv. Defaults to every attempt, one after the other.",
+    )
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job_jobid_logs directory was saved to. Defaults to working directory.",
+    )
+    return parser.parse_args(argv)
+
+
+def logs_main(argv):
+    logs_args = parse_logs_args(argv)
+    attempt = None if logs_args.attempt is None else logs_args.attempt[0]
+    found = False
+    last_attempt = None
+    for record_attempt, stream, data in iter_task_output(
+        logs_args.status_dir[0], logs_args.job_id, logs_args.line, attempt
+    ):
+        found = True
+        if attempt is None and record_attempt != last_attempt:
+            # say where each retry starts, on stderr to keep stdout the job's
+            print("[dSQ]: attempt {}".format(record_attempt), file=sys.stderr)
+            sys.stderr.flush()
+            last_attempt = record_attempt
+        out = sys.stdout if stream == LOG_STDOUT else sys.stderr
+        out = getattr(out, "buffer", out)
+        out.write(data)
+        out.flush()
+    if not found:
+        print(
+            "No output saved for line {} of job {}{}.".format(
+                logs_args.line,
+                logs_args.job_id,
+                "" if attempt is None else ", attempt {}".format(attempt),
+            ),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def parse_watch_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Follow the progress of a dSQ array from its status file, reading only what was added since the last refresh.",
+        usage="%(prog)s watch jobid [--status-dir dir] [--job-file jobfile.txt] [--interval seconds] [--json] [--once]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_id", metavar="jobid", help="Job ID of your dSQ array.")
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job stats were saved to. Defaults to working directory.",
+    )
+    parser.add_argument(
+        "--job-file",
+        metavar="jobfile.txt",
+        nargs=1,
+        help="Count the jobs left for the ETA from every line of this job file, instead of from the number of jobs dsq submitted. Only needed for arrays submitted with --array.",
+    )
+    parser.add_argument(
+        "--interval",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        default=[5],
+        help="Seconds between refreshes. Default: 5",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print one line of json per refresh instead of a summary.",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="Print the progress once and exit."
+    )
+    return parser.parse_args(argv)
+
+
+def job_file_total_jobs(job_file):
+    # the jobs in a --job-file given to dsq watch or dsq throttle. without one
+    # they use the number of jobs dsq submitted
+    if job_file is None:
+        return None
+    try:
+        return count_jobs(job_file[0])
+    except (IOError, OSError) as e:
+        print("Could not open {}.".format(job_file[0]), file=sys.stderr)
+        sys.exit(1)
+
+
+def watch_main(argv):
+    watch_args = parse_watch_args(argv)
+    status_dir = watch_args.status_dir[0]
+    state = new_watch_state(job_file_total_jobs(watch_args.job_file))
+    while True:
+        find_total_jobs(state, status_dir, watch_args.job_id)
+        read_new_status(state, status_dir, watch_args.job_id)
+        summary = summarize(state)
+        if watch_args.json:
+            summary["job_id"] = watch_args.job_id
+            print(json.dumps(summary, sort_keys=True))
+        else:
+            if sys.stdout.isatty() and not watch_args.once:
+                # redraw in place
+                sys.stdout.write("\033[H\033[J")
+            print(format_summary(watch_args.job_id, summary))
+        sys.stdout.flush()
+        if watch_args.once or summary["remaining"] == 0:
+            break
+        time.sleep(watch_args.interval[0])
+
+
+def parse_cache_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Fold the jobs dSQ recorded in a --cache directory into its index, and forget the ones that haven't succeeded or been skipped for a while.",
+        usage="%(prog)s cache evict dir [--older-than days] [--max-entries number]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("action", choices=["evict"])
+    parser.add_argument("cache_dir", metavar="dir", help="The --cache directory.")
+    parser.add_argument(
+        "--older-than",
+        metavar="days",
+        nargs=1,
+        type=float,
+        help="Forget jobs last used more than this many days ago.",
+    )
+    parser.add_argument(
+        "--max-entries",
+        metavar="number",
+        nargs=1,
+        type=int,
+        help="Only keep this many of the most recently used jobs.",
+    )
+    return parser.parse_args(argv)
+
+
+def cache_main(argv):
+    cache_args = parse_cache_args(argv)
+    if not path.isdir(cache_args.cache_dir):
+        print("{} is not a directory.".format(cache_args.cache_dir), file=sys.stderr)
+        sys.exit(1)
+    max_age = None
+    if cache_args.older_than is not None:
+        max_age = int(cache_args.older_than[0] * 86400)
+    max_entries = None
+    if cache_args.max_entries is not None:
+        max_entries = cache_args.max_entries[0]
+    kept, dropped = compact_cache(cache_args.cache_dir, max_age, max_entries)
+    print("Kept {} jobs in {}, forgot {}.".format(kept, cache_args.cache_dir, dropped))
+
+
+def parse_bulk_args(argv):
+    # everything after -- goes to dsq for every job file
+    dsq_argv = []
+    if "--" in argv:
+        dsq_argv = argv[argv.index("--") + 1 :]
+        argv = argv[: argv.index("--")]
+    parser = argparse.ArgumentParser(
+        description="Submit many job files at once, with the same dSQ and slurm arguments. Slurm's limits are only looked up once, and several sbatch can run at the same time.",
+        usage="%(prog)s bulk [--parallel number] [--rate per_second] jobfile [jobfile ...] [-- dsq and slurm arguments]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_files", metavar="jobfile", nargs="+")
+    parser.add_argument(
+        "--parallel",
+        metavar="number",
+        nargs=1,
+        type=int,
+        default=[1],
+        help="Run up to this many sbatch at once. Default 1.",
+    )
+    parser.add_argument(
+        "--rate",
+        metavar="per_second",
+        nargs=1,
+        type=float,
+        help="Start at most this many sbatch a second.",
+    )
+    bulk_args = parser.parse_args(argv)
+    return bulk_args, dsq_argv
+
+
+def bulk_main(argv):
+    bulk_args, dsq_argv = parse_bulk_args(argv)
+    if bulk_args.parallel[0] < 1:
+        print("--parallel must be at least 1.", file=sys.stderr)
+        sys.exit(1)
+    if bulk_args.rate is not None and bulk_args.rate[0] <= 0:
+        print("--rate must be more than 0.", file=sys.stderr)
+        sys.exit(1)
+    for forbidden in ["--job-file", "--batch-file", "--stdout", "--submit"]:
+        if forbidden in dsq_argv:
+            print("{} can't be used with dsq bulk.".format(forbidden), file=sys.stderr)
+            sys.exit(1)
+    results = submit_job_files(
+        bulk_args.job_files,
+        dsq_argv,
+        bulk_args.parallel[0],
+        None if bulk_args.rate is None else bulk_args.rate[0],
+    )
+    failed = 0
+    for job_file_name, result in zip(bulk_args.job_files, results):
+        if isinstance(result, list):
+            print("{}\t{}".format(job_file_name, ",".join(result) or "-"))
+            continue
+        failed += 1
+        if isinstance(result, CalledProcessError):
+            reason = "sbatch exited {}".format(result.returncode)
+        else:
+            reason = str(result)
+        print("{}\tfailed: {}".format(job_file_name, reason), file=sys.stderr)
+    if failed > 0:
         print(
-            "\n# DO NOT EDIT LINE BELOW".format(**job_info),
-            file=job_info["batch_script_out"],
+            "{} of {} job files were not submitted.".format(
+                failed, len(bulk_args.job_files)
+            ),
+            file=sys.stderr,
         )
+        sys.exit(1)
+
+
+def parse_compress_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Compress a job file in blocks, so each job only decompresses the block its line is in. dSQ reads gzip and xz job files compressed any other way too, but has to decompress them from the start to get to a line.",
+        usage="%(prog)s compress jobfile [--xz] [-o file]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_file", metavar="jobfile")
+    parser.add_argument(
+        "--xz", action="store_true", help="Use xz instead of gzip. Slower, but smaller."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="file",
+        nargs=1,
+        help="Where to write it. Default is the job file with .gz or .xz on the end.",
+    )
+    return parser.parse_args(argv)
+
+
+def compress_main(argv):
+    compress_args = parse_compress_args(argv)
+    compression = "xz" if compress_args.xz else "gzip"
+    if compress_args.output is not None:
+        compressed_name = compress_args.output[0]
+    else:
+        compressed_name = compress_args.job_file + (
+            ".xz" if compress_args.xz else ".gz"
+        )
+    try:
+        compress_job_file(compress_args.job_file, compressed_name, compression)
+    except (IOError, OSError) as e:
+        print("Could not compress job file: {}".format(e), file=sys.stderr)
+        sys.exit(1)
+    print("Compressed {} to {}.".format(compress_args.job_file, compressed_name))
+
+
+def parse_throttle_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Keep adjusting how many tasks of a running dSQ array slurm runs at once, to get through it as fast as the cluster and its filesystem allow. Runs until the array has finished.",
+        usage="%(prog)s throttle jobid [--status-dir dir] [--job-file jobfile.txt] [--min N] [--max N] [--start N] [--window seconds]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_id", metavar="jobid", help="Job ID of your dSQ array.")
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job stats are saved to. Defaults to working directory.",
+    )
+    parser.add_argument(
+        "--job-file",
+        metavar="jobfile.txt",
+        nargs=1,
+        help="Tell when only a few jobs are left from every line of this job file, instead of from the number of jobs dsq submitted. Only needed for arrays submitted with --array.",
+    )
+    parser.add_argument(
+        "--min",
+        metavar="N",
+        nargs=1,
+        type=int,
+        default=[1],
+        help="Never run fewer than this many tasks at once. Default: 1",
+    )
+    parser.add_argument(
+        "--max",
+        metavar="N",
+        nargs=1,
+        type=int,
+        help="Never run more than this many tasks at once.",
+    )
+    parser.add_argument(
+        "--start",
+        metavar="N",
+        nargs=1,
+        type=int,
+        help="Tasks to run at once to begin with. Defaults to the array's current limit, or 10 if it has none.",
+    )
+    parser.add_argument(
+        "--window",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        default=[60],
+        help="Look at how the array is doing this often, or less often if fewer than 20 jobs finished in that time. Should be longer than most jobs take. Default: 60",
+    )
+    return parser.parse_args(argv)
+
+
+def throttle_main(argv):
+    throttle_args = parse_throttle_args(argv)
+    status_dir = throttle_args.status_dir[0]
+    max_limit = None if throttle_args.max is None else throttle_args.max[0]
+    if throttle_args.min[0] < 1 or (
+        max_limit is not None and max_limit < throttle_args.min[0]
+    ):
+        print("--min must be at least 1, and --max at least --min.", file=sys.stderr)
+        sys.exit(1)
+    total_jobs = job_file_total_jobs(throttle_args.job_file)
+    try:
+        limit, active = array_throttle(throttle_args.job_id)
+    except (CalledProcessError, OSError, ValueError):
+        print("Could not look up job {}.".format(throttle_args.job_id), file=sys.stderr)
+        sys.exit(1)
+    if not active:
+        print("Job {} has finished.".format(throttle_args.job_id))
+        sys.exit(0)
+    if throttle_args.start is not None:
+        limit = throttle_args.start[0]
+    elif limit == 0:
+        limit = 10
+    limit = max(throttle_args.min[0], limit)
+    if max_limit is not None:
+        limit = min(max_limit, limit)
+    state = new_throttle_state(limit, throttle_args.min[0], max_limit)
+
+    def log(message):
+        print(message)
+        sys.stdout.flush()
+
+    try:
+        run_throttle(
+            throttle_args.job_id,
+            status_dir,
+            state,
+            total_jobs,
+            throttle_args.window[0],
+            log,
+        )
+    except CalledProcessError as e:
+        # slurm forgot about the array, or won't let us change it
         print(
-            "{run_script} {job_file_arg} {status_dir_arg}\n".format(**job_info),
-            file=job_info["batch_script_out"],
+            "scontrol exited {}, stopping.".format(e.returncode),
+            file=sys.stderr,
         )
-        if not args.stdout:
-            print(
-                "Batch script generated. To submit your jobs, run:\n sbatch {}".format(
-                    job_info["batch_script_out"].name
-                )
-            )
+        sys.exit(1)
+
+
+def parse_trace_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Merge the timings saved with --trace into one trace for chrome://tracing or ui.perfetto.dev, and print percentiles of how long each step took and of the time the dSQ wrapper took on top of the jobs.",
+        usage="%(prog)s trace jobid [--status-dir dir] [--output trace.json] [--json]",
+        prog=path.basename(sys.argv[0]),
+    )
+    parser.add_argument("job_id", metavar="jobid", help="Job ID of your dSQ array.")
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job_jobid_trace directory was saved to. Defaults to working directory.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="trace.json",
+        nargs=1,
+        help="Where to save the trace. Defaults to job_jobid_trace.json, none saves no trace.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the percentiles as json."
+    )
+    return parser.parse_args(argv)
+
+
+def trace_main(argv):
+    trace_args = parse_trace_args(argv)
+    status_dir = trace_args.status_dir[0]
+    if len(trace_files(status_dir, trace_args.job_id)) == 0:
+        print(
+            "No timings saved in {}. Did you submit job {} with --trace?".format(
+                path.join(status_dir, TRACE_DIR.format(trace_args.job_id)),
+                trace_args.job_id,
+            ),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if trace_args.output is None:
+        output = "job_{}_trace.json".format(trace_args.job_id)
+    else:
+        output = trace_args.output[0]
+    if output == "none":
+        summary = merge_trace(status_dir, trace_args.job_id)
+    else:
+        try:
+            with open(output, "w") as out_file:
+                summary = merge_trace(status_dir, trace_args.job_id, out_file)
+        except (IOError, OSError) as e:
+            print("Could not write {}: {}".format(output, e), file=sys.stderr)
+            sys.exit(1)
+    if trace_args.json:
+        summary["job_id"] = trace_args.job_id
+        print(json.dumps(summary, sort_keys=True))
+    else:
+        print(format_trace_summary(trace_args.job_id, summary))
+        if output != "none":
+            print("Trace saved to {}".format(output))
+
+
+subcommands = {
+    "merge": merge_main,
+    "logs": logs_main,
+    "watch": watch_main,
+    "cache": cache_main,
+    "bulk": bulk_main,
+    "compress": compress_main,
+    "throttle": throttle_main,
+    "trace": trace_main,
+}
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        subcommands[sys.argv[1]](sys.argv[2:])
+        sys.exit(0)
     args, user_slurm_args = parse_args()
-    job_info = get_job_info(args, user_slurm_args)
-    submit_or_print_job(job_info, args.submit, args.stdout)
+    try:
+        job_info = get_job_info(args, user_slurm_args)
+    except (RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if len(job_info["parts"]) == 0:
+        print("All jobs in {job_file_name} already succeeded.".format(**job_info))
+        sys.exit(0)
+    submit_or_print_job(job_info, args.submit, args.stdout, args.chain, args.batch_file)
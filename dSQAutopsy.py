@@ -1,39 +1,111 @@
 #!/usr/bin/env python3
 from __future__ import print_function
 from collections import defaultdict
-from itertools import groupby
 from os import path
-from subprocess import call, check_output
+from subprocess import PIPE, Popen
 from textwrap import fill
+from dSQJobFile import (
+    find_run_manifests,
+    is_job_line,
+    open_job_file,
+    read_line_map,
+    task_positions,
+)
+from dSQStatus import lines_in_states, succeeded_lines
+from dSQSweep import load_sweep, sweep_line, sweep_size
 import argparse
+import heapq
 import os
+import shutil
 import sys
 
 __version__ = 1.05
 
-
-def collapse_ranges(i):
-    for a, b in groupby(enumerate(i), lambda pair: pair[1] - pair[0]):
-        b = list(b)
-        if b[0][1] == b[-1][1]:
-            yield "{}".format(b[0][1])
-        else:
-            yield "{}-{}".format(b[0][1], b[-1][1])
+# states of failed jobs that dSQBatch saves in status files
+STATUS_STATES = ["FAILED", "TIMEOUT", "STALLED"]
 
 
-def expand_ranges(idx_range):
+# array indices are kept as lists of inclusive (low, high, step) ranges, so a
+# huge array costs as much as its number of ranges rather than its number of
+# indices
+def parse_ranges(idx_range):
+    # takes an array index as sacct prints it, e.g. 7 or [0-5,9,10-20:2%2],
+    # yields ranges. high is always the last index in the range
     if "[" in idx_range:
         start = idx_range.find("[") + 1
         end = idx_range.find("]") if idx_range.find("%") == -1 else idx_range.find("%")
         for sub_idx in idx_range[start:end].split(","):
             if "-" not in sub_idx:
-                yield int(sub_idx)
-            else:
-                low, high = sub_idx.split("-", 1)
-                for i in range(int(low), int(high) + 1):
-                    yield int(i)
+                yield int(sub_idx), int(sub_idx), 1
+                continue
+            low, high = sub_idx.split("-", 1)
+            step = 1
+            if ":" in high:
+                high, step = high.split(":", 1)
+                step = int(step)
+            low, high = int(low), int(high)
+            yield low, high - (high - low) % step, step
     else:
-        yield int(idx_range)
+        yield int(idx_range), int(idx_range), 1
+
+
+def range_size(low, high, step):
+    return (high - low) // step + 1
+
+
+def job_id_key(job_id):
+    # sort job ids like 123, 123_4 and 123+1 by their numbers, and anything
+    # else after them
+    return [
+        (0, int(part)) if part.isdigit() else (1, part)
+        for part in job_id.replace("+", "_").split("_")
+    ]
+
+
+def merge_intervals(intervals):
+    # sort intervals and join the ones that overlap or touch
+    merged = []
+    for low, high in sorted(intervals):
+        if len(merged) > 0 and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return merged
+
+
+def merge_ranges(ranges):
+    # sort ranges and join the ones without a step where they touch. stepped
+    # ones are kept as they are, so the result can still overlap
+    stepped = [
+        (low, high, step) for low, high, step in ranges if step > 1 and low < high
+    ]
+    for low, high in merge_intervals(
+        (low, high) for low, high, step in ranges if step == 1 or low == high
+    ):
+        stepped.append((low, high, 1))
+    return sorted(stepped)
+
+
+def range_members(ranges):
+    # every number in sorted ranges once and in order, without listing them all
+    # up front
+    last = None
+    for i in heapq.merge(*[range(low, high + 1, step) for low, high, step in ranges]):
+        if i != last:
+            yield i
+        last = i
+
+
+def collapse_ranges(ranges):
+    # ranges without a step are joined where they touch, stepped ones are
+    # printed the way sacct does
+    for low, high, step in merge_ranges(ranges):
+        if low == high:
+            yield "{}".format(low)
+        elif step == 1:
+            yield "{}-{}".format(low, high)
+        else:
+            yield "{}-{}:{}".format(low, high, step)
 
 
 def safe_fill(text, wrap_width):
@@ -47,9 +119,7 @@ def safe_fill(text, wrap_width):
 # Check if dSQ is being run interactively
 if sys.__stdin__.isatty():
     # get terminal columns for wrapping
-    term_rows, term_columns = [int(x) for x in check_output(["stty", "size"]).split()]
-    if term_columns < 25:
-        term_columns = 25
+    term_columns = max(shutil.get_terminal_size().columns, 25)
 else:
     term_columns = 25
 
@@ -62,7 +132,9 @@ For more in-depth job stats use sacct, seff, or seff-array.
 Example usage:
 
 dsqa -j 1111 
+dsqa -j 1111 1187 1243
 dsqa -j 1243 -f jobs.txt -s NODE_FAIL,PREEMPTED > rerun_jobs.txt
+dsqa -f jobs.txt --resume-from job_1243_status.tsv > unfinished_jobs.txt
 
 """.format(
     __version__
@@ -74,19 +146,25 @@ desc = "\n".join([safe_fill(x, term_columns - 1) for x in str.splitlines(desc)])
 def parse_args():
     parser = argparse.ArgumentParser(
         description=desc,
-        usage="%(prog)s --job-id jobid [--job-file jobfile.txt [--states STATES] > new_jobs.txt]",
+        usage="%(prog)s --job-id jobid [jobid ...] [--job-file jobfile.txt [--states STATES] > new_jobs.txt]\n       %(prog)s --job-file jobfile.txt --resume-from job_jobid_status.tsv [...] > new_jobs.txt",
         formatter_class=argparse.RawTextHelpFormatter,
         prog=path.basename(sys.argv[0]),
     )
     parser.add_argument(
         "-v", "--version", action="version", version="%(prog)s {}".format(__version__)
     )
-    parser.add_argument(
+    job_or_status = parser.add_mutually_exclusive_group(required=True)
+    job_or_status.add_argument(
         "-j",
         "--job-id",
-        nargs=1,
-        required=True,
-        help="The Job ID of a running or completed dSQ Array",
+        nargs="+",
+        help="The Job ID of a running or completed dSQ Array. Give several to report on them together.",
+    )
+    job_or_status.add_argument(
+        "--resume-from",
+        metavar="job_jobid_status.tsv",
+        nargs="+",
+        help="Instead of asking sacct, write out the jobs in the job file that didn't exit 0 according to these status files.",
     )
     parser.add_argument(
         "-f",
@@ -94,14 +172,28 @@ def parse_args():
         nargs=1,
         help="Job file, one job per line (not your job submission script).",
     )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="The job file is a sweep spec you gave dsq with --sweep. The jobs to re-run are written out one per line.",
+    )
     parser.add_argument(
         "-s",
         "--states",
         nargs=1,
-        default=["CANCELLED,NODE_FAIL,PREEMPTED"],
-        help="Comma separated list of states to use for re-writing job file. Default: CANCELLED,NODE_FAIL,PREEMPTED",
+        help="Comma separated list of states to use for re-writing job file. Default: CANCELLED,NODE_FAIL,PREEMPTED. With --resume-from, only write out the jobs that didn't exit 0 and were saved with one of FAILED, TIMEOUT or STALLED.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--status-dir",
+        metavar="dir",
+        nargs=1,
+        default=["."],
+        help="Directory the job_jobid_status.tsv file was saved to. Defaults to working directory.",
+    )
+    args = parser.parse_args()
+    if args.resume_from is not None and args.job_file is None:
+        parser.error("--resume-from needs --job-file")
+    return args
 
 
 def get_state_status(args):
@@ -124,11 +216,10 @@ def get_state_status(args):
         "TIMEOUT",
     ]
     sacct_cmd = ["sacct", "-o" + ",".join(array_state_header), "-nXPj"]
-    state_summary = defaultdict(lambda: 0)
-    array_states = defaultdict(lambda: [])
-    job_id = args.job_id[0]
+    job_ids = [j for job_id in args.job_id for j in job_id.split(",") if j != ""]
     rerun_states = []
-    for state in args.states[0].split(","):
+    states = "CANCELLED,NODE_FAIL,PREEMPTED" if args.states is None else args.states[0]
+    for state in states.split(","):
         if state in possible_states:
             rerun_states.append(state)
         else:
@@ -136,52 +227,61 @@ def get_state_status(args):
             print("Choose from {}.".format(",".join(possible_states)), file=sys.stderr)
             sys.exit(1)
     state_summary_header = ["State", "Num_Jobs", "Indices"]
-    reruns = []
-    sacct_cmd.append(job_id)
+    tally = {
+        "summary": defaultdict(lambda: 0),
+        "states": defaultdict(lambda: []),
+        "reruns": [],
+        "rerun_states": rerun_states,
+        "lines_read": 0,
+    }
+    # job files split into several arrays all report as the first one, with
+    # their array indices offset
+    manifests = find_run_manifests(args.status_dir[0], job_ids)
+    array_jids = sorted(manifests, key=job_id_key)
+    # ask sacct about every array at once, and read its answer as it comes
+    sacct_cmd.append(",".join(array_jids))
     try:
-        sacct_output = check_output(sacct_cmd).decode().split("\n")
+        sacct = Popen(sacct_cmd, stdout=PIPE, universal_newlines=True)
+        tally_states(sacct.stdout, manifests, tally)
+        sacct.stdout.close()
+        if sacct.wait() != 0:
+            raise OSError()
     except Exception as e:
         # give up if we hit an error
-        print("Error looking up job {}.".format(job_id), file=sys.stderr)
+        print("Error looking up job {}.".format(",".join(job_ids)), file=sys.stderr)
         sys.exit(1)
-    column_lengths = dict(
-        zip(state_summary_header, [len(x) + 2 for x in state_summary_header])
-    )
     # if there is job info
-    if sacct_output[0] == "":
-        print("Couldn't look up job. (Does sacct -j {} return anything?)".format(jid))
+    if tally["lines_read"] == 0:
+        print(
+            "Couldn't look up job. (Does sacct -j {} return anything?)".format(
+                ",".join(array_jids)
+            )
+        )
         sys.exit(1)
-    else:
-        for l in sacct_output:
-            split_line = l.split("|")
-            if len(split_line) == len(array_state_header):
-                line_dict = dict(zip(array_state_header, split_line))
-                # track column widths for pretty printing
-                if len(line_dict["State"]) + 2 > column_lengths["State"]:
-                    column_lengths["State"] = len(line_dict["State"]) + 2
-                if "_" in line_dict["JobID"]:
-                    # track array idx
-                    array_ids = list(expand_ranges(line_dict["JobID"].split("_")[1]))
-                    array_states[line_dict["State"]] = (
-                        array_states[line_dict["State"]] + array_ids
-                    )
-                    state_summary[line_dict["State"]] += len(array_ids)
-                    if any([line_dict["State"].startswith(x) for x in rerun_states]):
-                        # add them to the reruns list if desired
-                        # some states can have info appended, e.g.
-                        # "CANCELLED by 124412", but want to treat it as CANCELLED
-                        reruns = reruns + array_ids
-                else:
-                    print(
-                        "{} does not look like a job array.".format(jid),
-                        file=sys.stderr,
-                    )
-                    sys.exit(1)
 
-    for state in array_states:
-        array_states[state] = ",".join(collapse_ranges(sorted(array_states[state])))
+    state_summary = tally["summary"]
+    array_states = {}
+    for state in tally["states"]:
+        array_states[state] = ",".join(collapse_ranges(tally["states"][state]))
+    # track column widths for pretty printing
+    column_lengths = dict(
+        zip(state_summary_header, [len(x) + 2 for x in state_summary_header])
+    )
+    for state in state_summary:
+        if len(state) + 2 > column_lengths["State"]:
+            column_lengths["State"] = len(state) + 2
 
-    print("State Summary for Array {}".format(job_id), file=sys.stderr)
+    if len(array_jids) > 1:
+        print(
+            "State Summary for Array{} {} (job arrays {})".format(
+                "s" if len(job_ids) > 1 else "",
+                ",".join(job_ids),
+                ",".join(array_jids),
+            ),
+            file=sys.stderr,
+        )
+    else:
+        print("State Summary for Array {}".format(job_ids[0]), file=sys.stderr)
     summary_template = "{{:<{}}}{{:^{}}}{{:<{}}}".format(
         *[column_lengths[x] for x in state_summary_header]
     )
@@ -195,22 +295,156 @@ def get_state_status(args):
             summary_template.format(state, state_summary[state], array_states[state]),
             file=sys.stderr,
         )
-    return reruns
+    dynamic_jids = [j for j in array_jids if manifests[j].get("dynamic", False)]
+    if args.job_file and len(dynamic_jids) > 0:
+        print(
+            "Job array {} pulled its jobs from a queue, use --resume-from job_{}_status.tsv to find the ones to re-run.".format(
+                ",".join(dynamic_jids), manifests[dynamic_jids[0]]["run_id"]
+            ),
+            file=sys.stderr,
+        )
+    return merge_ranges(tally["reruns"])
+
+
+def tally_states(sacct_lines, manifests, tally):
+    # count array indices by state from lines of sacct -o JobID,State -P output.
+    # manifests maps job ids to how their array indices map to job file lines
+    rerun_state = {}
+    # positions in each line map to look up once sacct is done
+    mapped = defaultdict(list)
+    for l in sacct_lines:
+        tally["lines_read"] += 1
+        split_line = l.rstrip("\n").split("|")
+        if len(split_line) != 2:
+            continue
+        job_id, state = split_line
+        if "_" not in job_id:
+            print("{} does not look like a job array.".format(job_id), file=sys.stderr)
+            sys.exit(1)
+        array_jid, idx_range = job_id.split("_", 1)
+        manifest = manifests.get(array_jid, {})
+        offset = manifest.get("offset", 0)
+        ranges = list(parse_ranges(idx_range))
+        tally["states"][state].extend(
+            (low + offset, high + offset, step) for low, high, step in ranges
+        )
+        tally["summary"][state] += sum(range_size(*r) for r in ranges)
+        if state not in rerun_state:
+            # some states can have info appended, e.g.
+            # "CANCELLED by 124412", but want to treat it as CANCELLED
+            rerun_state[state] = any(state.startswith(x) for x in tally["rerun_states"])
+        if rerun_state[state] and not manifest.get("dynamic", False):
+            # add the job file lines they ran to the reruns list if desired.
+            # workers of a --dynamic array don't run fixed lines
+            positions = [
+                p
+                for low, high, step in ranges
+                for p in task_positions(low, high, step, manifest)
+            ]
+            if manifest.get("line_map") is None:
+                tally["reruns"].extend(positions)
+            else:
+                mapped[manifest["line_map"]].extend(positions)
+    # each map is read once, the lines in it are in no particular order
+    for map_name, positions in mapped.items():
+        tally["reruns"].extend(
+            (n, n, 1)
+            for n in read_line_map(map_name, range_members(merge_ranges(positions)))
+        )
+
+
+def load_sweep_or_exit(spec_name):
+    try:
+        return load_sweep(spec_name)
+    except (IOError, OSError, ValueError) as e:
+        print("Could not read sweep: {}".format(e), file=sys.stderr)
+        sys.exit(1)
+
+
+def print_sweep_reruns(reruns, spec_name):
+    # every line of a sweep is a job, so we can go straight to the ones we want
+    sweep = load_sweep_or_exit(spec_name)
+    size = sweep_size(sweep)
+    for i in range_members(reruns):
+        if i >= size:
+            break
+        print(sweep_line(sweep, i))
 
 
 def print_reruns(reruns, job_file_name):
     try:
-        job_file = open(job_file_name, "r")
+        job_file = open_job_file(job_file_name, "rt")
     except Exception as e:
         print("Could not open {}.".format(job_file_name), file=sys.stderr)
         sys.exit(1)
+    # reruns are sorted ranges, so we only need to walk through their lines
+    # alongside the job file once
+    reruns = range_members(reruns)
+    rerun = next(reruns, None)
     for i, line in enumerate(job_file):
-        if i in reruns:
+        if rerun is None:
+            break
+        if i < rerun:
+            continue
+        rerun = next(reruns, None)
+        # packed jobs can include comments and empty lines, leave those out
+        if not (line.startswith("#") or line.rstrip() == ""):
             print(line.rstrip())
 
 
+def print_unfinished(status_file_names, job_file_name, sweep=False, states=None):
+    try:
+        succeeded = succeeded_lines(status_file_names)
+        in_states = None
+        if states is not None:
+            in_states = lines_in_states(status_file_names, states)
+    except Exception as e:
+        print("Could not read {}.".format(" ".join(status_file_names)), file=sys.stderr)
+        sys.exit(1)
+
+    def unfinished(i):
+        if i < len(succeeded) and succeeded[i] == 1:
+            return False
+        # with states, only the lines that were saved with one of them
+        return in_states is None or (i < len(in_states) and in_states[i] == 1)
+
+    try:
+        job_file = open_job_file(job_file_name)
+    except Exception as e:
+        print("Could not open {}.".format(job_file_name), file=sys.stderr)
+        sys.exit(1)
+    # print every job that has no line with exit code 0 in the status files
+    if sweep:
+        job_file.close()
+        sweep = load_sweep_or_exit(job_file_name)
+        for i in range(sweep_size(sweep)):
+            if unfinished(i):
+                print(sweep_line(sweep, i))
+        return
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    for i, line in enumerate(job_file):
+        if is_job_line(line) and unfinished(i):
+            out.write(line.rstrip() + b"\n")
+
+
 if __name__ == "__main__":
     args = parse_args()
-    reruns = get_state_status(args)
-    if args.job_file:
-        print_reruns(reruns, args.job_file[0])
+    if args.resume_from is not None:
+        states = None
+        if args.states is not None:
+            states = args.states[0].split(",")
+            for state in states:
+                if state not in STATUS_STATES:
+                    print("Unknown state: {}.".format(state), file=sys.stderr)
+                    print(
+                        "Choose from {}.".format(",".join(STATUS_STATES)),
+                        file=sys.stderr,
+                    )
+                    sys.exit(1)
+        print_unfinished(args.resume_from, args.job_file[0], args.sweep, states)
+    else:
+        reruns = get_state_status(args)
+        if args.job_file and args.sweep:
+            print_sweep_reruns(reruns, args.job_file[0])
+        elif args.job_file:
+            print_reruns(reruns, args.job_file[0])
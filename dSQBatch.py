@@ -1,30 +1,368 @@
 #!/bin/env python3
 from __future__ import print_function
 from datetime import datetime
-from functools import partial
 from os import path
-from subprocess import Popen
+from dSQJobFile import read_line_map, read_lines, task_lines, write_manifest
+from dSQStatus import STATUS_BACKENDS, STATUS_COLUMNS, write_status_row
 import argparse
 import os
-import platform
 import signal
 import sys
+import threading
 import time
 
+# every array task starts a new python, so modules only some options need
+# (thread pools for packing, sqlite, logs, sweeps) are imported where they are
+# used. threading is light, and running jobs needs it for copying output and
+# watching for stalls
+
 __version__ = 1.05
 
 
+# pids of the jobs currently running, so signals can be passed on to all of them.
+# maps to True for jobs started in their own process group
+running_children = {}
+# seconds between asking a job that ran out of time to stop and killing it
+KILL_GRACE = 10
+TIMEOUT_EXIT_CODE = 124
+# jobs stopped for making no progress for --stall-timeout seconds
+STALLED_EXIT_CODE = 125
+# most seconds between looks at how much cpu and io a job has used
+STALL_SAMPLE = 30
+# set once slurm asks this task to stop, so failed jobs aren't retried
+task_stopping = threading.Event()
+
+
 def forward_signal_to_child(pid, signum, frame):
     print("[dSQ]: ", pid, signum, frame)
-    os.kill(pid, signum)
+    if running_children.get(pid):
+        os.killpg(pid, signum)
+    else:
+        os.kill(pid, signum)
+
+
+def forward_signal_to_children(signum, frame):
+    if signum == signal.SIGTERM:
+        task_stopping.set()
+    if signum == signal.SIGTERM and len(running_children) == 0:
+        # nothing started yet, terminate as if we hadn't caught it
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    for pid in list(running_children):
+        forward_signal_to_child(pid, signum, frame)
+
+
+def exit_code_from_status(wait_status):
+    # same convention as Popen.returncode, negative if killed by a signal
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def read_cgroup_stats():
+    # peak memory and cpu time of this task's cgroup so far, if it is on cgroup
+    # v2. they cover everything that ran in the task
+    stats = {}
+    try:
+        with open("/proc/self/cgroup", "r") as cgroup_file:
+            cgroup = [l.strip()[3:] for l in cgroup_file if l.startswith("0::")][0]
+        cgroup_dir = path.join("/sys/fs/cgroup", cgroup.lstrip("/"))
+        with open(path.join(cgroup_dir, "memory.peak"), "r") as peak_file:
+            stats["Cgroup_Mem_Peak_KB"] = int(peak_file.read()) // 1024
+        with open(path.join(cgroup_dir, "cpu.stat"), "r") as cpu_file:
+            for l in cpu_file:
+                key, value = l.split()
+                if key == "usage_usec":
+                    stats["Cgroup_CPU"] = int(value) / 1e6
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return stats
+
+
+# anything that makes a line more than a command and its arguments needs a
+# shell: pipes, redirects, variables, globs, subshells, comments and so on
+SHELL_CHARS = set("|&;<>()$`\\*?[]#~{}!")
+# and so do commands that only a shell has
+SHELL_WORDS = set(
+    [
+        ".",
+        ":",
+        "[[",
+        "{",
+        "!",
+        "alias",
+        "bg",
+        "break",
+        "case",
+        "cd",
+        "command",
+        "continue",
+        "declare",
+        "eval",
+        "exec",
+        "exit",
+        "export",
+        "fg",
+        "for",
+        "function",
+        "getopts",
+        "hash",
+        "if",
+        "jobs",
+        "local",
+        "read",
+        "readonly",
+        "return",
+        "select",
+        "set",
+        "shift",
+        "source",
+        "time",
+        "times",
+        "trap",
+        "type",
+        "typeset",
+        "ulimit",
+        "umask",
+        "unalias",
+        "unset",
+        "until",
+        "wait",
+        "while",
+    ]
+)
+# signals python ignores that jobs should get the default behavior for
+DEFAULT_SIGNALS = [signal.SIGPIPE, signal.SIGXFSZ]
+
+
+def direct_argv(job_str):
+    # the arguments to run job_str with, if it doesn't need a shell, otherwise None
+    if any(c in SHELL_CHARS for c in job_str):
+        return None
+    if '"' in job_str or "'" in job_str:
+        import shlex
+
+        try:
+            argv = shlex.split(job_str)
+        except ValueError:
+            return None
+    else:
+        argv = job_str.split()
+    if len(argv) == 0 or "=" in argv[0] or argv[0] in SHELL_WORDS:
+        return None
+    return argv
+
 
+def spawn_job(job_str, stdout=None, stderr=None, new_group=False):
+    # start the job without a shell in between if we can. returns its pid. with
+    # new_group, the job and everything it starts can be killed together
+    argv = direct_argv(job_str)
+    if not hasattr(os, "posix_spawnp"):
+        from subprocess import Popen
 
-def exec_job(job_str):
-    process = Popen(job_str, shell=True)
-    signal.signal(signal.SIGCONT, partial(forward_signal_to_child, process.pid))
-    signal.signal(signal.SIGTERM, partial(forward_signal_to_child, process.pid))
-    return_code = process.wait()
-    return return_code
+        return Popen(
+            job_str if argv is None else argv,
+            shell=argv is None,
+            stdout=stdout,
+            stderr=stderr,
+            start_new_session=new_group,
+        ).pid
+    spawn_args = {"setsigdef": DEFAULT_SIGNALS}
+    if new_group:
+        spawn_args["setpgroup"] = 0
+    file_actions = []
+    if stdout is not None:
+        file_actions.append((os.POSIX_SPAWN_DUP2, stdout, 1))
+    if stderr is not None:
+        file_actions.append((os.POSIX_SPAWN_DUP2, stderr, 2))
+    if argv is not None:
+        try:
+            return os.posix_spawnp(
+                argv[0], argv, os.environ, file_actions=file_actions, **spawn_args
+            )
+        except OSError:
+            # e.g. command not found, let the shell report it
+            pass
+    return os.posix_spawn(
+        "/bin/sh",
+        ["/bin/sh", "-c", job_str],
+        os.environ,
+        file_actions=file_actions,
+        **spawn_args
+    )
+
+
+def fork_exec_job(job_str, new_group=False):
+    # --exec: the wrapper forks and the child turns into the job. returns its pid
+    argv = direct_argv(job_str)
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    try:
+        if new_group:
+            os.setpgid(0, 0)
+        for signum in DEFAULT_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        if argv is not None:
+            try:
+                os.execvp(argv[0], argv)
+            except OSError:
+                pass
+        os.execv("/bin/sh", ["/bin/sh", "-c", job_str])
+    finally:
+        os._exit(127)
+
+
+def stop_job(pid, stopped):
+    # the job ran out of time or stalled. ask everything in its process group to
+    # stop, and kill whatever is left if it hasn't after a grace period
+    stopped.set()
+    try:
+        os.killpg(pid, signal.SIGTERM)
+        deadline = time.monotonic() + KILL_GRACE
+        while pid in running_children and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if pid in running_children:
+            os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        # it already finished
+        pass
+
+
+def job_progress(pgid):
+    # cpu ticks used and bytes read and written by the processes in a job's
+    # process group, including children they already waited for
+    ticks = 0
+    io = 0
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(name), "rb") as stat_file:
+                stat = stat_file.read()
+            # the command can have spaces and parentheses in it, so count the
+            # fields from the end of it: state ppid pgrp ... utime stime cutime cstime
+            fields = stat[stat.rfind(b")") + 2 :].split()
+            if int(fields[2]) != pgid:
+                continue
+            ticks += sum(int(f) for f in fields[11:15])
+            with open("/proc/{}/io".format(name), "r") as io_file:
+                for l in io_file:
+                    key, value = l.split(":")
+                    if key in ["rchar", "wchar"]:
+                        io += int(value)
+        except (IOError, OSError, IndexError, ValueError):
+            # it finished, or isn't ours to look at
+            continue
+    return ticks, io
+
+
+def watch_job(pid, stall_timeout, stalled, done):
+    # stop the job if nothing in its process group used any cpu or read or wrote
+    # anything for stall_timeout seconds, e.g. it is stuck on a dead nfs mount
+    interval = min(STALL_SAMPLE, stall_timeout / 4.0)
+    last_progress = None
+    last_change = time.monotonic()
+    while not done.wait(interval):
+        progress = job_progress(pid)
+        now = time.monotonic()
+        if progress != last_progress:
+            last_progress = progress
+            last_change = now
+        elif now - last_change >= stall_timeout:
+            stop_job(pid, stalled)
+            return
+
+
+def wait_job(pid, new_group=False, timeout=None, stall_timeout=None):
+    # returns the job's exit code, the resources it used and TIMEOUT or STALLED
+    # if it was stopped for running longer than timeout seconds or for making no
+    # progress for stall_timeout seconds
+    running_children[pid] = new_group
+    timed_out = threading.Event()
+    stalled = threading.Event()
+    done = threading.Event()
+    threads = []
+    if timeout is not None:
+        threads.append(threading.Timer(timeout, stop_job, args=(pid, timed_out)))
+    if stall_timeout is not None and path.isdir("/proc/self"):
+        threads.append(
+            threading.Thread(target=watch_job, args=(pid, stall_timeout, stalled, done))
+        )
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        # wait4 also gives us the resources used by the job and everything it
+        # waited for
+        _, wait_status, rusage = os.wait4(pid, 0)
+    finally:
+        running_children.pop(pid, None)
+        # a retry may fork again, so don't leave the threads behind
+        done.set()
+        for thread in threads:
+            if isinstance(thread, threading.Timer):
+                thread.cancel()
+            thread.join()
+    # the job starts out as a copy of this process, and linux keeps the high
+    # water mark of that copy, so small jobs show our memory rather than theirs
+    usage = {
+        "Max_RSS_HWM_KB": rusage.ru_maxrss,
+        "CPU_User": rusage.ru_utime,
+        "CPU_Sys": rusage.ru_stime,
+        "Blocks_In": rusage.ru_inblock,
+        "Blocks_Out": rusage.ru_oublock,
+    }
+    if timed_out.is_set():
+        # like timeout(1), whatever the job did when it was stopped
+        return TIMEOUT_EXIT_CODE, usage, "TIMEOUT"
+    if stalled.is_set():
+        return STALLED_EXIT_CODE, usage, "STALLED"
+    return exit_code_from_status(wait_status), usage, None
+
+
+def exec_job(
+    job_str,
+    log_fds=None,
+    line_num=None,
+    timeout=None,
+    stall_timeout=None,
+    spawned=None,
+    attempt=1,
+):
+    # spawned is a list to add the time the job was started at to, for --trace.
+    # attempt is saved with its output, so retries can be told apart
+    new_group = timeout is not None or stall_timeout is not None
+    if log_fds is None:
+        pid = spawn_job(job_str, new_group=new_group)
+        if spawned is not None:
+            spawned.append(time.time())
+        return wait_job(pid, new_group, timeout, stall_timeout)
+    from dSQLogs import LOG_STDERR, LOG_STDOUT, copy_to_log
+
+    # copy the job's output to the node's log as it comes
+    out_read, out_write = os.pipe()
+    err_read, err_write = os.pipe()
+    try:
+        pid = spawn_job(job_str, out_write, err_write, new_group)
+    finally:
+        os.close(out_write)
+        os.close(err_write)
+    if spawned is not None:
+        spawned.append(time.time())
+    copiers = [
+        threading.Thread(
+            target=copy_to_log,
+            args=(os.fdopen(pipe, "rb", 0), log_fds, line_num, stream, attempt),
+        )
+        for pipe, stream in [(out_read, LOG_STDOUT), (err_read, LOG_STDERR)]
+    ]
+    for copier in copiers:
+        copier.start()
+    ret, usage, stopped = wait_job(pid, new_group, timeout, stall_timeout)
+    for copier in copiers:
+        copier.join()
+    return ret, usage, stopped
 
 
 desc = """Dead Simple Queue Batch v{}
@@ -51,6 +389,11 @@ def parse_args():
         nargs=1,
         help="Job file, one job per line (not your job submission script).",
     )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="The job file is a sweep spec made for dsq --sweep.",
+    )
     parser.add_argument(
         "--suppress-stats-file",
         action="store_true",
@@ -63,74 +406,477 @@ def parse_args():
         default=".",
         help="Directory to save the job_jobid_status.tsv file to. Defaults to working directory.",
     )
+    parser.add_argument(
+        "--status-backend",
+        nargs=1,
+        choices=STATUS_BACKENDS,
+        default=["tsv"],
+        help="How to save job stats: append to one tsv file (default), to one file per node, or to an sqlite database.",
+    )
+    parser.add_argument(
+        "--pack",
+        metavar="K",
+        nargs=1,
+        type=int,
+        default=[1],
+        help="Run K consecutive lines of the job file per array task.",
+    )
+    parser.add_argument(
+        "--line-map",
+        metavar="file",
+        nargs=1,
+        help="Run the job file lines listed in this map made by dsq, instead of going by line number.",
+    )
+    parser.add_argument(
+        "--dynamic",
+        metavar="chunks",
+        nargs=1,
+        type=int,
+        help="Instead of running the lines for this array task, keep pulling chunks of K lines from a queue shared by the array until all of them have run.",
+    )
+    parser.add_argument(
+        "--aggregate-output",
+        action="store_true",
+        help="Save the output of jobs to one log per node in job_jobid_logs/ instead of printing it.",
+    )
+    parser.add_argument(
+        "--exec",
+        action="store_true",
+        help="Fork and exec the job straight from this wrapper, which only waits for it and saves its stats. Only for array tasks that run one job.",
+    )
+    parser.add_argument(
+        "--stage",
+        action="store_true",
+        help="Read the job file and its index from a copy on node-local storage, made by the first task on each node.",
+    )
+    parser.add_argument(
+        "--stage-dir",
+        metavar="dir",
+        nargs=1,
+        help="Where to keep the copy for --stage. Defaults to /dev/shm, then $TMPDIR, then /tmp.",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="dir",
+        nargs=1,
+        help="Remember jobs that succeed in this cache directory made by dsq.",
+    )
+    parser.add_argument(
+        "--cache-by",
+        nargs=1,
+        default=["stat"],
+        choices=["stat", "content"],
+        help="Whether jobs' inputs are told apart by size and modification time, or by their contents.",
+    )
+    parser.add_argument(
+        "--task-timeout",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        help="Stop a job that runs longer than this, sending SIGTERM to everything it started and SIGKILL {} seconds later.".format(
+            KILL_GRACE
+        ),
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        help="Stop a job whose processes haven't used any cpu or read or written anything for this long, like --task-timeout, and save it as STALLED.",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="N",
+        nargs=1,
+        type=int,
+        default=[0],
+        help="Run a job that failed up to N more times in the same allocation.",
+    )
+    parser.add_argument(
+        "--retry-on",
+        metavar="codes",
+        help="Only retry jobs that exited with one of these comma separated exit codes. timeout stands for jobs stopped by --task-timeout, stalled for jobs stopped by --stall-timeout.",
+    )
+    parser.add_argument(
+        "--retry-delay",
+        metavar="seconds",
+        nargs=1,
+        type=float,
+        default=[1.0],
+        help="Wait this long before the first retry, doubling it before every one after that.",
+    )
+    parser.add_argument(
+        "--index-offset",
+        metavar="N",
+        nargs=1,
+        type=int,
+        default=[0],
+        help="Add N to the array task id, for job files split into several arrays.",
+    )
+    parser.add_argument(
+        "--run-id",
+        metavar="jobid",
+        nargs=1,
+        help="Save job stats to job_jobid_status.tsv instead of using this array's job id.",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Save how long each step of running the jobs took to job_jobid_trace/, for dsq trace.",
+    )
+    parser.add_argument(
+        "--num-jobs",
+        metavar="N",
+        nargs=1,
+        type=int,
+        help="Number of jobs dsq submitted in the whole run, saved for dsq watch and dsq throttle.",
+    )
     return parser.parse_args()
 
 
-def run_job(args):
-    jid = int(os.environ.get("SLURM_ARRAY_JOB_ID"))
-    tid = int(os.environ.get("SLURM_ARRAY_TASK_ID"))
+def parse_retry_on(retry_on):
+    # exit codes, and the words timeout and stalled, of failures worth running
+    # again. None retries any failure
+    if retry_on is None:
+        return None
+    codes = set()
+    for code in retry_on.split(","):
+        code = code.strip().lower()
+        if code == "timeout":
+            codes.add(TIMEOUT_EXIT_CODE)
+        elif code == "stalled":
+            codes.add(STALLED_EXIT_CODE)
+        else:
+            codes.add(int(code))
+    return codes
+
+
+def write_status(args, jid, line_num, ret, hostname, st, et, mycmd, usage):
+    # set up job stats
+    time_fmt = "%Y-%m-%d %H:%M:%S"
+    time_start = st.strftime(time_fmt)
+    time_end = et.strftime(time_fmt)
+    time_elapsed = (et - st).total_seconds()
+    out_dict = dict(
+        zip(
+            STATUS_COLUMNS,
+            [line_num, ret, hostname, time_start, time_end, time_elapsed, mycmd],
+        )
+    )
+    out_dict.update(usage)
+
+    # save job stats to the status file, or whichever backend was chosen
+    write_status_row(
+        args.status_backend[0], args.status_dir[0], jid, hostname, out_dict
+    )
+
+
+def run_job(args, started=None):
+    # started is when the script got to main, for --trace
+    array_jid = int(os.environ.get("SLURM_ARRAY_JOB_ID"))
+    offset = args.index_offset[0]
+    tid = int(os.environ.get("SLURM_ARRAY_TASK_ID")) + offset
     # slurm calls individual job array indices "tasks"
+    # job files split into several arrays all report as the first one
+    jid = array_jid if args.run_id is None else int(args.run_id[0])
+    pack = args.pack[0]
 
-    hostname = platform.node()
+    hostname = os.uname()[1]
+    status_lock = threading.Lock()
+    trace = None
+    if args.trace:
+        from dSQTrace import new_trace, trace_event, write_trace
 
-    # use task_id to get my job out of job_file
-    mycmd = ""
-    with open(args.job_file[0], "r") as tf:
-        for i, l in enumerate(tf):
-            if i == tid:
-                mycmd = l.strip()
-                break
+        trace = new_trace(tid, time.time() if started is None else started)
 
-    # run job and track its execution time
-    if mycmd == "":
-        st = datetime.now()
-        mycmd = "# could not find zero-indexed line {} in job file {}".format(
-            tid, job_file
+    line_map = None if args.line_map is None else path.abspath(args.line_map[0])
+    sweep = None
+    if args.sweep:
+        from dSQSweep import load_sweep, sweep_lines
+
+        sweep = load_sweep(args.job_file[0])
+    job_file_name = args.job_file[0]
+    if args.stage and sweep is None:
+        from dSQJobFile import default_stage_dir, stage_job_file
+
+        stage_dir = default_stage_dir() if args.stage_dir is None else args.stage_dir[0]
+        if stage_dir is not None:
+            job_file_name = stage_job_file(job_file_name, stage_dir)
+    # one task per array saves the manifest, so the others don't touch the
+    # status dir for it. slurm sets SLURM_ARRAY_TASK_MIN for every task
+    first_task = os.environ.get(
+        "SLURM_ARRAY_TASK_MIN", os.environ.get("SLURM_ARRAY_TASK_ID")
+    )
+    if (
+        not args.suppress_stats_file
+        and first_task == os.environ.get("SLURM_ARRAY_TASK_ID")
+        and (
+            pack > 1
+            or offset > 0
+            or jid != array_jid
+            or line_map is not None
+            or args.dynamic is not None
+            or args.num_jobs is not None
         )
-        print(mycmd, file=sys.stderr)
-        ret = 1
-        et = datetime.now()
-    else:
-        st = datetime.now()
-        ret = exec_job(mycmd)
-        et = datetime.now()
-
-    if not args.suppress_stats_file:
-        # set up job stats
-        out_cols = [
-            "Array_Task_ID",
-            "Exit_Code",
-            "Hostname",
-            "T_Start",
-            "T_End",
-            "T_Elapsed",
-            "Task",
-        ]
-        time_fmt = "%Y-%m-%d %H:%M:%S"
-        time_start = st.strftime(time_fmt)
-        time_end = et.strftime(time_fmt)
-        time_elapsed = (et - st).total_seconds()
-        out_dict = dict(
-            zip(
-                out_cols,
-                [tid, ret, hostname, time_start, time_end, time_elapsed, mycmd],
-            )
+    ):
+        # let dSQAutopsy know how array indices map to lines
+        write_manifest(
+            args.status_dir[0],
+            array_jid,
+            {
+                "job_file": path.abspath(args.job_file[0]),
+                "sweep": args.sweep,
+                "pack": pack,
+                "offset": offset,
+                "run_id": jid,
+                "line_map": line_map,
+                "dynamic": args.dynamic is not None,
+                "num_jobs": None if args.num_jobs is None else args.num_jobs[0],
+            },
         )
 
-        # append status file with job stats
-        with open(
-            path.join(args.status_dir[0], "job_{}_status.tsv".format(jid)), "a"
-        ) as out_status:
-            print(
-                "{Array_Task_ID}\t{Exit_Code}\t{Hostname}\t{T_Start}\t{T_End}\t{T_Elapsed:.02f}\t{Task}".format(
-                    **out_dict
-                ),
-                file=out_status,
+    def chunk_jobs(chunk, skip_comments):
+        # use task_id to get my job(s) out of job_file
+        lookup_start = time.time()
+        line_nums = task_lines(chunk, pack)
+        if line_map is not None:
+            line_nums = read_line_map(line_map, line_nums)
+        if sweep is not None:
+            lines = sweep_lines(sweep, line_nums)
+        else:
+            lines = read_lines(job_file_name, line_nums)
+        if skip_comments:
+            # a packed task skips over empty lines and comments like dsq does
+            jobs = [
+                (n, lines[n])
+                for n in line_nums
+                if lines[n] != "" and not lines[n].startswith("#")
+            ]
+        else:
+            jobs = [(n, lines[n]) for n in line_nums]
+        if trace is not None:
+            trace_event(
+                trace,
+                "lookup",
+                lookup_start,
+                time.time(),
+                line_nums[0] if len(line_nums) > 0 else None,
+            )
+        return line_nums, jobs
+
+    def save_status(line_num, ret, st, et, mycmd, usage):
+        if not args.suppress_stats_file:
+            with status_lock:
+                write_status(args, jid, line_num, ret, hostname, st, et, mycmd, usage)
+
+    def run_one(line_num, mycmd):
+        # run job and track its execution time
+        if mycmd == "":
+            st = datetime.now()
+            mycmd = "# could not find zero-indexed line {} in job file {}".format(
+                line_num, args.job_file[0]
+            )
+            print(mycmd, file=sys.stderr)
+            if log_fds is not None:
+                from dSQLogs import LOG_STDERR, write_log_record
+
+                write_log_record(log_fds, line_num, LOG_STDERR, (mycmd + "\n").encode())
+            save_status(
+                line_num,
+                1,
+                st,
+                datetime.now(),
+                mycmd,
+                {"Attempt": 1, "State": "FAILED"},
             )
+            return 1
+
+        cache_key = None
+        if args.cache is not None:
+            from dSQCache import job_key, record_jobs
+
+            # before the job runs, in case it changes its own inputs
+            cache_key = job_key(mycmd, args.cache_by[0])
+
+        # every attempt gets its own status line
+        attempt = 1
+        while True:
+            if cgroup_per_job:
+                cgroup_start = read_cgroup_stats()
+            st = datetime.now()
+            mono_start = time.monotonic()
+            spawn_start = time.time()
+            spawned = []
+            if fork_exec:
+                pid = fork_exec_job(mycmd, new_group)
+                spawned.append(time.time())
+                ret, usage, stopped = wait_job(pid, new_group, timeout, stall_timeout)
+            else:
+                ret, usage, stopped = exec_job(
+                    mycmd, log_fds, line_num, timeout, stall_timeout, spawned, attempt
+                )
+            usage["T_Elapsed_Mono"] = time.monotonic() - mono_start
+            run_end = time.time()
+            usage["Attempt"] = attempt
+            if cgroup_per_job:
+                # the cgroup is the whole task's, only the cpu it used while this
+                # attempt ran is this attempt's. its peak memory is only this
+                # job's the first time
+                cgroup_end = read_cgroup_stats()
+                if "Cgroup_CPU" in cgroup_start and "Cgroup_CPU" in cgroup_end:
+                    usage["Cgroup_CPU"] = (
+                        cgroup_end["Cgroup_CPU"] - cgroup_start["Cgroup_CPU"]
+                    )
+                if attempt == 1:
+                    usage["Cgroup_Mem_Peak_KB"] = cgroup_end.get("Cgroup_Mem_Peak_KB")
+            if stopped is not None:
+                usage["State"] = stopped
+            else:
+                usage["State"] = "COMPLETED" if ret == 0 else "FAILED"
+            save_status(line_num, ret, st, datetime.now(), mycmd, usage)
+            if trace is not None:
+                trace_event(trace, "spawn", spawn_start, spawned[0], line_num)
+                trace_event(trace, "run", spawned[0], run_end, line_num)
+                trace_event(trace, "status", run_end, time.time(), line_num)
+            if ret == 0 and cache_key is not None:
+                record_jobs(args.cache[0], hostname, [cache_key])
+            if (
+                ret == 0
+                or attempt > args.retries[0]
+                or (retry_on is not None and ret not in retry_on)
+                or task_stopping.is_set()
+            ):
+                return ret
+            # back off a little longer every time
+            if task_stopping.wait(args.retry_delay[0] * 2 ** (attempt - 1)):
+                return ret
+            attempt += 1
+
+    def give_up(line_num, mycmd):
+        # the lines of a --dynamic chunk that took down too many workers
+        from dSQQueue import QUEUE_MAX_ATTEMPTS
+
+        print(
+            "[dSQ]: gave up on zero-indexed line {} after {} jobs running it died".format(
+                line_num, QUEUE_MAX_ATTEMPTS
+            ),
+            file=sys.stderr,
+        )
+        now = datetime.now()
+        save_status(line_num, 1, now, now, mycmd, {"State": "FAILED"})
+        return 1
+
+    timeout = args.task_timeout[0] if args.task_timeout is not None else None
+    stall_timeout = None if args.stall_timeout is None else args.stall_timeout[0]
+    new_group = timeout is not None or stall_timeout is not None
+    retry_on = parse_retry_on(args.retry_on)
+    fork_exec = False
+    # jobs that run side by side share the task's cgroup, so they get no cgroup
+    # stats of their own
+    cgroup_per_job = False
+    log_fds = None
+    if args.aggregate_output:
+        from dSQLogs import close_node_log, open_node_log
+
+        log_fds = open_node_log(args.status_dir[0], jid, hostname)
 
+    signal.signal(signal.SIGCONT, forward_signal_to_children)
+    signal.signal(signal.SIGTERM, forward_signal_to_children)
+    if args.dynamic is not None:
+        ret = pull_jobs(args, jid, hostname, chunk_jobs, run_one, give_up)
+        if log_fds is not None:
+            close_node_log(log_fds)
+        if trace is not None:
+            write_trace(trace, args.status_dir[0], jid, hostname)
+        sys.exit(ret)
+
+    line_nums, jobs = chunk_jobs(tid, pack > 1)
+    if len(jobs) == 0:
+        jobs = [(line_nums[0] if len(line_nums) > 0 else tid * pack, "")]
+    # forking isn't safe once other threads are running, so --exec only applies
+    # to tasks that run one job and don't copy its output
+    fork_exec = args.exec and len(jobs) == 1 and log_fds is None
+    cgroup_per_job = len(jobs) == 1
+
+    if len(jobs) == 1:
+        return_codes = [run_one(*jobs[0])]
+    else:
+        # run packed jobs side by side, one per cpu allocated to this task
+        from concurrent.futures import ThreadPoolExecutor
+
+        num_workers = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            return_codes = list(pool.map(lambda job: run_one(*job), jobs))
+
+    # exit with the first failure, if any
+    ret = next((r for r in return_codes if r != 0), 0)
+    if log_fds is not None:
+        close_node_log(log_fds)
+    if trace is not None:
+        write_trace(trace, args.status_dir[0], jid, hostname)
+    if fork_exec:
+        # nothing left to clean up, skip tearing down the interpreter
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(ret % 256)
     sys.exit(ret)
 
 
+def pull_jobs(args, jid, hostname, chunk_jobs, run_one, give_up):
+    from concurrent.futures import ThreadPoolExecutor
+    from dSQQueue import (
+        QUEUE_LEASE,
+        claim_chunk,
+        close_queue,
+        finish_chunk,
+        given_up_chunks,
+        open_queue,
+        renew_leases,
+    )
+
+    worker = "{}:{}:{}".format(
+        hostname, os.getpid(), os.environ.get("SLURM_ARRAY_TASK_ID")
+    )
+    queue = open_queue(args.status_dir[0], jid, args.dynamic[0])
+
+    # keep our leases from running out while we're alive
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(QUEUE_LEASE / 4.0):
+            renew_leases(queue)
+
+    heartbeat_thread = threading.Thread(target=heartbeat)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+
+    def pull():
+        return_codes = []
+        while True:
+            chunk = claim_chunk(queue, worker)
+            for given_up in given_up_chunks(queue):
+                for job in chunk_jobs(given_up, True)[1]:
+                    return_codes.append(give_up(*job))
+            if chunk is None:
+                break
+            for job in chunk_jobs(chunk, True)[1]:
+                return_codes.append(run_one(*job))
+            finish_chunk(queue, chunk)
+        return return_codes
+
+    # one puller per cpu allocated to this task
+    num_workers = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pullers = [pool.submit(pull) for i in range(num_workers)]
+        return_codes = [r for puller in pullers for r in puller.result()]
+    stop_heartbeat.set()
+    close_queue(queue)
+
+    # exit with the first failure, if any
+    return next((r for r in return_codes if r != 0), 0)
+
+
 if __name__ == "__main__":
+    started = time.time()
     args = parse_args()
-    run_job(args)
+    run_job(args, started)
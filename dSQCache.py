@@ -0,0 +1,273 @@
+from __future__ import print_function
+from bisect import bisect_left
+from glob import glob
+from os import path
+from dSQStatus import append_shard, command_key
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+__version__ = 1.05
+
+# with --cache, every job that succeeds is remembered in a cache directory by a
+# hash of its command and of the input files it declares, and dsq leaves out the
+# jobs that are already in it. jobs declare their inputs at the end of their
+# line, e.g.
+#
+#   python fit.py data/a.csv > fit_a.txt # dsq-inputs: data/a.csv params.json
+#
+# the cache is a sorted index of (key, last used) entries that is searched
+# without reading it all, plus one log per node that dSQBatch appends new
+# entries to. dsq cache evict folds the logs into the index and drops entries
+# that haven't been used for a while
+CACHE_INDEX_NAME = "index"
+CACHE_LOG_DIR = "logs"
+CACHE_LOG_SUFFIX = ".log"
+CACHE_LOCK_NAME = "lock"
+CACHE_MAGIC = b"DSQCACHE"
+CACHE_VERSION = 1
+# magic, version, number of entries
+CACHE_HEADER = struct.Struct("<8sH6xQ")
+# md5 of the job, unix time it last succeeded or was skipped
+CACHE_ENTRY = struct.Struct("<16sQ")
+# dsq folds the logs into the index itself once they get this long
+CACHE_COMPACT_ENTRIES = 1 << 20
+CACHE_BY = ["stat", "content"]
+INPUTS_MARKER = "# dsq-inputs:"
+HASH_BLOCK = 1 << 20
+
+
+def job_inputs(cmd):
+    # input files declared at the end of a job line
+    if INPUTS_MARKER not in cmd:
+        return []
+    return cmd.split(INPUTS_MARKER, 1)[1].split()
+
+
+def _input_digest(input_name, by):
+    try:
+        if by == "content":
+            digest = hashlib.md5()
+            with open(input_name, "rb") as input_file:
+                while True:
+                    block = input_file.read(HASH_BLOCK)
+                    if len(block) == 0:
+                        return digest.hexdigest()
+                    digest.update(block)
+        input_stat = os.stat(input_name)
+        return "{}:{}".format(input_stat.st_size, input_stat.st_mtime_ns)
+    except (IOError, OSError):
+        return "missing"
+
+
+def job_key(cmd, by="stat"):
+    # the cache key of a job: its command and the size and mtime (or contents)
+    # of its inputs. relative inputs are relative to the working directory
+    key = hashlib.md5(command_key(cmd))
+    for input_name in sorted(set(job_inputs(cmd))):
+        input_name = path.abspath(input_name)
+        key.update(
+            "\0{}\0{}".format(input_name, _input_digest(input_name, by)).encode()
+        )
+    return key.digest()
+
+
+def _log_name(cache_dir, hostname):
+    return path.join(cache_dir, CACHE_LOG_DIR, hostname + CACHE_LOG_SUFFIX)
+
+
+def record_jobs(cache_dir, hostname, keys, now=None):
+    # remember that the jobs with these keys succeeded, or were just used again
+    if len(keys) == 0:
+        return
+    if now is None:
+        now = int(time.time())
+    log_dir = path.join(cache_dir, CACHE_LOG_DIR)
+    if not path.isdir(log_dir):
+        try:
+            os.makedirs(log_dir)
+        except OSError:
+            pass
+    append_shard(
+        _log_name(cache_dir, hostname),
+        b"".join(CACHE_ENTRY.pack(key, now) for key in keys),
+    )
+
+
+def _log_files(cache_dir):
+    # logs, and any that an interrupted dsq cache evict left behind
+    log_dir = path.join(cache_dir, CACHE_LOG_DIR)
+    return sorted(
+        glob(path.join(log_dir, "*" + CACHE_LOG_SUFFIX))
+        + glob(path.join(log_dir, "*.compacting"))
+    )
+
+
+def _read_log_entries(log_file, entries):
+    data = log_file.read()
+    end = len(data) - len(data) % CACHE_ENTRY.size
+    for key, used in CACHE_ENTRY.iter_unpack(data[:end]):
+        if used > entries.get(key, 0):
+            entries[key] = used
+
+
+def _open_index(cache_dir):
+    # the index mapped into memory and its number of entries, or None
+    try:
+        with open(path.join(cache_dir, CACHE_INDEX_NAME), "rb") as index_file:
+            index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    if len(index_map) < CACHE_HEADER.size:
+        index_map.close()
+        return None
+    magic, version, num_entries = CACHE_HEADER.unpack_from(index_map, 0)
+    if (
+        magic != CACHE_MAGIC
+        or version != CACHE_VERSION
+        or len(index_map) < CACHE_HEADER.size + num_entries * CACHE_ENTRY.size
+    ):
+        index_map.close()
+        return None
+    return index_map, num_entries
+
+
+class _IndexKeys(object):
+    # the keys of the index as a sorted sequence, for bisect
+    def __init__(self, index_map, num_entries):
+        self.index_map = index_map
+        self.num_entries = num_entries
+
+    def __len__(self):
+        return self.num_entries
+
+    def __getitem__(self, i):
+        start = CACHE_HEADER.size + i * CACHE_ENTRY.size
+        return self.index_map[start : start + 16]
+
+
+def find_cached(cache_dir, keys):
+    # the subset of keys that are in the cache
+    found = set()
+    entries = {}
+    for log_name in _log_files(cache_dir):
+        try:
+            with open(log_name, "rb") as log_file:
+                _read_log_entries(log_file, entries)
+        except (IOError, OSError):
+            pass
+    index = _open_index(cache_dir)
+    if index is not None:
+        index_map, num_entries = index
+        keys = set(keys)
+        if len(keys) * num_entries.bit_length() < num_entries:
+            # a few keys, search for each of them
+            index_keys = _IndexKeys(index_map, num_entries)
+            for key in keys:
+                position = bisect_left(index_keys, key)
+                if position < num_entries and index_keys[position] == key:
+                    found.add(key)
+        else:
+            # cheaper to read through the whole index
+            found.update(key for key, used in _iter_index(index) if key in keys)
+        index_map.close()
+    found.update(key for key in keys if key in entries)
+    if len(entries) >= CACHE_COMPACT_ENTRIES:
+        compact_cache(cache_dir)
+    return found
+
+
+def _iter_index(index):
+    if index is None:
+        return iter([])
+    index_map, num_entries = index
+    end = CACHE_HEADER.size + num_entries * CACHE_ENTRY.size
+    return CACHE_ENTRY.iter_unpack(memoryview(index_map)[CACHE_HEADER.size : end])
+
+
+def _merge_entries(index, log_entries):
+    # entries of the index and the logs in key order, one per key
+    log_entries = sorted(log_entries.items())
+    i = 0
+    for key, used in _iter_index(index):
+        while i < len(log_entries) and log_entries[i][0] < key:
+            yield log_entries[i]
+            i += 1
+        if i < len(log_entries) and log_entries[i][0] == key:
+            used = max(used, log_entries[i][1])
+            i += 1
+        yield key, used
+    for entry in log_entries[i:]:
+        yield entry
+
+
+def compact_cache(cache_dir, max_age=None, max_entries=None, now=None):
+    # fold the logs into the index, dropping entries last used more than max_age
+    # seconds ago and the least recently used beyond max_entries. returns the
+    # number of entries kept and dropped
+    if now is None:
+        now = int(time.time())
+    lock_fd = os.open(
+        path.join(cache_dir, CACHE_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644
+    )
+    locked = []
+    index = None
+    try:
+        # only one of us compacts at a time
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        log_entries = {}
+        for log_name in _log_files(cache_dir):
+            if not log_name.endswith(".compacting"):
+                # jobs still running start a new log from here on
+                compacting = "{}.{}.compacting".format(
+                    path.splitext(log_name)[0], os.getpid()
+                )
+                os.rename(log_name, compacting)
+                log_name = compacting
+            log_file = open(log_name, "rb")
+            locked.append((log_name, log_file))
+            # wait for any job that is in the middle of writing to it
+            fcntl.lockf(log_file.fileno(), fcntl.LOCK_SH)
+            _read_log_entries(log_file, log_entries)
+        index = _open_index(cache_dir)
+        oldest = 0 if max_age is None else now - max_age
+        if max_entries is not None:
+            # the last used time of the max_entries-th most recent entry
+            used_times = sorted(
+                (used for key, used in _merge_entries(index, log_entries)),
+                reverse=True,
+            )
+            if len(used_times) > max_entries:
+                oldest = max(
+                    oldest, used_times[max_entries - 1] if max_entries > 0 else now + 1
+                )
+        index_name = path.join(cache_dir, CACHE_INDEX_NAME)
+        tmp_name = "{}.{}.tmp".format(index_name, os.getpid())
+        kept = 0
+        dropped = 0
+        with open(tmp_name, "wb") as index_file:
+            index_file.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, 0))
+            for key, used in _merge_entries(index, log_entries):
+                if used < oldest or (max_entries is not None and kept >= max_entries):
+                    dropped += 1
+                    continue
+                index_file.write(CACHE_ENTRY.pack(key, used))
+                kept += 1
+            index_file.seek(0)
+            index_file.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, kept))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.rename(tmp_name, index_name)
+        # only clean up once the entries are safely in the index
+        for log_name, log_file in locked:
+            os.remove(log_name)
+    finally:
+        if index is not None:
+            index[0].close()
+        for log_name, log_file in locked:
+            log_file.close()
+        os.close(lock_fd)
+    return kept, dropped
@@ -0,0 +1,698 @@
+from __future__ import print_function
+from array import array
+from bisect import bisect_right
+from os import path
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+__version__ = 1.05
+
+# a job file index is a small header followed by the byte offset of the start of
+# every line in the job file, plus one trailing offset for the end of the file.
+# the header ties the index to the job file it was built from. its size and mtime
+# are checked whenever the index is opened. the crc32 of the job file is checked
+# where the whole file is read anyway, i.e. counting its jobs and staging it, and
+# array tasks that only read their own lines check that each one starts and ends
+# at a line break. an index that fails a check is rebuilt, so a job file that was
+# edited after dsq scanned it is never read with a stale index.
+#
+# job files can be compressed with gzip or xz. offsets are then into the
+# decompressed text, and the index ends with a table of where each gzip member or
+# xz stream starts, so a line can be read by decompressing from the start of the
+# one it is in. a job file that is one big member still works, but has to be
+# decompressed from the start; dsq compress writes one that is split into blocks
+INDEX_SUFFIX = ".dsqidx"
+INDEX_MAGIC = b"DSQIDX"
+INDEX_VERSION = 1
+# magic, version, job file size, job file mtime (ns), number of lines,
+# number of runnable jobs, crc32 of the job file as it is on disk, number of
+# compressed blocks
+INDEX_HEADER = struct.Struct("<6sHQqQQII")
+INDEX_OFFSET = struct.Struct("<QQ")
+# offset in the job file, offset in the decompressed text
+INDEX_BLOCK = struct.Struct("<QQ")
+COMPRESSION_MAGIC = [("gzip", b"\x1f\x8b"), ("xz", b"\xfd7zXZ\x00")]
+# uncompressed size of each block dsq compress writes
+COMPRESS_BLOCK = 1 << 20
+READ_BLOCK = 1 << 20
+
+
+def is_job_line(line):
+    # empty lines or lines that begin with # are not jobs
+    return not (line.startswith(b"#") or line.rstrip() == b"")
+
+
+def index_file_name(job_file_name):
+    return job_file_name + INDEX_SUFFIX
+
+
+def job_file_compression(job_file):
+    # "gzip", "xz" or None, from the first bytes of an open job file
+    start = job_file.read(6)
+    job_file.seek(0)
+    for compression, magic in COMPRESSION_MAGIC:
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def _decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=31)
+    import lzma
+
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+def _decompress_file(job_file, compression, crc):
+    # decompress the rest of a job file, yielding the offset each gzip member or
+    # xz stream starts at (or None) with each piece of decompressed text. crc[0]
+    # is updated with every byte read
+    offset = job_file.tell()
+    decompressor = None
+    data = b""
+    while True:
+        if len(data) == 0:
+            data = job_file.read(READ_BLOCK)
+            if len(data) == 0:
+                break
+            crc[0] = zlib.crc32(data, crc[0])
+        block_start = None
+        if decompressor is None:
+            # gzip and xz allow zero padding between blocks
+            unpadded = data.lstrip(b"\0")
+            offset += len(data) - len(unpadded)
+            data = unpadded
+            if len(data) == 0:
+                continue
+            decompressor = _decompressor(compression)
+            block_start = offset
+        try:
+            text = decompressor.decompress(data)
+        except Exception as e:
+            raise ValueError(
+                "{} is not valid {}: {}".format(job_file.name, compression, e)
+            )
+        if decompressor.eof:
+            offset += len(data) - len(decompressor.unused_data)
+            data = decompressor.unused_data
+            decompressor = None
+        else:
+            offset += len(data)
+            data = b""
+        yield block_start, text
+    if decompressor is not None:
+        raise ValueError("{} is truncated".format(job_file.name))
+
+
+def open_job_file(job_file_name, mode="rb"):
+    # open a job file, plain or compressed, to read through it once
+    with open(job_file_name, "rb") as job_file:
+        compression = job_file_compression(job_file)
+    if compression == "gzip":
+        import gzip
+
+        return gzip.open(job_file_name, mode)
+    elif compression == "xz":
+        import lzma
+
+        return lzma.open(job_file_name, mode)
+    return open(job_file_name, mode)
+
+
+def compress_job_file(job_file_name, compressed_name, compression="gzip"):
+    # write a copy of a job file compressed in blocks of about COMPRESS_BLOCK,
+    # each ending at the end of a line, so dSQBatch only decompresses one
+    if compression == "gzip":
+        import gzip
+
+        compress = gzip.compress
+    else:
+        import lzma
+
+        compress = lzma.compress
+    tmp_name = "{}.{}.tmp".format(compressed_name, os.getpid())
+    try:
+        with open(job_file_name, "rb") as job_file, open(tmp_name, "wb") as out_file:
+            block = []
+            block_size = 0
+            for line in job_file:
+                block.append(line)
+                block_size += len(line)
+                if block_size >= COMPRESS_BLOCK:
+                    out_file.write(compress(b"".join(block)))
+                    block = []
+                    block_size = 0
+            if block_size > 0:
+                out_file.write(compress(b"".join(block)))
+        os.rename(tmp_name, compressed_name)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def write_index(index_name, job_file_stat, offsets, num_jobs, crc, blocks=()):
+    # write to a temporary file first so readers never see a partial index
+    tmp_name = "{}.{}.tmp".format(index_name, os.getpid())
+    try:
+        with open(tmp_name, "wb") as index_file:
+            index_file.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    INDEX_VERSION,
+                    job_file_stat.st_size,
+                    job_file_stat.st_mtime_ns,
+                    len(offsets) - 1,
+                    num_jobs,
+                    crc,
+                    len(blocks),
+                )
+            )
+            offsets = array("Q", offsets)
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            offsets.tofile(index_file)
+            for block in blocks:
+                index_file.write(INDEX_BLOCK.pack(*block))
+        os.rename(tmp_name, index_name)
+    except (IOError, OSError):
+        # the index is only an optimization, dSQBatch will scan the job file without it
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def scan_job_file(job_file_name, write_index_file=True):
+    # read through the job file once, returning the zero-indexed line numbers of
+    # all jobs and writing a byte offset index of every line next to the job file
+    job_id_list = []
+    offsets = array("Q", [0])
+    crc = 0
+    blocks = []
+    with open(job_file_name, "rb") as job_file:
+        job_file_stat = os.fstat(job_file.fileno())
+        compression = job_file_compression(job_file)
+        if compression is None:
+            for i, line in enumerate(job_file):
+                if is_job_line(line):
+                    job_id_list.append(i)
+                offsets.append(offsets[-1] + len(line))
+                crc = zlib.crc32(line, crc)
+        else:
+            # the same, on the decompressed text, noting where each block starts
+            crc = [0]
+            partial = b""
+            for block_start, text in _decompress_file(job_file, compression, crc):
+                if block_start is not None:
+                    blocks.append((block_start, offsets[-1] + len(partial)))
+                lines = (partial + text).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    if is_job_line(line):
+                        job_id_list.append(len(offsets) - 1)
+                    offsets.append(offsets[-1] + len(line) + 1)
+            if len(partial) > 0:
+                if is_job_line(partial):
+                    job_id_list.append(len(offsets) - 1)
+                offsets.append(offsets[-1] + len(partial))
+            crc = crc[0]
+    if write_index_file:
+        write_index(
+            index_file_name(job_file_name),
+            job_file_stat,
+            offsets,
+            len(job_id_list),
+            crc,
+            blocks,
+        )
+    return job_id_list
+
+
+def read_index_header(index_map, job_file_stat):
+    # return the index header if it is valid for this job file, otherwise None
+    if len(index_map) < INDEX_HEADER.size:
+        return None
+    header = INDEX_HEADER.unpack_from(index_map, 0)
+    magic, version, size, mtime_ns, num_lines = header[:5]
+    if (
+        magic != INDEX_MAGIC
+        or version != INDEX_VERSION
+        or size != job_file_stat.st_size
+        or mtime_ns != job_file_stat.st_mtime_ns
+        or len(index_map)
+        < INDEX_HEADER.size + (num_lines + 1) * 8 + header[7] * INDEX_BLOCK.size
+    ):
+        return None
+    return header
+
+
+def job_file_crc(job_file_name):
+    # crc32 of the job file as it is on disk, as saved in its index
+    crc = 0
+    with open(job_file_name, "rb") as job_file:
+        while True:
+            block = job_file.read(STAGE_BLOCK)
+            if len(block) == 0:
+                return crc
+            crc = zlib.crc32(block, crc)
+
+
+def count_jobs(job_file_name):
+    # number of jobs in a job file, from its index if that is up to date
+    try:
+        job_file_stat = os.stat(job_file_name)
+        with open(index_file_name(job_file_name), "rb") as index_file:
+            index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = read_index_header(index_map, job_file_stat)
+        finally:
+            index_map.close()
+    except (IOError, OSError, ValueError):
+        return len(scan_job_file(job_file_name, write_index_file=False))
+    if header is not None and header[6] == job_file_crc(job_file_name):
+        return header[5]
+    # the index is stale or corrupt, make a new one
+    return len(scan_job_file(job_file_name))
+
+
+def _lookup_offsets(job_file_name, line_nums):
+    # use the index to find the byte range of each requested line, the
+    # compressed blocks if there are any, and the length of the (decompressed)
+    # text. returns None if there is no usable index, so callers can fall back to
+    # scanning
+    try:
+        job_file_stat = os.stat(job_file_name)
+        with open(index_file_name(job_file_name), "rb") as index_file:
+            index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        header = read_index_header(index_map, job_file_stat)
+        if header is None:
+            return None
+        num_lines = header[4]
+        ranges = {}
+        for line_num in line_nums:
+            if 0 <= line_num < num_lines:
+                ranges[line_num] = INDEX_OFFSET.unpack_from(
+                    index_map, INDEX_HEADER.size + line_num * 8
+                )
+        blocks_start = INDEX_HEADER.size + (num_lines + 1) * 8
+        blocks = [
+            INDEX_BLOCK.unpack_from(index_map, blocks_start + i * INDEX_BLOCK.size)
+            for i in range(header[7])
+        ]
+        text_size = struct.unpack_from("<Q", index_map, blocks_start - 8)[0]
+        return ranges, blocks, text_size
+    finally:
+        index_map.close()
+
+
+def _read_compressed_ranges(job_file, compression, blocks, ranges):
+    # the decompressed text of each byte range, decompressing from the start of
+    # the block it begins in. ranges in the same block share one pass over it
+    import gzip
+    import lzma
+
+    block_texts = [block[1] for block in blocks]
+    texts = {}
+    stream = None
+    stream_start = 0
+    stream_pos = 0
+    for line_num, (start, end) in sorted(ranges.items(), key=lambda r: r[1]):
+        block = blocks[max(bisect_right(block_texts, start) - 1, 0)]
+        if stream is None or stream_pos > start or block[1] > stream_pos:
+            job_file.seek(block[0])
+            if compression == "gzip":
+                stream = gzip.GzipFile(fileobj=job_file, mode="rb")
+            else:
+                stream = lzma.LZMAFile(job_file, "rb")
+            stream_start = block[1]
+        stream.seek(start - stream_start)
+        texts[line_num] = stream.read(end - start)
+        stream_pos = end
+    return texts
+
+
+def read_lines(job_file_name, line_nums):
+    # return a dict of line number to stripped line for the requested zero-indexed
+    # lines. lines that don't exist in the job file map to an empty string.
+    lines = dict((n, "") for n in line_nums)
+    index = _lookup_offsets(job_file_name, line_nums)
+    if index is not None:
+        ranges, blocks, text_size = index
+        # read from the end of the line before, to check the index is right
+        spans = dict(
+            (line_num, (max(start - 1, 0), end))
+            for line_num, (start, end) in ranges.items()
+        )
+        with open(job_file_name, "rb") as job_file:
+            compression = job_file_compression(job_file)
+            if compression is not None:
+                if len(blocks) == 0:
+                    blocks = [(0, 0)]
+                texts = _read_compressed_ranges(job_file, compression, blocks, spans)
+            else:
+                texts = {}
+                for line_num, (start, end) in spans.items():
+                    job_file.seek(start)
+                    texts[line_num] = job_file.read(end - start)
+        if all(
+            (start == 0 or texts[line_num][:1] == b"\n")
+            and (end == text_size or texts[line_num][-1:] == b"\n")
+            for line_num, (start, end) in ranges.items()
+        ):
+            for line_num, (start, end) in ranges.items():
+                lines[line_num] = texts[line_num][1 if start > 0 else 0 :]
+                lines[line_num] = lines[line_num].decode().strip()
+            return lines
+        # the index doesn't match the job file after all, make a new one
+        scan_job_file(job_file_name)
+    # no usable index, scan the job file
+    remaining = len(lines)
+    last_line = max(lines) if lines else -1
+    with open_job_file(job_file_name) as job_file:
+        for i, line in enumerate(job_file):
+            if i in lines:
+                lines[i] = line.decode().strip()
+                remaining -= 1
+            if remaining == 0 or i >= last_line:
+                break
+    return lines
+
+
+# with --stage, the first array task on a node copies the job file and its index
+# to node-local storage and the rest read that copy instead of the shared
+# filesystem. copies are named after the job file's path, size, mtime and the
+# crc32 of its contents from the index, so an edited job file gets a new copy.
+# every task holds a shared flock on the copy's lock file while it runs, and
+# touches it. whoever makes a new copy removes the ones no task has used for
+# STAGE_KEEP seconds and no task holds a lock on, so they don't pile up in memory
+STAGE_DIR = "dsq-{}"
+STAGE_BLOCK = 1 << 20
+STAGE_LOCK_SUFFIX = ".lock"
+STAGE_KEEP = 24 * 60 * 60
+# lock files of the copies this task uses, open until it exits
+_stage_locks = []
+
+
+def default_stage_dir():
+    for stage_dir in ["/dev/shm", os.environ.get("TMPDIR"), "/tmp"]:
+        if stage_dir and os.access(stage_dir, os.W_OK | os.X_OK):
+            return stage_dir
+    return None
+
+
+def _copy_file(src_file, dst_name):
+    # returns the crc32 of what was copied
+    crc = 0
+    with open(dst_name, "wb") as dst_file:
+        while True:
+            block = src_file.read(STAGE_BLOCK)
+            if len(block) == 0:
+                return crc
+            crc = zlib.crc32(block, crc)
+            dst_file.write(block)
+
+
+def _index_crc(index_file, job_file_stat):
+    # crc32 of the job file contents saved in its index, or None if the index
+    # is out of date
+    header = index_file.read(INDEX_HEADER.size)
+    if len(header) < INDEX_HEADER.size:
+        return None
+    magic, version, size, mtime_ns, num_lines, num_jobs, crc = INDEX_HEADER.unpack(
+        header
+    )[:7]
+    if (
+        magic != INDEX_MAGIC
+        or version != INDEX_VERSION
+        or size != job_file_stat.st_size
+        or mtime_ns != job_file_stat.st_mtime_ns
+    ):
+        return None
+    return crc
+
+
+def _open_stage_lock(lock_name):
+    # an fd of the lock file, locked shared. whoever removes a copy holds it
+    # exclusively and unlinks it last, so one we got after that is stale
+    import fcntl
+
+    while True:
+        lock_fd = os.open(lock_name, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        if os.fstat(lock_fd).st_nlink > 0:
+            return lock_fd
+        os.close(lock_fd)
+
+
+def remove_unused_copies(local_dir, keep=STAGE_KEEP):
+    # copies no task has used for keep seconds or holds a lock on, with their
+    # index and anything a task that died while copying them left behind
+    import fcntl
+    import time
+
+    names = os.listdir(local_dir)
+    now = time.time()
+    for name in names:
+        if not name.endswith(STAGE_LOCK_SUFFIX):
+            continue
+        lock_name = path.join(local_dir, name)
+        try:
+            if os.stat(lock_name).st_mtime + keep > now:
+                continue
+            lock_fd = os.open(lock_name, os.O_RDWR)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            copy_name = name[: -len(STAGE_LOCK_SUFFIX)]
+            for staged_name in names:
+                if staged_name != name and (
+                    staged_name == copy_name or staged_name.startswith(copy_name + ".")
+                ):
+                    os.remove(path.join(local_dir, staged_name))
+            os.remove(lock_name)
+        except (IOError, OSError):
+            # a task is still using it
+            pass
+        finally:
+            os.close(lock_fd)
+
+
+def stage_job_file(job_file_name, stage_dir):
+    # name of an up to date copy of the job file in stage_dir, made if there
+    # isn't one yet. falls back to the job file itself if it can't be staged
+    import fcntl
+    import hashlib
+
+    job_file = None
+    index_file = None
+    tmp_names = []
+    try:
+        job_file = open(job_file_name, "rb")
+        job_file_stat = os.fstat(job_file.fileno())
+        crc = None
+        try:
+            index_file = open(index_file_name(job_file_name), "rb")
+            crc = _index_crc(index_file, job_file_stat)
+        except (IOError, OSError):
+            pass
+        key = hashlib.md5(
+            "{}\0{}\0{}\0{}".format(
+                path.abspath(job_file_name),
+                job_file_stat.st_size,
+                job_file_stat.st_mtime_ns,
+                crc,
+            ).encode()
+        ).hexdigest()[:16]
+        local_dir = path.join(stage_dir, STAGE_DIR.format(os.getuid()))
+        local_name = path.join(
+            local_dir, "{}.{}".format(path.basename(job_file_name), key)
+        )
+        try:
+            os.mkdir(local_dir, 0o700)
+        except OSError:
+            pass
+        lock_name = local_name + STAGE_LOCK_SUFFIX
+        lock_fd = _open_stage_lock(lock_name)
+        try:
+            if not path.isfile(local_name):
+                # only one task per node copies, the others wait for it
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                if not path.isfile(local_name):
+                    _copy_job_file(
+                        job_file_name, job_file, index_file, crc, local_name, tmp_names
+                    )
+                    remove_unused_copies(local_dir)
+                fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            # keep it from being removed while we run
+            os.utime(lock_name, None)
+            _stage_locks.append(lock_fd)
+            return local_name
+        except BaseException:
+            os.close(lock_fd)
+            raise
+    except (IOError, OSError):
+        for tmp_name in tmp_names:
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+        return job_file_name
+    finally:
+        for staged_file in [job_file, index_file]:
+            if staged_file is not None:
+                staged_file.close()
+
+
+def _copy_job_file(job_file_name, job_file, index_file, crc, local_name, tmp_names):
+    job_file_stat = os.fstat(job_file.fileno())
+    tmp_name = "{}.{}.tmp".format(local_name, os.getpid())
+    tmp_names.append(tmp_name)
+    copy_crc = _copy_file(job_file, tmp_name)
+    if crc is not None and copy_crc != crc:
+        # it changed while we were copying it, or its index is stale. either
+        # way, tasks read the job file itself, which checks the lines it reads
+        raise IOError("{} changed".format(job_file_name))
+    # keep the mtime, so the index still matches the copy
+    os.utime(tmp_name, ns=(job_file_stat.st_atime_ns, job_file_stat.st_mtime_ns))
+    if crc is not None:
+        index_file.seek(0)
+        tmp_names.append(index_file_name(tmp_name))
+        _copy_file(index_file, tmp_names[-1])
+        os.rename(tmp_names[-1], index_file_name(local_name))
+    # the copy only shows up once it is complete
+    os.rename(tmp_name, local_name)
+
+
+# array jobs that don't map one array index to one job file line leave a small
+# manifest next to their status file, so dSQAutopsy can map indices back to lines
+MANIFEST_NAME = "job_{}_manifest.json"
+
+
+def manifest_file_name(status_dir, job_id):
+    return path.join(status_dir, MANIFEST_NAME.format(job_id))
+
+
+def write_manifest(status_dir, job_id, manifest):
+    # every task of the array tries, only the first one to get here writes it
+    try:
+        fd = os.open(
+            manifest_file_name(status_dir, job_id),
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+            0o644,
+        )
+    except OSError:
+        return False
+    import json
+
+    with os.fdopen(fd, "w") as manifest_file:
+        json.dump(manifest, manifest_file, sort_keys=True)
+    return True
+
+
+def read_manifest(status_dir, job_id):
+    import json
+
+    try:
+        with open(manifest_file_name(status_dir, job_id), "r") as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def task_lines(task_id, pack=1):
+    # zero-indexed job file lines run by one array task
+    return range(task_id * pack, (task_id + 1) * pack)
+
+
+def find_run_manifests(status_dir, run_ids):
+    # the manifests of every job array that saves its stats as one of run_ids,
+    # by job id
+    run_ids = [str(run_id) for run_id in run_ids]
+    manifests = dict((run_id, read_manifest(status_dir, run_id)) for run_id in run_ids)
+    from glob import glob
+
+    prefix, suffix = MANIFEST_NAME.split("{}")
+    for name in glob(path.join(status_dir, MANIFEST_NAME.format("*"))):
+        job_id = path.basename(name)[len(prefix) : -len(suffix)]
+        manifest = read_manifest(status_dir, job_id)
+        if str(manifest.get("run_id")) in run_ids:
+            manifests[job_id] = manifest
+    return manifests
+
+
+def run_num_jobs(status_dir, run_id):
+    # the number of jobs dsq submitted for a run, or None until one of its
+    # arrays has saved its manifest
+    for manifest in find_run_manifests(status_dir, [run_id]).values():
+        if manifest.get("num_jobs") is not None:
+            return manifest["num_jobs"]
+    return None
+
+
+# a line map lists the job file lines to run in the order they should run, for
+# arrays that only run some of the lines. array index i runs the lines at
+# positions i*pack to i*pack+pack-1 of the map instead of those line numbers
+MAP_MAGIC = b"DSQMAP"
+MAP_VERSION = 1
+# magic, version, number of lines in the map
+MAP_HEADER = struct.Struct("<6sHQ")
+MAP_NO_LINE = 2**64 - 1
+
+
+def write_line_map(map_name, line_nums):
+    tmp_name = "{}.{}.tmp".format(map_name, os.getpid())
+    with open(tmp_name, "wb") as map_file:
+        line_nums = array("Q", line_nums)
+        map_file.write(MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, len(line_nums)))
+        if sys.byteorder != "little":
+            line_nums.byteswap()
+        line_nums.tofile(map_file)
+    os.rename(tmp_name, map_name)
+
+
+def read_line_map(map_name, positions):
+    # the job file lines at the given positions of the map, skipping positions
+    # past its end
+    line_nums = []
+    with open(map_name, "rb") as map_file:
+        map_data = mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, num_lines = MAP_HEADER.unpack_from(map_data, 0)
+        if magic != MAP_MAGIC or version != MAP_VERSION:
+            raise ValueError("{} is not a dSQ line map".format(map_name))
+        for position in positions:
+            if 0 <= position < num_lines:
+                line_num = struct.unpack_from(
+                    "<Q", map_data, MAP_HEADER.size + position * 8
+                )[0]
+                if line_num != MAP_NO_LINE:
+                    line_nums.append(line_num)
+    finally:
+        map_data.close()
+    return line_nums
+
+
+def task_positions(low, high, step, manifest):
+    # the positions run by every step-th array index from low to high of an
+    # array, as inclusive (low, high, step) ranges. positions are job file lines,
+    # or places in the manifest's line map if it has one. a stepped range of
+    # packed tasks is one stepped range per place in the pack
+    pack = manifest.get("pack", 1)
+    low = (low + manifest.get("offset", 0)) * pack
+    high = (high + manifest.get("offset", 0)) * pack
+    if step == 1 or low == high:
+        return [(low, high + pack - 1, 1)]
+    return [(low + k, high + k, step * pack) for k in range(pack)]
@@ -0,0 +1,142 @@
+from __future__ import print_function
+from glob import glob
+from os import path
+import fcntl
+import os
+import struct
+import threading
+
+__version__ = 1.05
+
+# with --aggregate-output, jobs don't get a slurm output file each. dSQBatch
+# copies their output into one log per node instead, a chunk at a time so a job
+# that prints a lot never has to fit in memory. every chunk is a record: a
+# header with the job file line, attempt and stream, then the data. a small
+# index next to each log lists where every record's data is, so one job's output
+# can be found without reading the whole log
+LOG_DIR = "job_{}_logs"
+LOG_SUFFIX = ".log"
+LOG_INDEX_SUFFIX = ".idx"
+LOG_MAGIC = b"DSQL"
+# magic, job file line, attempt, stream, length of data
+LOG_RECORD = struct.Struct("<4sQHBI")
+# job file line, attempt, stream, offset of data in the log, length of data
+LOG_INDEX = struct.Struct("<QHBQI")
+LOG_STDOUT = 1
+LOG_STDERR = 2
+LOG_CHUNK = 65536
+
+# lockf only keeps other processes out, jobs running side by side in this one
+# take turns with this
+_log_lock = threading.Lock()
+
+
+def log_dir_name(status_dir, job_id):
+    return path.join(status_dir, LOG_DIR.format(job_id))
+
+
+def open_node_log(status_dir, job_id, hostname):
+    # the log and index that jobs running on this node append to
+    log_dir = log_dir_name(status_dir, job_id)
+    if not path.isdir(log_dir):
+        try:
+            os.mkdir(log_dir)
+        except OSError:
+            pass
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+    log_fd = os.open(path.join(log_dir, hostname + LOG_SUFFIX), flags, 0o644)
+    index_fd = os.open(path.join(log_dir, hostname + LOG_INDEX_SUFFIX), flags, 0o644)
+    return log_fd, index_fd
+
+
+def close_node_log(log_fds):
+    for fd in log_fds:
+        os.close(fd)
+
+
+def _write_all(fd, data):
+    while len(data) > 0:
+        data = data[os.write(fd, data) :]
+
+
+def write_log_record(log_fds, line_num, stream, data, attempt=1):
+    log_fd, index_fd = log_fds
+    with _log_lock:
+        fcntl.lockf(log_fd, fcntl.LOCK_EX)
+        try:
+            offset = os.lseek(log_fd, 0, os.SEEK_END) + LOG_RECORD.size
+            _write_all(
+                log_fd,
+                LOG_RECORD.pack(LOG_MAGIC, line_num, attempt, stream, len(data)) + data,
+            )
+            _write_all(
+                index_fd, LOG_INDEX.pack(line_num, attempt, stream, offset, len(data))
+            )
+        finally:
+            fcntl.lockf(log_fd, fcntl.LOCK_UN)
+
+
+def copy_to_log(pipe, log_fds, line_num, stream, attempt=1):
+    # copy a job's stdout or stderr pipe to the log until the job closes it
+    try:
+        while True:
+            data = os.read(pipe.fileno(), LOG_CHUNK)
+            if len(data) == 0:
+                break
+            write_log_record(log_fds, line_num, stream, data, attempt)
+    finally:
+        pipe.close()
+
+
+def _index_records(log_name):
+    # (line, attempt, stream, offset, length) of every record in a log, from its
+    # index if there is one, otherwise by reading through the log
+    index_name = path.splitext(log_name)[0] + LOG_INDEX_SUFFIX
+    if path.isfile(index_name):
+        with open(index_name, "rb") as index_file:
+            while True:
+                index_data = index_file.read(LOG_INDEX.size * 4096)
+                # leave off a record that is still being written
+                end = len(index_data) - len(index_data) % LOG_INDEX.size
+                for record in LOG_INDEX.iter_unpack(index_data[:end]):
+                    yield record
+                if len(index_data) < LOG_INDEX.size * 4096:
+                    return
+    with open(log_name, "rb") as log_file:
+        offset = 0
+        while True:
+            header = log_file.read(LOG_RECORD.size)
+            if len(header) < LOG_RECORD.size:
+                break
+            magic, line_num, attempt, stream, length = LOG_RECORD.unpack(header)
+            if magic != LOG_MAGIC:
+                break
+            offset += LOG_RECORD.size
+            yield line_num, attempt, stream, offset, length
+            offset += length
+            log_file.seek(offset)
+
+
+def iter_task_output(status_dir, job_id, line_num, attempt=None):
+    # (attempt, stream, data) of every chunk of output of one job file line, or
+    # of one attempt at it. attempts come one after the other even if they ran
+    # on different nodes, each in the order it was written
+    records = []
+    for log_name in sorted(glob(path.join(log_dir_name(status_dir, job_id), "*.log"))):
+        for record in _index_records(log_name):
+            if record[0] == line_num and attempt in [None, record[1]]:
+                records.append((record[1], log_name) + record[2:])
+    # sorting is stable, so chunks of an attempt stay in order
+    records.sort(key=lambda record: record[0])
+    log_file = None
+    try:
+        for record_attempt, log_name, stream, offset, length in records:
+            if log_file is None or log_file.name != log_name:
+                if log_file is not None:
+                    log_file.close()
+                log_file = open(log_name, "rb")
+            log_file.seek(offset)
+            yield record_attempt, stream, log_file.read(length)
+    finally:
+        if log_file is not None:
+            log_file.close()
@@ -0,0 +1,225 @@
+from __future__ import print_function
+from os import path
+import errno
+import os
+import threading
+import time
+
+__version__ = 1.05
+
+# with --dynamic, the array tasks don't each run a fixed part of the job file.
+# they pull chunks of it from a queue instead, so a long job only holds up the
+# task running it. chunk i is what array index i would have run without
+# --dynamic. the queue is a directory of small files in the status dir, which is
+# usually on a network filesystem where locks can't be trusted. so nothing is
+# ever locked or rewritten in place, a worker claims a chunk by creating its
+# lease file with O_EXCL, which only one worker can do:
+#
+#   <chunk>.<attempt>.lease  a worker is running (or ran) this attempt
+#   <worker>.done            the chunks a worker finished, one per line
+#   <chunk>.failed           the chunk was given up on
+#
+# every file made on a network filesystem costs a round trip to its metadata
+# server, so a chunk only makes its lease. a worker appends the chunks it
+# finished to a log of its own, which is only read when looking for stale
+# leases. a worker touches its lease files while it is alive, so the chunks of a
+# worker that died are handed out again under the next attempt once their
+# leases go stale. chunks are handed out in order, the next file only tells
+# workers where to start looking and is rewritten every QUEUE_NEXT_EVERY chunks
+QUEUE_DIR_NAME = "job_{}_queue"
+# seconds a lease lasts without being renewed
+QUEUE_LEASE = 120
+# give up on a chunk after it took down this many workers
+QUEUE_MAX_ATTEMPTS = 3
+# a worker that starts from an old next file tries at most this many taken chunks
+QUEUE_NEXT_EVERY = 32
+
+LEASE_SUFFIX = ".lease"
+DONE_SUFFIX = ".done"
+FAILED_SUFFIX = ".failed"
+NEXT_NAME = "next"
+CLOCK_NAME = "clock"
+
+
+def queue_dir_name(status_dir, job_id):
+    return path.join(status_dir, QUEUE_DIR_NAME.format(job_id))
+
+
+def open_queue(status_dir, job_id, num_chunks):
+    # a queue can be shared by the threads of a worker
+    queue_dir = queue_dir_name(status_dir, job_id)
+    try:
+        os.mkdir(queue_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return {
+        "dir": queue_dir,
+        "num_chunks": num_chunks,
+        "next": 0,
+        "leases": {},
+        "given_up": [],
+        "done_fd": None,
+        "worker": None,
+        "lock": threading.Lock(),
+    }
+
+
+def _create(file_name, text=""):
+    # True if we made the file, False if it was already there
+    try:
+        fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    try:
+        os.write(fd, text.encode())
+    finally:
+        os.close(fd)
+    return True
+
+
+def _take_lease(queue, worker, chunk, attempt):
+    lease_file = path.join(queue["dir"], "{}.{}{}".format(chunk, attempt, LEASE_SUFFIX))
+    if not _create(lease_file, worker + "\n"):
+        return False
+    with queue["lock"]:
+        queue["leases"][chunk] = lease_file
+    return True
+
+
+def _read_next(queue):
+    try:
+        with open(path.join(queue["dir"], NEXT_NAME)) as next_file:
+            return int(next_file.read())
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def _write_next(queue, worker, chunk):
+    # only a hint, a worker that reads an old one just tries a few taken chunks
+    next_file = path.join(queue["dir"], NEXT_NAME)
+    tmp_file = "{}.{}.{}".format(next_file, worker, threading.current_thread().ident)
+    try:
+        with open(tmp_file, "w") as f:
+            f.write(str(chunk))
+        os.rename(tmp_file, next_file)
+    except (IOError, OSError):
+        pass
+
+
+def _now(queue):
+    # lease files are stamped by the file server's clock, so compare them with
+    # that rather than this node's
+    clock_file = path.join(queue["dir"], CLOCK_NAME)
+    try:
+        _create(clock_file)
+        os.utime(clock_file, None)
+        return os.stat(clock_file).st_mtime
+    except OSError:
+        return time.time()
+
+
+def _read_done(done_name, finished):
+    # add the chunks in a worker's done log to finished, leaving out a line
+    # that is still being written
+    try:
+        with open(done_name) as done_file:
+            for l in done_file:
+                if l.endswith("\n"):
+                    finished.add(int(l))
+    except (IOError, OSError, ValueError):
+        pass
+
+
+def _claim_stale(queue, worker, lease):
+    leases = {}
+    finished = set()
+    for name in os.listdir(queue["dir"]):
+        parts = name.split(".")
+        if name.endswith(DONE_SUFFIX):
+            _read_done(path.join(queue["dir"], name), finished)
+        elif name.endswith(LEASE_SUFFIX) and len(parts) == 3:
+            chunk, attempt = int(parts[0]), int(parts[1])
+            if attempt > leases.get(chunk, 0):
+                leases[chunk] = attempt
+        elif name.endswith(FAILED_SUFFIX):
+            finished.add(int(parts[0]))
+    now = _now(queue)
+    for chunk, attempt in sorted(leases.items()):
+        if chunk in finished or chunk in queue["leases"]:
+            continue
+        lease_file = path.join(
+            queue["dir"], "{}.{}{}".format(chunk, attempt, LEASE_SUFFIX)
+        )
+        try:
+            if os.stat(lease_file).st_mtime + lease >= now:
+                continue
+        except OSError:
+            continue
+        if attempt >= QUEUE_MAX_ATTEMPTS:
+            # whoever marks it failed reports it
+            if _create(path.join(queue["dir"], "{}{}".format(chunk, FAILED_SUFFIX))):
+                with queue["lock"]:
+                    queue["given_up"].append(chunk)
+            continue
+        if _take_lease(queue, worker, chunk, attempt + 1):
+            return chunk
+    return None
+
+
+def claim_chunk(queue, worker, lease=QUEUE_LEASE):
+    # the next chunk for worker to run, or None if there is nothing left.
+    # chunks whose lease went stale are only looked for once no chunk is left
+    # that hasn't been tried
+    queue["worker"] = worker
+    chunk = max(queue["next"], _read_next(queue))
+    while chunk < queue["num_chunks"]:
+        if _take_lease(queue, worker, chunk, 1):
+            queue["next"] = chunk + 1
+            if (chunk + 1) % QUEUE_NEXT_EVERY == 0:
+                _write_next(queue, worker, chunk + 1)
+            return chunk
+        chunk += 1
+    queue["next"] = chunk
+    return _claim_stale(queue, worker, lease)
+
+
+def renew_leases(queue):
+    with queue["lock"]:
+        lease_files = list(queue["leases"].values())
+    for lease_file in lease_files:
+        try:
+            os.utime(lease_file, None)
+        except OSError:
+            pass
+
+
+def finish_chunk(queue, chunk):
+    with queue["lock"]:
+        if queue["done_fd"] is None:
+            done_name = path.join(
+                queue["dir"], "{}{}".format(queue["worker"], DONE_SUFFIX)
+            )
+            queue["done_fd"] = os.open(
+                done_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+        # one write, so a reader sees whole lines
+        os.write(queue["done_fd"], "{}\n".format(chunk).encode())
+        queue["leases"].pop(chunk, None)
+
+
+def close_queue(queue):
+    with queue["lock"]:
+        if queue["done_fd"] is not None:
+            os.close(queue["done_fd"])
+            queue["done_fd"] = None
+
+
+def given_up_chunks(queue):
+    # chunks this worker gave up on since it last asked
+    with queue["lock"]:
+        chunks = queue["given_up"]
+        queue["given_up"] = []
+    return chunks
@@ -0,0 +1,107 @@
+from __future__ import print_function
+from os import path
+from subprocess import check_output
+import hashlib
+import json
+import os
+import shutil
+import time
+
+__version__ = 1.05
+
+# dsq needs a couple of limits from the slurm config to size job arrays. asking
+# slurmctld for them can take seconds when it is busy, so they are saved to a
+# small cache file for a while. they can also be set in the environment, which
+# skips scontrol altogether
+SLURM_LIMITS = {
+    "MaxArraySize": "DSQ_MAX_ARRAY_SIZE",
+    "MaxJobCount": "DSQ_MAX_JOB_COUNT",
+}
+# seconds to trust the cache for, DSQ_SLURM_CONF_TTL=0 turns it off
+SLURM_CONF_TTL = 3600
+# what this process already looked up, so submitting many job files at once
+# from python reads the config once
+_looked_up = {}
+
+
+def slurm_conf_cache_name():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or path.join(
+        path.expanduser("~"), ".cache"
+    )
+    # home directories can be shared by several clusters, keep one cache for
+    # each slurm config and domain, and for each scontrol so a stand-in one on
+    # the PATH doesn't leave its limits for the real one
+    domain = os.uname()[1].partition(".")[2]
+    conf_key = hashlib.md5(
+        "{}\0{}\0{}".format(
+            os.environ.get("SLURM_CONF", ""), domain, shutil.which("scontrol")
+        ).encode()
+    ).hexdigest()[:12]
+    return path.join(cache_dir, "dsq", "slurm_conf_{}.json".format(conf_key))
+
+
+def read_slurm_conf():
+    # every setting scontrol show conf prints, as strings
+    conf = {}
+    for l in check_output(["scontrol", "show", "conf"], universal_newlines=True).split(
+        "\n"
+    ):
+        key, sep, value = l.partition("=")
+        if sep != "":
+            conf[key.strip()] = value.strip()
+    return conf
+
+
+def _read_cache(cache_name, ttl):
+    try:
+        if time.time() - os.stat(cache_name).st_mtime >= ttl:
+            return None
+        with open(cache_name, "r") as cache_file:
+            cached = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if not all(isinstance(cached.get(key), int) for key in SLURM_LIMITS):
+        return None
+    return cached
+
+
+def _write_cache(cache_name, limits):
+    # the cache is only there to save time, never fail because of it
+    tmp_name = "{}.{}.tmp".format(cache_name, os.getpid())
+    try:
+        if not path.isdir(path.dirname(cache_name)):
+            os.makedirs(path.dirname(cache_name))
+        with open(tmp_name, "w") as cache_file:
+            json.dump(limits, cache_file, sort_keys=True)
+        os.rename(tmp_name, cache_name)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+
+
+def slurm_limits():
+    # MaxArraySize and MaxJobCount, from the environment, the cache or scontrol.
+    # raises OSError if there is no scontrol, and CalledProcessError, KeyError or
+    # ValueError if it didn't tell us
+    limits = {}
+    for key, env_name in SLURM_LIMITS.items():
+        if os.environ.get(env_name):
+            limits[key] = int(os.environ[env_name])
+    if len(limits) == len(SLURM_LIMITS):
+        return limits
+    ttl = float(os.environ.get("DSQ_SLURM_CONF_TTL", SLURM_CONF_TTL))
+    cache_name = slurm_conf_cache_name()
+    cached = _looked_up.get(cache_name)
+    if cached is None and ttl > 0:
+        cached = _read_cache(cache_name, ttl)
+    if cached is None:
+        conf = read_slurm_conf()
+        cached = dict((key, int(conf[key])) for key in SLURM_LIMITS)
+        if ttl > 0:
+            _write_cache(cache_name, cached)
+    _looked_up[cache_name] = cached
+    for key in SLURM_LIMITS:
+        limits.setdefault(key, cached[key])
+    return limits
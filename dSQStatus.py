@@ -0,0 +1,372 @@
+from __future__ import print_function
+from os import path
+import fcntl
+import os
+import shutil
+import time
+
+__version__ = 1.05
+
+# columns of the job_jobid_status.tsv file. new columns go after Task, which
+# used to be the last one
+STATUS_COLUMNS = [
+    "Array_Task_ID",
+    "Exit_Code",
+    "Hostname",
+    "T_Start",
+    "T_End",
+    "T_Elapsed",
+    "Task",
+    "Max_RSS_HWM_KB",
+    "CPU_User",
+    "CPU_Sys",
+    "Blocks_In",
+    "Blocks_Out",
+    "Cgroup_Mem_Peak_KB",
+    "Cgroup_CPU",
+    "T_Elapsed_Mono",
+    "Attempt",
+    "State",
+]
+STATUS_FORMATS = {
+    "T_Elapsed": "{:.02f}",
+    "CPU_User": "{:.02f}",
+    "CPU_Sys": "{:.02f}",
+    "Cgroup_CPU": "{:.02f}",
+    "T_Elapsed_Mono": "{:.03f}",
+}
+
+# where each status backend keeps the job stats of an array, by job id
+STATUS_TSV_NAME = "job_{}_status.tsv"
+STATUS_SHARD_DIR = "job_{}_status.d"
+STATUS_SQLITE_NAME = "job_{}_status.sqlite"
+STATUS_BACKENDS = ["tsv", "shard", "sqlite"]
+# the shard backend gives every task a status file of its own that it appends
+# its lines to, so no two tasks ever write to the same file. dsq merge renames
+# each shard before reading it and tasks start a new one from then on, the same
+# way dSQCache folds its logs. the tsv of an array that saves to shards or sqlite
+# is only written by dsq merge, which replaces it in one rename
+SHARD_SUFFIX = ".tsv"
+SHARD_MERGING_SUFFIX = ".merging"
+MERGE_LOCK_NAME = "merge.lock"
+
+
+def format_status_row(row):
+    # columns we couldn't measure are NA, and tabs in the job would shift the
+    # columns after it
+    fields = []
+    for column in STATUS_COLUMNS:
+        value = row.get(column)
+        if value is None:
+            fields.append("NA")
+        elif column == "Task":
+            fields.append(value.replace("\t", " "))
+        else:
+            fields.append(STATUS_FORMATS.get(column, "{}").format(value))
+    return "\t".join(fields) + "\n"
+
+
+def _append(file_name, data):
+    # a single write to a file opened for appending, so lines aren't interleaved
+    fd = os.open(file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def append_shard(file_name, data):
+    # for files several tasks append to that get renamed before they are read,
+    # like the logs of dSQCache. lock the file, and if it was renamed while we
+    # waited, start over with a new one under the old name
+    while True:
+        fd = os.open(file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(file_name).st_ino
+            except OSError:
+                same_file = False
+            if same_file:
+                os.write(fd, data)
+                return
+        finally:
+            os.close(fd)
+
+
+def write_tsv_row(status_dir, job_id, hostname, row):
+    _append(
+        path.join(status_dir, STATUS_TSV_NAME.format(job_id)),
+        format_status_row(row).encode(),
+    )
+
+
+# the shard this process appends to, by shard dir
+_shard_names = {}
+
+
+def write_shard_row(status_dir, job_id, hostname, row):
+    shard_dir = path.join(status_dir, STATUS_SHARD_DIR.format(job_id))
+    if shard_dir not in _shard_names:
+        if not path.isdir(shard_dir):
+            try:
+                os.mkdir(shard_dir)
+            except OSError:
+                pass
+        # only this process uses a name with its node, pid and start in it
+        _shard_names[shard_dir] = path.join(
+            shard_dir,
+            "{}.{}.{}{}".format(
+                hostname, os.getpid(), int(time.time() * 1e6), SHARD_SUFFIX
+            ),
+        )
+    append_shard(_shard_names[shard_dir], format_status_row(row).encode())
+
+
+def _connect_sqlite(status_dir, job_id):
+    # imported here, dSQBatch only needs it for the sqlite backend
+    import sqlite3
+
+    conn = sqlite3.connect(
+        path.join(status_dir, STATUS_SQLITE_NAME.format(job_id)), timeout=300
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS status (task_id INTEGER, exit_code INTEGER, row TEXT)"
+    )
+    return conn
+
+
+def write_sqlite_row(status_dir, job_id, hostname, row):
+    conn = _connect_sqlite(status_dir, job_id)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO status VALUES (?, ?, ?)",
+                (row["Array_Task_ID"], row["Exit_Code"], format_status_row(row)),
+            )
+    finally:
+        conn.close()
+
+
+STATUS_WRITERS = {
+    "tsv": write_tsv_row,
+    "shard": write_shard_row,
+    "sqlite": write_sqlite_row,
+}
+
+
+def write_status_row(backend, status_dir, job_id, hostname, row):
+    STATUS_WRITERS[backend](status_dir, job_id, hostname, row)
+
+
+def _complete_shards(shard_dir):
+    # shards tasks append to and ones dsq merge is in the middle of merging
+    try:
+        names = os.listdir(shard_dir)
+    except OSError:
+        return []
+    return sorted(
+        path.join(shard_dir, name)
+        for name in names
+        if name.endswith(SHARD_SUFFIX) or name.endswith(SHARD_MERGING_SUFFIX)
+    )
+
+
+def shard_files(status_dir, job_id):
+    return _complete_shards(path.join(status_dir, STATUS_SHARD_DIR.format(job_id)))
+
+
+def iter_status_lines(status_dir, job_id):
+    # every status line saved for an array so far, whichever backend saved it
+    tsv_name = path.join(status_dir, STATUS_TSV_NAME.format(job_id))
+    for file_name in [tsv_name] + shard_files(status_dir, job_id):
+        try:
+            with open(file_name, "r") as status_file:
+                for line in status_file:
+                    yield line
+        except (IOError, OSError):
+            pass
+    if path.isfile(path.join(status_dir, STATUS_SQLITE_NAME.format(job_id))):
+        conn = _connect_sqlite(status_dir, job_id)
+        try:
+            for (line,) in conn.execute("SELECT row FROM status ORDER BY rowid"):
+                yield line
+        finally:
+            conn.close()
+
+
+def _take_shards(shard_dir, locked):
+    # status lines of every shard, renamed out of the way of the tasks first.
+    # shards a merge that died left behind are merged again, a line saved twice
+    # is better than a lost one
+    lines = []
+    for shard in _complete_shards(shard_dir):
+        if shard.endswith(SHARD_SUFFIX):
+            # tasks still running start a new shard from here on
+            merging = "{}.{}{}".format(shard, os.getpid(), SHARD_MERGING_SUFFIX)
+            os.rename(shard, merging)
+            shard = merging
+        shard_file = open(shard, "rb")
+        locked.append((shard, shard_file))
+        # wait for a task that is in the middle of writing to it
+        fcntl.lockf(shard_file.fileno(), fcntl.LOCK_SH)
+        data = shard_file.read()
+        # leave out a line a task died in the middle of writing
+        lines.extend(data[: data.rfind(b"\n") + 1].decode().splitlines(True))
+    return lines
+
+
+def merge_status(status_dir, job_id):
+    # fold the shard and sqlite backends into job_jobid_status.tsv, returning the
+    # number of lines added to it
+    tsv_name = path.join(status_dir, STATUS_TSV_NAME.format(job_id))
+    sqlite_name = path.join(status_dir, STATUS_SQLITE_NAME.format(job_id))
+    shard_dir = path.join(status_dir, STATUS_SHARD_DIR.format(job_id))
+    lock_fd = None
+    if path.isdir(shard_dir):
+        lock_fd = os.open(
+            path.join(shard_dir, MERGE_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644
+        )
+    locked = []
+    tmp_name = "{}.{}.tmp".format(tsv_name, os.getpid())
+    try:
+        if lock_fd is not None:
+            # only one of us merges at a time
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            merged = _take_shards(shard_dir, locked)
+        else:
+            merged = []
+        max_rowid = None
+        if path.isfile(sqlite_name):
+            conn = _connect_sqlite(status_dir, job_id)
+            try:
+                for rowid, line in conn.execute(
+                    "SELECT rowid, row FROM status ORDER BY rowid"
+                ):
+                    merged.append(line)
+                    max_rowid = rowid
+            finally:
+                conn.close()
+        if len(merged) > 0:
+            # the new tsv only replaces the old one once it is complete
+            with open(tmp_name, "w") as tmp_file:
+                try:
+                    with open(tsv_name, "r") as tsv_file:
+                        shutil.copyfileobj(tsv_file, tmp_file)
+                except (IOError, OSError):
+                    pass
+                tmp_file.writelines(merged)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.rename(tmp_name, tsv_name)
+        # only clean up once the lines are safely in the tsv
+        for shard, shard_file in locked:
+            os.remove(shard)
+        if max_rowid is not None:
+            conn = _connect_sqlite(status_dir, job_id)
+            try:
+                with conn:
+                    conn.execute("DELETE FROM status WHERE rowid <= ?", (max_rowid,))
+            finally:
+                conn.close()
+    finally:
+        if path.isfile(tmp_name):
+            os.remove(tmp_name)
+        for shard, shard_file in locked:
+            shard_file.close()
+        if lock_fd is not None:
+            os.close(lock_fd)
+    return len(merged)
+
+
+def iter_status_file_lines(file_name):
+    # lines of a status tsv, a directory of shards or an sqlite status database
+    if path.isdir(file_name):
+        shard_names = _complete_shards(file_name)
+    elif file_name.endswith(".sqlite"):
+        import sqlite3
+
+        conn = sqlite3.connect(file_name, timeout=300)
+        try:
+            for (line,) in conn.execute("SELECT row FROM status ORDER BY rowid"):
+                yield line
+        finally:
+            conn.close()
+        return
+    else:
+        shard_names = [file_name]
+    for shard_name in shard_names:
+        with open(shard_name, "r") as status_file:
+            for line in status_file:
+                yield line
+
+
+def parse_status_line(line):
+    # dict of the columns in a status line, older status files have fewer columns
+    return dict(zip(STATUS_COLUMNS, line.rstrip("\n").split("\t")))
+
+
+def succeeded_lines(file_names):
+    # a bytearray that is 1 at every job file line that exited 0 in any of the
+    # status files. requeued jobs can show up more than once, one success is enough
+    succeeded = bytearray()
+    for file_name in file_names:
+        for line in iter_status_file_lines(file_name):
+            fields = line.split("\t", 2)
+            if len(fields) < 3 or fields[1] != "0":
+                continue
+            try:
+                line_num = int(fields[0])
+            except ValueError:
+                continue
+            if line_num >= len(succeeded):
+                succeeded.extend(bytearray(line_num + 1 - len(succeeded)))
+            succeeded[line_num] = 1
+    return succeeded
+
+
+def lines_in_states(file_names, states):
+    # a bytearray that is 1 at every job file line that dSQBatch saved with one of
+    # states, e.g. STALLED, in any of the status files
+    in_states = bytearray()
+    for file_name in file_names:
+        for line in iter_status_file_lines(file_name):
+            row = parse_status_line(line)
+            if row.get("State") not in states:
+                continue
+            try:
+                line_num = int(row["Array_Task_ID"])
+            except ValueError:
+                continue
+            if line_num >= len(in_states):
+                in_states.extend(bytearray(line_num + 1 - len(in_states)))
+            in_states[line_num] = 1
+    return in_states
+
+
+def command_key(cmd):
+    # jobs are matched across runs by a hash of their command. status files
+    # replace tabs in the job with spaces
+    import hashlib
+
+    return hashlib.md5(cmd.strip().replace("\t", " ").encode()).digest()
+
+
+def elapsed_by_command(file_names):
+    # the longest run time in seconds seen for each job in the status files, by
+    # command_key of the job
+    elapsed = {}
+    for file_name in file_names:
+        for line in iter_status_file_lines(file_name):
+            row = parse_status_line(line)
+            try:
+                seconds = float(row.get("T_Elapsed_Mono", "NA"))
+            except ValueError:
+                try:
+                    seconds = float(row.get("T_Elapsed"))
+                except (TypeError, ValueError):
+                    continue
+            key = command_key(row.get("Task", ""))
+            if seconds > elapsed.get(key, -1):
+                elapsed[key] = seconds
+    return elapsed
@@ -0,0 +1,126 @@
+from __future__ import print_function
+from os import path
+import json
+
+__version__ = 1.05
+
+# a sweep spec stands in for a job file that would have one line for every
+# combination of some parameters. it is a json file like
+#
+#   {
+#     "command": "python fit.py --lr {lr} --seed {seed} --data {data}",
+#     "axes": [
+#       {"name": "lr", "range": [0.001, 0.01, 0.001]},
+#       {"name": "seed", "range": [1, 100]},
+#       {"name": "data", "file": "datasets.txt"}
+#     ]
+#   }
+#
+# ranges are start, stop and an optional step (default 1), all numbers, and
+# include stop. files list one value per line, relative to the spec. values can
+# also be given as a list with "values". line n of the sweep is found by reading
+# n as a mixed-radix number, one digit per axis with the last axis changing
+# fastest, like the lines of nested for loops.
+#
+# the command is filled in with str.format, so a literal brace is written twice,
+# e.g. echo ${{HOME}} for echo ${HOME}
+BRACE_HINT = " (write a literal { or } as {{ or }})"
+
+
+def _range_axis(name, bounds):
+    if not isinstance(bounds, list) or len(bounds) not in (2, 3):
+        raise ValueError(
+            "range of {} needs a start, stop and optional step".format(name)
+        )
+    start, stop = bounds[:2]
+    step = bounds[2] if len(bounds) == 3 else 1
+    for bound in (start, stop, step):
+        # json true and false are ints to python
+        if not isinstance(bound, (int, float)) or isinstance(bound, bool):
+            raise ValueError(
+                "range of {} has {}, which is not a number".format(
+                    name, json.dumps(bound)
+                )
+            )
+    if step <= 0 or stop < start:
+        raise ValueError("range of {} is empty".format(name))
+    is_int = all(isinstance(x, int) for x in (start, stop, step))
+    if is_int:
+        size = (stop - start) // step + 1
+    else:
+        # allow for rounding with float steps
+        size = int((stop - start) / float(step) + 1e-9) + 1
+    return {"name": name, "start": start, "step": step, "size": size, "int": is_int}
+
+
+def load_sweep(spec_name):
+    # read a sweep spec, raising ValueError if it doesn't make sense
+    with open(spec_name, "r") as spec_file:
+        try:
+            spec = json.load(spec_file)
+        except ValueError as e:
+            raise ValueError("{} is not valid json: {}".format(spec_name, e))
+    if not isinstance(spec, dict) or "command" not in spec or "axes" not in spec:
+        raise ValueError("{} needs a command and axes".format(spec_name))
+    axes = []
+    for axis in spec["axes"]:
+        name = axis.get("name")
+        if name is None:
+            raise ValueError("every axis in {} needs a name".format(spec_name))
+        if "range" in axis:
+            axes.append(_range_axis(name, axis["range"]))
+            continue
+        if "values" in axis:
+            values = [str(value) for value in axis["values"]]
+        elif "file" in axis:
+            values_name = path.join(path.dirname(path.abspath(spec_name)), axis["file"])
+            with open(values_name, "r") as values_file:
+                values = [l.strip() for l in values_file if l.strip() != ""]
+        else:
+            raise ValueError("axis {} needs a range, values or a file".format(name))
+        if len(values) == 0:
+            raise ValueError("axis {} has no values".format(name))
+        axes.append({"name": name, "values": values, "size": len(values)})
+    sweep = {"command": spec["command"], "axes": axes}
+    try:
+        sweep_line(sweep, 0)
+    except (KeyError, IndexError) as e:
+        raise ValueError(
+            "command in {} uses {}, which is not an axis{}".format(
+                spec_name, e, BRACE_HINT
+            )
+        )
+    except (AttributeError, ValueError) as e:
+        raise ValueError(
+            "command in {} can't be filled in: {}{}".format(spec_name, e, BRACE_HINT)
+        )
+    return sweep
+
+
+def sweep_size(sweep):
+    size = 1
+    for axis in sweep["axes"]:
+        size *= axis["size"]
+    return size
+
+
+def sweep_line(sweep, line_num):
+    # the job at zero-indexed line line_num of the sweep
+    params = {}
+    for axis in reversed(sweep["axes"]):
+        line_num, digit = divmod(line_num, axis["size"])
+        if "values" in axis:
+            params[axis["name"]] = axis["values"][digit]
+        elif axis["int"]:
+            params[axis["name"]] = axis["start"] + digit * axis["step"]
+        else:
+            # keep float steps from printing as 0.30000000000000004
+            value = axis["start"] + digit * axis["step"]
+            params[axis["name"]] = float("{:.12g}".format(value))
+    return sweep["command"].format(**params)
+
+
+def sweep_lines(sweep, line_nums):
+    # the same as dSQJobFile.read_lines, for a sweep
+    size = sweep_size(sweep)
+    return dict((n, sweep_line(sweep, n) if 0 <= n < size else "") for n in line_nums)
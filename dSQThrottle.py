@@ -0,0 +1,246 @@
+from __future__ import print_function
+from datetime import datetime
+from os import path
+from subprocess import check_call, check_output
+from dSQWatch import find_total_jobs, new_watch_state, read_new_status
+import os
+import time
+
+__version__ = 1.05
+
+# dsq throttle changes how many tasks of a running job array slurm runs at once
+# (its ArrayTaskThrottle, the %N of --array) to get through the array fastest.
+# every window it looks at the jobs that finished: how many failed, how long they
+# ran compared to the quickest they have been, and how long a write to the
+# status directory takes. too many failures, jobs slowing down a lot or slow
+# writes mean something the jobs share, usually the filesystem, is overloaded,
+# and the limit is cut straight away. otherwise it climbs towards the limit that
+# finishes the most jobs a second, which is the limit over the mean run time.
+# counting the jobs that finished is too noisy for that unless windows are much
+# longer than jobs. it keeps going the same way while that goes up and turns
+# around, in smaller steps, when it goes down. if it stays flat, fewer tasks do
+# just as well
+MAX_FAILURE_RATE = 0.05
+MAX_RUNTIME_DRIFT = 1.5
+MAX_WRITE_LATENCY = 1.0
+# cut the limit to this fraction of itself when overloaded
+BACKOFF = 0.7
+# tasks are only added while each one adds at least this fraction of what the
+# average task finishes
+MIN_MARGINAL = 0.5
+# a window lasts at least this many seconds, and until this many jobs finished
+# or ten times as long
+WINDOW_SECONDS = 60
+WINDOW_JOBS = 20
+# job states of an array that isn't finished yet
+ACTIVE_STATES = ["PENDING", "RUNNING", "CONFIGURING", "COMPLETING", "SUSPENDED"]
+PROBE_NAME = ".job_{}_throttle_probe"
+
+
+def new_throttle_state(limit, min_limit=1, max_limit=None):
+    return {
+        "limit": limit,
+        "min_limit": min_limit,
+        "max_limit": max_limit,
+        "step": max(1, limit // 4),
+        "direction": 1,
+        "last_throughput": None,
+        "last_limit": None,
+        "baseline_runtime": None,
+    }
+
+
+def _clamp(state, limit):
+    limit = max(state["min_limit"], int(limit))
+    if state["max_limit"] is not None:
+        limit = min(state["max_limit"], limit)
+    return limit
+
+
+def _overloaded(state, sample):
+    # why the last window looks overloaded, if it does
+    reasons = []
+    finished = sample["finished"]
+    # a few failures more than that in a small window are just bad luck
+    margin = 2 * (MAX_FAILURE_RATE * finished) ** 0.5
+    if finished > 0 and sample["failed"] > MAX_FAILURE_RATE * finished + margin:
+        reasons.append(
+            "{:.0f}% of jobs failed".format(100.0 * sample["failed"] / finished)
+        )
+    runtime = sample.get("mean_runtime")
+    baseline = state["baseline_runtime"]
+    if runtime is not None and baseline and runtime > MAX_RUNTIME_DRIFT * baseline:
+        reasons.append("jobs ran {:.1f}x as long".format(runtime / baseline))
+    latency = sample.get("write_latency")
+    if latency is not None and latency > MAX_WRITE_LATENCY:
+        reasons.append("a status write took {:.2f}s".format(latency))
+    return reasons
+
+
+def throttle_step(state, sample):
+    # the next limit and why, from a window's sample: a dict of its seconds, the
+    # jobs that finished and failed in it, their mean run time (None if not
+    # known) and the write latency of the status directory (None if not known)
+    reasons = _overloaded(state, sample)
+    limit = state["limit"]
+    runtime = sample.get("mean_runtime")
+    if runtime:
+        throughput = limit / runtime
+    else:
+        throughput = sample["finished"] / float(sample["seconds"])
+    if runtime is not None and (
+        state["baseline_runtime"] is None or runtime < state["baseline_runtime"]
+    ):
+        state["baseline_runtime"] = runtime
+    last = state["last_throughput"]
+    last_limit = state["last_limit"]
+    if len(reasons) > 0:
+        new_limit = _clamp(state, limit * BACKOFF)
+        state["direction"] = 1
+        state["step"] = max(1, state["step"] // 2)
+        reason = "overloaded, " + ", ".join(reasons)
+    elif last is None or last_limit == limit or last == 0:
+        reason = "trying more tasks"
+        state["direction"] = 1
+        new_limit = _clamp(state, limit + state["step"])
+    else:
+        # what the tasks we added or took away did, compared to the average
+        # task before. added tasks should be worth at least MIN_MARGINAL of one
+        marginal = (throughput - last) / (limit - last_limit) / (last / last_limit)
+        if (limit > last_limit) == (marginal >= MIN_MARGINAL):
+            reason = (
+                "more tasks are worth it"
+                if limit > last_limit
+                else "fewer tasks are enough"
+            )
+            state["step"] = min(state["step"] * 2, max(1, limit // 4))
+        else:
+            state["direction"] = -state["direction"]
+            state["step"] = max(1, state["step"] // 2)
+            reason = "turning back"
+        new_limit = _clamp(state, limit + state["direction"] * state["step"])
+    state["last_throughput"] = throughput
+    state["last_limit"] = limit
+    state["limit"] = new_limit
+    return new_limit, reason
+
+
+def probe_write_latency(status_dir, job_id):
+    # seconds to append a line to a file in the status directory and get it to
+    # disk, about what it takes a job to save its stats
+    probe_name = path.join(status_dir, PROBE_NAME.format(job_id))
+    start = time.monotonic()
+    fd = os.open(probe_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, b"probe\n")
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return time.monotonic() - start
+
+
+def array_throttle(job_id):
+    # the ArrayTaskThrottle of a job array (0 for none) and whether any of its
+    # tasks are still to run. raises CalledProcessError once slurm forgot it
+    throttle = 0
+    active = False
+    show_job = check_output(
+        ["scontrol", "show", "job", str(job_id)], universal_newlines=True
+    )
+    for field in show_job.split():
+        key, sep, value = field.partition("=")
+        if key == "ArrayTaskThrottle":
+            throttle = int(value)
+        elif key == "JobState" and value in ACTIVE_STATES:
+            active = True
+    return throttle, active
+
+
+def set_array_throttle(job_id, limit):
+    check_call(
+        [
+            "scontrol",
+            "update",
+            "JobId={}".format(job_id),
+            "ArrayTaskThrottle={}".format(limit),
+        ]
+    )
+
+
+def run_throttle(job_id, status_dir, state, total_jobs=None, window=None, log=print):
+    # adjust the array's throttle every window until it has finished
+    if window is None:
+        window = WINDOW_SECONDS
+    watch = new_watch_state(total_jobs)
+    # only judge the limit by jobs that finish from now on
+    find_total_jobs(watch, status_dir, job_id)
+    read_new_status(watch, status_dir, job_id)
+    set_array_throttle(job_id, state["limit"])
+    log("{} starting at {} tasks at once".format(job_id, state["limit"]))
+    try:
+        while True:
+            start = time.monotonic()
+            marks = dict(
+                (key, watch[key])
+                for key in ["done", "failed_first", "elapsed_total", "elapsed_count"]
+            )
+            seconds = 0
+            next_check = window
+            active = True
+            while active:
+                time.sleep(min(5, window))
+                find_total_jobs(watch, status_dir, job_id)
+                read_new_status(watch, status_dir, job_id)
+                seconds = time.monotonic() - start
+                if seconds < next_check:
+                    continue
+                # don't ask slurmctld more than once a window
+                active = array_throttle(job_id)[1]
+                next_check += window
+                if (
+                    watch["done"] - marks["done"] >= WINDOW_JOBS
+                    or seconds >= 10 * window
+                ):
+                    break
+            if not active:
+                break
+            sample = {
+                "seconds": seconds,
+                "finished": watch["done"] - marks["done"],
+                "failed": watch["failed_first"] - marks["failed_first"],
+                "mean_runtime": None,
+                "write_latency": probe_write_latency(status_dir, job_id),
+            }
+            timed = watch["elapsed_count"] - marks["elapsed_count"]
+            if timed > 0:
+                sample["mean_runtime"] = (
+                    watch["elapsed_total"] - marks["elapsed_total"]
+                ) / timed
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            total_jobs = watch["total_jobs"]
+            if total_jobs is not None and total_jobs - watch["done"] < state["limit"]:
+                # fewer jobs left than we let run, how fast they go says nothing
+                log(
+                    "{} {} jobs left, keeping {}".format(
+                        now, total_jobs - watch["done"], state["limit"]
+                    )
+                )
+                continue
+            if sample["finished"] == 0:
+                log("{} no jobs finished, keeping {}".format(now, state["limit"]))
+                continue
+            old_limit = state["limit"]
+            limit, reason = throttle_step(state, sample)
+            log(
+                "{} {:.2f} jobs/s, {} -> {} tasks at once: {}".format(
+                    now, sample["finished"] / seconds, old_limit, limit, reason
+                )
+            )
+            if limit != old_limit:
+                set_array_throttle(job_id, limit)
+    finally:
+        try:
+            os.remove(path.join(status_dir, PROBE_NAME.format(job_id)))
+        except OSError:
+            pass
+    log("{} finished".format(job_id))
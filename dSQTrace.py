@@ -0,0 +1,282 @@
+from __future__ import print_function
+from glob import glob
+from os import path
+import json
+import os
+import threading
+import time
+
+__version__ = 1.05
+
+# with --trace, every array task keeps how long each step of running its jobs
+# took, to tell time spent in the jobs from time spent in dSQ and the shared
+# filesystem. a task saves them in one write when it's done, a line per step, to
+# one file per node: the array task, the wrapper's pid, which of the task's
+# threads ran the step, the step, the job file line (NA if none), and when it
+# started and how long it took in microseconds. dsq trace merges them into a
+# trace for chrome://tracing or Perfetto and sums up the wrapper's overhead
+TRACE_DIR = "job_{}_trace"
+# startup is from the python starting to dSQBatch's main, exit from the last
+# status write to the trace being saved. the rest are per job
+TRACE_PHASES = ["startup", "lookup", "spawn", "run", "status", "exit"]
+# durations are counted in dsq watch's histograms of buckets about 5% wide, in
+# microseconds. dSQWatch is only imported to sum traces up, so tasks saving them
+# don't have to load it
+
+
+def process_start_time():
+    # when this process started, in seconds since the epoch, or None if there is
+    # no /proc. linux only keeps it in clock ticks, so to about 10ms
+    try:
+        with open("/proc/self/stat", "rb") as stat_file:
+            stat = stat_file.read()
+        with open("/proc/uptime", "r") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        now = time.time()
+        # the command can have spaces and parentheses in it, so count the fields
+        # from the end of it. starttime is the 20th after it
+        ticks = int(stat[stat.rfind(b")") + 2 :].split()[19])
+        return now - (uptime - ticks / float(os.sysconf("SC_CLK_TCK")))
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def new_trace(task_id, started):
+    # started is when main was reached, the end of startup
+    trace = {
+        "task": task_id,
+        "pid": os.getpid(),
+        "lines": [],
+        "slots": {},
+        "lock": threading.Lock(),
+    }
+    process_start = process_start_time()
+    if process_start is not None and process_start <= started:
+        trace_event(trace, "startup", process_start, started)
+    return trace
+
+
+def trace_event(trace, phase, start, end, line_num=None):
+    with trace["lock"]:
+        # packed jobs run side by side, number the threads they ran on
+        slot = trace["slots"].setdefault(
+            threading.current_thread().ident, len(trace["slots"])
+        )
+        trace["lines"].append(
+            "{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                trace["task"],
+                trace["pid"],
+                slot,
+                phase,
+                "NA" if line_num is None else line_num,
+                int(start * 1e6),
+                int((end - start) * 1e6),
+            )
+        )
+        trace["last_end"] = max(trace.get("last_end", 0), end)
+
+
+def write_trace(trace, status_dir, job_id, hostname):
+    # the time since the last step is exit, then everything goes to the node's
+    # file in one write, so tasks on the same node don't interleave lines
+    now = time.time()
+    trace_event(trace, "exit", trace.get("last_end", now), now)
+    trace_dir = path.join(status_dir, TRACE_DIR.format(job_id))
+    if not path.isdir(trace_dir):
+        try:
+            os.mkdir(trace_dir)
+        except OSError:
+            pass
+    data = "".join(trace["lines"]).encode()
+    fd = os.open(
+        path.join(trace_dir, "{}.tsv".format(hostname)),
+        os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+        0o644,
+    )
+    try:
+        while len(data) > 0:
+            data = data[os.write(fd, data) :]
+    finally:
+        os.close(fd)
+
+
+def trace_files(status_dir, job_id):
+    return sorted(glob(path.join(status_dir, TRACE_DIR.format(job_id), "*.tsv")))
+
+
+def iter_trace_tasks(file_name):
+    # the steps of every array task saved in a node's file, as lists of (task,
+    # pid, slot, phase, line, start, duration) with times in microseconds. a
+    # task's lines are saved together, so they come one after the other
+    steps = []
+    with open(file_name, "r") as trace_file:
+        for l in trace_file:
+            fields = l.rstrip("\n").split("\t")
+            if len(fields) != 7:
+                # cut off by a full disk or a task killed while writing
+                continue
+            try:
+                step = (
+                    fields[0],
+                    int(fields[1]),
+                    int(fields[2]),
+                    fields[3],
+                    None if fields[4] == "NA" else int(fields[4]),
+                    int(fields[5]),
+                    int(fields[6]),
+                )
+            except ValueError:
+                continue
+            if len(steps) > 0 and (step[0], step[1]) != (steps[0][0], steps[0][1]):
+                yield steps
+                steps = []
+            steps.append(step)
+    if len(steps) > 0:
+        yield steps
+
+
+def new_trace_summary():
+    return {
+        "tasks": 0,
+        "histograms": dict((phase, {}) for phase in TRACE_PHASES + ["overhead"]),
+        "overhead_percent": {},
+    }
+
+
+def _add_task(summary, steps):
+    # everything a task spent outside its jobs is overhead, including what
+    # isn't one of the steps, like setting up and staging the job file
+    from dSQWatch import add_to_histogram
+
+    summary["tasks"] += 1
+    for step in steps:
+        if step[3] in summary["histograms"]:
+            add_to_histogram(summary["histograms"][step[3]], max(step[6], 1))
+    wall = max(s[5] + s[6] for s in steps) - min(s[5] for s in steps)
+    # packed jobs run side by side, only count the time none of them ran
+    running = 0
+    run_end = None
+    for start, end in sorted((s[5], s[5] + s[6]) for s in steps if s[3] == "run"):
+        if run_end is None or start > run_end:
+            running += end - start
+            run_end = end
+        elif end > run_end:
+            running += end - run_end
+            run_end = end
+    overhead = max(wall - running, 0)
+    add_to_histogram(summary["histograms"]["overhead"], max(overhead, 1))
+    if wall > 0:
+        percent = int(round(100.0 * overhead / wall))
+        summary["overhead_percent"][percent] = (
+            summary["overhead_percent"].get(percent, 0) + 1
+        )
+
+
+def summarize_trace(summary):
+    # percentiles of each step and of the overhead per task, in seconds, and of
+    # the overhead as a percentage of the task's time
+    from dSQWatch import bucket_middle, histogram_percentile
+
+    def seconds(bucket):
+        return bucket_middle(bucket) / 1e6
+
+    rows = {}
+    for name, histogram in summary["histograms"].items():
+        rows[name] = {"count": sum(histogram.values())}
+        for label, fraction in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]:
+            rows[name][label] = histogram_percentile(histogram, fraction, seconds)
+        rows[name]["max"] = seconds(max(histogram)) if len(histogram) > 0 else None
+    percent = summary["overhead_percent"]
+    rows["overhead_percent"] = {"count": sum(percent.values())}
+    for label, fraction in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]:
+        # percents are counted as they are, not in log buckets
+        rows["overhead_percent"][label] = histogram_percentile(
+            percent, fraction, lambda bucket: bucket
+        )
+    rows["overhead_percent"]["max"] = max(percent) if len(percent) > 0 else None
+    return {"tasks": summary["tasks"], "phases": rows}
+
+
+def format_trace_summary(job_id, summarized):
+    def cell(value, unit):
+        if value is None:
+            return "NA"
+        if unit == "%":
+            return "{}%".format(value)
+        return "{:.1f}ms".format(value * 1000)
+
+    lines = [
+        "dSQ job {}: {} array tasks traced".format(job_id, summarized["tasks"]),
+        "{:<12} {:>9} {:>10} {:>10} {:>10} {:>10}".format(
+            "Step", "Count", "p50", "p95", "p99", "Max"
+        ),
+    ]
+    for name, unit in [(phase, "s") for phase in TRACE_PHASES] + [
+        ("overhead", "s"),
+        ("overhead_percent", "%"),
+    ]:
+        row = summarized["phases"][name]
+        lines.append(
+            "{:<12} {:>9} {:>10} {:>10} {:>10} {:>10}".format(
+                "overhead %" if name == "overhead_percent" else name,
+                row["count"],
+                cell(row["p50"], unit),
+                cell(row["p95"], unit),
+                cell(row["p99"], unit),
+                cell(row["max"], unit),
+            )
+        )
+    return "\n".join(lines)
+
+
+def merge_trace(status_dir, job_id, out_file=None):
+    # write the trace of every node to out_file as chrome trace json, one
+    # process per wrapper named after its node and one thread per wrapper
+    # thread, a step at a time so it doesn't have to fit in memory. returns the
+    # summary of the overhead
+    summary = new_trace_summary()
+    first = [True]
+
+    def write_event(event):
+        if out_file is not None:
+            out_file.write(("" if first[0] else ",\n") + json.dumps(event))
+        first[0] = False
+
+    if out_file is not None:
+        out_file.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+    # wrapper pids can be the same on different nodes, so they are numbered
+    num_processes = 0
+    for file_name in trace_files(status_dir, job_id):
+        node = path.splitext(path.basename(file_name))[0]
+        processes = {}
+        for steps in iter_trace_tasks(file_name):
+            _add_task(summary, steps)
+            for task, pid, slot, phase, line_num, start, duration in steps:
+                if pid not in processes:
+                    processes[pid] = num_processes
+                    num_processes += 1
+                    write_event(
+                        {
+                            "name": "process_name",
+                            "ph": "M",
+                            "pid": processes[pid],
+                            "args": {"name": "{} pid {}".format(node, pid)},
+                        }
+                    )
+                args = {"task": task}
+                if line_num is not None:
+                    args["line"] = line_num
+                write_event(
+                    {
+                        "name": phase,
+                        "ph": "X",
+                        "pid": processes[pid],
+                        "tid": slot,
+                        "ts": start,
+                        "dur": duration,
+                        "args": args,
+                    }
+                )
+    if out_file is not None:
+        out_file.write("\n]}\n")
+    return summarize_trace(summary)
@@ -0,0 +1,240 @@
+from __future__ import print_function
+from datetime import datetime, timedelta
+from os import path
+from dSQJobFile import run_num_jobs
+from dSQStatus import STATUS_COLUMNS, STATUS_SQLITE_NAME, STATUS_TSV_NAME, shard_files
+import math
+import os
+import sqlite3
+
+__version__ = 1.05
+
+# dsq watch keeps running totals of a job's status lines and, on every refresh,
+# only reads what was added since the last one: new bytes of the status tsv and
+# of every shard, and new rows of the sqlite database. dsq merge copies lines it
+# already saw into the tsv, and requeued jobs can finish twice, so every line is
+# only counted once
+ELAPSED_COLUMN = STATUS_COLUMNS.index("T_Elapsed")
+ELAPSED_MONO_COLUMN = STATUS_COLUMNS.index("T_Elapsed_Mono")
+END_COLUMN = STATUS_COLUMNS.index("T_End")
+READ_BLOCK = 1 << 20
+# run times are counted in buckets about 5% wide for percentiles
+HIST_SCALE = 20
+# minutes of finished jobs to work out the throughput from
+RATE_MINUTES = 5
+LINE_NOT_DONE = 0
+LINE_FAILED = 1
+LINE_SUCCEEDED = 2
+
+
+def new_watch_state(total_jobs=None):
+    return {
+        "offsets": {},
+        "sqlite_rowid": 0,
+        "lines": bytearray(),
+        "done": 0,
+        "failed": 0,
+        "histogram": {},
+        "per_minute": {},
+        # for dsq throttle: lines whose first try failed, and the run times of
+        # first tries
+        "failed_first": 0,
+        "elapsed_total": 0.0,
+        "elapsed_count": 0,
+        "total_jobs": total_jobs,
+    }
+
+
+def find_total_jobs(state, status_dir, job_id):
+    # the arrays of a run save how many jobs dsq submitted when they start, so
+    # keep looking until one has
+    if state["total_jobs"] is None:
+        state["total_jobs"] = run_num_jobs(status_dir, job_id)
+
+
+def _add_status_line(state, line):
+    fields = line.split("\t")
+    if len(fields) <= ELAPSED_COLUMN:
+        return
+    try:
+        line_num = int(fields[0])
+    except ValueError:
+        return
+    lines = state["lines"]
+    if line_num >= len(lines):
+        lines.extend(bytearray(line_num + 1 - len(lines)))
+    new_state = LINE_SUCCEEDED if fields[1] == "0" else LINE_FAILED
+    old_state = lines[line_num]
+    if old_state == LINE_SUCCEEDED or old_state == new_state:
+        return
+    lines[line_num] = new_state
+    if old_state == LINE_FAILED:
+        # it failed before and succeeded this time
+        state["failed"] -= 1
+    else:
+        state["done"] += 1
+    if new_state == LINE_FAILED:
+        state["failed"] += 1
+    if old_state != LINE_NOT_DONE:
+        return
+    if new_state == LINE_FAILED:
+        state["failed_first"] += 1
+    try:
+        if len(fields) > ELAPSED_MONO_COLUMN and fields[ELAPSED_MONO_COLUMN] != "NA":
+            elapsed = float(fields[ELAPSED_MONO_COLUMN])
+        else:
+            elapsed = float(fields[ELAPSED_COLUMN])
+    except ValueError:
+        elapsed = None
+    if elapsed is not None:
+        state["elapsed_total"] += elapsed
+        state["elapsed_count"] += 1
+        add_to_histogram(state["histogram"], max(elapsed, 0.001))
+    # T_End up to the minute
+    minute = fields[END_COLUMN][:16]
+    state["per_minute"][minute] = state["per_minute"].get(minute, 0) + 1
+
+
+def _read_new_lines(state, offsets, file_name):
+    try:
+        status_file = open(file_name, "rb")
+    except (IOError, OSError):
+        return
+    with status_file:
+        file_stat = os.fstat(status_file.fileno())
+        key = (file_stat.st_dev, file_stat.st_ino)
+        offset = state["offsets"].get(key, 0)
+        if file_stat.st_size < offset:
+            # truncated or a new file that reused the inode
+            offset = 0
+        status_file.seek(offset)
+        while True:
+            block = status_file.read(READ_BLOCK)
+            if len(block) == 0:
+                break
+            # leave a line that is still being written for next time
+            end = block.rfind(b"\n") + 1
+            if end == 0:
+                if len(block) < READ_BLOCK:
+                    break
+                # a line longer than a block, it must be finished to be this long
+                end = len(block)
+            for line in block[:end].decode(errors="replace").split("\n"):
+                _add_status_line(state, line)
+            offset += end
+            status_file.seek(offset)
+        offsets[key] = offset
+
+
+def read_new_status(state, status_dir, job_id):
+    # add everything saved for job_id since the last call to the totals
+    tsv_name = path.join(status_dir, STATUS_TSV_NAME.format(job_id))
+    # only remember the files that are still there
+    offsets = {}
+    for file_name in [tsv_name] + shard_files(status_dir, job_id):
+        _read_new_lines(state, offsets, file_name)
+    state["offsets"] = offsets
+    sqlite_name = path.join(status_dir, STATUS_SQLITE_NAME.format(job_id))
+    if path.isfile(sqlite_name):
+        conn = sqlite3.connect(sqlite_name, timeout=300)
+        try:
+            (max_rowid,) = conn.execute("SELECT MAX(rowid) FROM status").fetchone()
+            if max_rowid is None or max_rowid < state["sqlite_rowid"]:
+                # dsq merge emptied the table, so rowids started over
+                state["sqlite_rowid"] = 0
+            for rowid, line in conn.execute(
+                "SELECT rowid, row FROM status WHERE rowid > ? ORDER BY rowid",
+                (state["sqlite_rowid"],),
+            ):
+                _add_status_line(state, line.rstrip("\n"))
+                state["sqlite_rowid"] = rowid
+        except sqlite3.OperationalError:
+            # no rows saved yet
+            pass
+        finally:
+            conn.close()
+
+
+def add_to_histogram(histogram, value):
+    # count a positive value in its log-scale bucket
+    bucket = int(math.floor(math.log(value) * HIST_SCALE))
+    histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+def bucket_middle(bucket):
+    return math.exp((bucket + 0.5) / HIST_SCALE)
+
+
+def histogram_percentile(histogram, fraction, value=bucket_middle):
+    # value turns the bucket the percentile falls in into a number
+    count = sum(histogram.values())
+    if count == 0:
+        return None
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= fraction * count:
+            return value(bucket)
+
+
+def summarize(state, now=None):
+    # dict of the totals so far, for printing or dumping as json
+    if now is None:
+        now = datetime.now()
+    # throughput over the last few whole minutes
+    minutes = [
+        (now - timedelta(minutes=m)).strftime("%Y-%m-%d %H:%M")
+        for m in range(1, RATE_MINUTES + 1)
+    ]
+    per_minute = float(sum(state["per_minute"].get(m, 0) for m in minutes))
+    per_minute /= RATE_MINUTES
+    # forget minutes we won't look at again
+    oldest = minutes[-1]
+    for minute in [m for m in state["per_minute"] if m < oldest]:
+        del state["per_minute"][minute]
+    summary = {
+        "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "done": state["done"],
+        "succeeded": state["done"] - state["failed"],
+        "failed": state["failed"],
+        "total": state["total_jobs"],
+        "remaining": None,
+        "per_minute": per_minute,
+        "p50_seconds": histogram_percentile(state["histogram"], 0.5),
+        "p95_seconds": histogram_percentile(state["histogram"], 0.95),
+        "eta_seconds": None,
+    }
+    if state["total_jobs"] is not None:
+        summary["remaining"] = max(state["total_jobs"] - state["done"], 0)
+        if summary["remaining"] == 0:
+            summary["eta_seconds"] = 0
+        elif per_minute > 0:
+            summary["eta_seconds"] = summary["remaining"] / per_minute * 60
+    return summary
+
+
+def format_summary(job_id, summary):
+    def seconds(value):
+        if value is None:
+            return "NA"
+        return "{:.02f}s".format(value)
+
+    def eta(value):
+        if value is None:
+            return "NA"
+        return str(timedelta(seconds=int(value)))
+
+    total = "?" if summary["total"] is None else summary["total"]
+    return "\n".join(
+        [
+            "dSQ job {} at {}".format(job_id, summary["time"]),
+            "Done:       {} of {} ({} succeeded, {} failed)".format(
+                summary["done"], total, summary["succeeded"], summary["failed"]
+            ),
+            "Throughput: {:.1f} jobs/minute".format(summary["per_minute"]),
+            "Run time:   p50 {}, p95 {}".format(
+                seconds(summary["p50_seconds"]), seconds(summary["p95_seconds"])
+            ),
+            "ETA:        {}".format(eta(summary["eta_seconds"])),
+        ]
+    )
@@ -0,0 +1,5 @@
+from os import path
+import sys
+
+# dSQ's modules sit at the top of the repo rather than in a package
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
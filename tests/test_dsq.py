@@ -0,0 +1,234 @@
+from dSQJobFile import read_line_map, task_positions
+from dSQWatch import find_total_jobs, new_watch_state, read_new_status
+import dSQ
+import json
+import os
+import pytest
+import shlex
+import subprocess
+import sys
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    # slurm's limits from the environment, so scontrol is never run
+    monkeypatch.setenv("DSQ_MAX_ARRAY_SIZE", "5")
+    monkeypatch.setenv("DSQ_MAX_JOB_COUNT", "100")
+    monkeypatch.delenv("DSQ_MAX_ARRAY_STRING", raising=False)
+
+
+def write_jobs(tmp_path, num_jobs, name="jobs.txt"):
+    job_file = tmp_path / name
+    job_file.parent.mkdir(parents=True, exist_ok=True)
+    job_file.write_text("".join("echo {}\n".format(i) for i in range(num_jobs)))
+    return str(job_file)
+
+
+def test_split_arrays_chain_with_max_jobs(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 12)
+    job_info = dSQ.build_job_info(["--job-file", job_file, "--max-jobs", "2"])
+    assert len(job_info["parts"]) == 3
+    assert job_info["chain"]
+    script = dSQ.format_parts_script(job_info, False)
+    assert script.count("--dependency=afterany") == 2
+    for part in job_info["parts"]:
+        assert part["slurm_args"]["--array"].endswith("%2")
+
+
+def test_split_arrays_run_together_without_max_jobs(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 12)
+    job_info = dSQ.build_job_info(["--job-file", job_file])
+    assert len(job_info["parts"]) == 3
+    assert not job_info["chain"]
+    assert "--dependency" not in dSQ.format_parts_script(job_info, False)
+
+
+def write_status(status_file, succeeded, failed):
+    # a status tsv of an earlier run
+    with open(str(status_file), "w") as f:
+        for line_num in succeeded:
+            f.write("{}\t0\tnode1\tx\tx\t1\techo {}\n".format(line_num, line_num))
+        for line_num in failed:
+            f.write("{}\t1\tnode1\tx\tx\t1\techo {}\n".format(line_num, line_num))
+
+
+def test_resume_skips_succeeded_lines(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 10)
+    write_status(tmp_path / "old.tsv", [0, 1, 2, 5, 9], [3])
+    job_info = dSQ.build_job_info(
+        ["--job-file", job_file, "--resume-from", str(tmp_path / "old.tsv")]
+    )
+    # without packing, indices are still line numbers
+    assert list(job_info["task_id_list"]) == [3, 4, 6, 7, 8]
+    assert "line_map" not in job_info
+
+
+def test_resume_packed_runs_lines_left_from_map(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 10)
+    write_status(tmp_path / "old.tsv", [0, 1, 2, 5, 9], [3])
+    job_info = dSQ.build_job_info(
+        [
+            "--job-file",
+            job_file,
+            "--pack",
+            "2",
+            "--resume-from",
+            str(tmp_path / "old.tsv"),
+        ]
+    )
+    assert list(job_info["task_id_list"]) == [0, 1, 2]
+    manifest = {"pack": 2, "line_map": job_info["line_map"]}
+    assert task_positions(0, 2, 1, manifest) == [(0, 5, 1)]
+    assert read_line_map(job_info["line_map"], range(6)) == [3, 4, 6, 7, 8]
+    assert "--line-map {}".format(job_info["line_map"]) in job_info["run_cmd"]
+
+
+def test_line_maps_of_same_named_job_files_dont_collide(tmp_path, limits, monkeypatch):
+    # e.g. dsq bulk a/jobs.txt b/jobs.txt -- --pack 2 --resume-from ...
+    monkeypatch.chdir(tmp_path)
+    write_status(tmp_path / "old.tsv", [0], [])
+    job_infos = []
+    for sub_dir, num_jobs in [("a", 4), ("b", 8)]:
+        job_file = write_jobs(tmp_path / sub_dir, num_jobs)
+        job_infos.append(
+            dSQ.build_job_info(
+                [
+                    "--job-file",
+                    job_file,
+                    "--pack",
+                    "2",
+                    "--resume-from",
+                    str(tmp_path / "old.tsv"),
+                ]
+            )
+        )
+    a, b = [job_info["line_map"] for job_info in job_infos]
+    assert a != b
+    assert read_line_map(a, range(10)) == [1, 2, 3]
+    assert read_line_map(b, range(10)) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_stdout_saves_the_line_map_it_prints(tmp_path, limits, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 4)
+    write_status(tmp_path / "old.tsv", [0], [])
+    job_info = dSQ.build_job_info(
+        [
+            "--job-file",
+            job_file,
+            "--pack",
+            "2",
+            "--resume-from",
+            str(tmp_path / "old.tsv"),
+            "--stdout",
+        ]
+    )
+    # the printed script can be submitted as it is
+    assert read_line_map(job_info["line_map"], range(10)) == [1, 2, 3]
+    assert job_info["line_map"] in capsys.readouterr().err
+
+
+def run_task(run_cmd, job_id, task_id, task_min=0):
+    # what slurm does for each array index
+    env = dict(os.environ, SLURM_ARRAY_JOB_ID=str(job_id))
+    env["SLURM_ARRAY_TASK_ID"] = str(task_id)
+    env["SLURM_ARRAY_TASK_MIN"] = str(task_min)
+    argv = [sys.executable] + shlex.split(run_cmd)
+    subprocess.check_call(argv, env=env, stdout=subprocess.DEVNULL)
+
+
+def test_watch_counts_the_jobs_submitted(tmp_path, limits, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 10)
+    write_status(tmp_path / "old.tsv", [0, 1, 2, 5, 9], [3])
+    job_info = dSQ.build_job_info(
+        ["--job-file", job_file, "--resume-from", str(tmp_path / "old.tsv")]
+    )
+    assert job_info["num_jobs"] == 5
+    # nothing to go by before the first job starts
+    dSQ.watch_main(["7", "--once", "--json"])
+    assert json.loads(capsys.readouterr().out)["total"] is None
+    task_ids = list(job_info["task_id_list"])
+    for task_id in task_ids[1:]:
+        run_task(job_info["run_cmd"], 7, task_id, task_ids[0])
+    # only the array's first task saves the manifest
+    assert not os.path.exists("job_7_manifest.json")
+    run_task(job_info["run_cmd"], 7, task_ids[0], task_ids[0])
+    dSQ.watch_main(["7", "--once", "--json"])
+    summary = json.loads(capsys.readouterr().out)
+    assert (summary["total"], summary["done"], summary["remaining"]) == (5, 5, 0)
+
+
+def test_watch_counts_the_jobs_of_every_split_array(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 12)
+    job_info = dSQ.build_job_info(["--job-file", job_file])
+    assert len(job_info["parts"]) == 3
+    # only the last array has started, it reports to the first one's id
+    part = job_info["parts"][-1]
+    run_task(dSQ.format_part_run_cmd(job_info, part, 7), 9, 0)
+    state = new_watch_state()
+    find_total_jobs(state, str(tmp_path), "7")
+    read_new_status(state, str(tmp_path), "7")
+    assert (state["total_jobs"], state["done"]) == (12, 1)
+
+
+def test_api_raises_instead_of_exiting(tmp_path, limits, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 4)
+    with pytest.raises(ValueError):
+        dSQ.build_job_info(["--job-file", job_file, "--pack", "0"])
+    with pytest.raises(ValueError):
+        dSQ.build_job_info(["--job-file", str(tmp_path / "missing.txt")])
+    with pytest.raises(ValueError):
+        dSQ.prepare_job([], str(tmp_path / "empty.txt"))
+    assert capsys.readouterr().err == ""
+
+
+def test_api_submits_nothing_when_all_jobs_succeeded(tmp_path, limits, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job_file = write_jobs(tmp_path, 3)
+    write_status(tmp_path / "old.tsv", [0, 1, 2], [])
+    job_info = dSQ.build_job_info(
+        ["--job-file", job_file, "--resume-from", str(tmp_path / "old.tsv")]
+    )
+    assert job_info["parts"] == []
+    assert dSQ.submit_job(job_info) == []
+    results = dSQ.submit_job_files(
+        [job_file, str(tmp_path / "missing.txt")],
+        ["--resume-from", str(tmp_path / "old.tsv")],
+    )
+    assert results[0] == []
+    assert isinstance(results[1], ValueError)
+
+
+def test_logs_keep_the_output_of_each_attempt(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    job_file = tmp_path / "jobs.txt"
+    job_file.write_text("echo try; echo oops >&2; exit 3\n")
+    argv = [
+        sys.executable,
+        os.path.join(os.path.dirname(dSQ.__file__), "dSQBatch.py"),
+        "--job-file",
+        str(job_file),
+        "--aggregate-output",
+        "--retries",
+        "1",
+        "--retry-delay",
+        "0",
+    ]
+    env = dict(os.environ, SLURM_ARRAY_JOB_ID="7", SLURM_ARRAY_TASK_ID="0")
+    # the task fails along with its job
+    assert subprocess.call(argv, env=env, stdout=subprocess.DEVNULL) != 0
+    dSQ.logs_main(["7", "0"])
+    out, err = capsys.readouterr()
+    assert out == "try\ntry\n"
+    assert err == "[dSQ]: attempt 1\noops\n[dSQ]: attempt 2\noops\n"
+    dSQ.logs_main(["7", "0", "--attempt", "2"])
+    assert capsys.readouterr() == ("try\n", "oops\n")
+    with pytest.raises(SystemExit):
+        dSQ.logs_main(["7", "0", "--attempt", "3"])
@@ -0,0 +1,166 @@
+from dSQJobFile import (
+    INDEX_HEADER,
+    STAGE_KEEP,
+    _lookup_offsets,
+    _stage_locks,
+    count_jobs,
+    index_file_name,
+    read_lines,
+    remove_unused_copies,
+    scan_job_file,
+    stage_job_file,
+)
+import dSQJobFile
+import gzip
+import lzma
+import os
+import pytest
+import time
+
+
+def write(tmp_path, name, text):
+    job_file = tmp_path / name
+    job_file.write_text(text)
+    return str(job_file)
+
+
+def test_scan_skips_comments_and_empty_lines(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\n\n# comment\necho 3\n  \necho 5")
+    assert scan_job_file(job_file) == [0, 3, 5]
+    assert os.path.isfile(index_file_name(job_file))
+    assert count_jobs(job_file) == 3
+
+
+def test_read_lines_through_index(tmp_path):
+    lines = ["echo {}".format(i) * (i % 7 + 1) for i in range(1000)]
+    job_file = write(tmp_path, "jobs.txt", "\n".join(lines) + "\n")
+    scan_job_file(job_file)
+    assert _lookup_offsets(job_file, [0]) is not None
+    wanted = [999, 0, 500, 123]
+    assert read_lines(job_file, wanted) == dict((n, lines[n]) for n in wanted)
+
+
+def test_missing_lines_are_empty(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 1\n")
+    scan_job_file(job_file)
+    assert read_lines(job_file, [1, 2, 100]) == {1: "echo 1", 2: "", 100: ""}
+
+
+def test_stale_index_is_not_used(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 1\n")
+    scan_job_file(job_file)
+    with open(job_file, "w") as f:
+        f.write("echo changed\necho lines\necho here\n")
+    assert _lookup_offsets(job_file, [0]) is None
+    assert read_lines(job_file, [0, 2]) == {0: "echo changed", 2: "echo here"}
+    assert count_jobs(job_file) == 3
+
+
+def test_index_with_the_same_size_and_mtime_is_checked(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 10\necho 2\n")
+    scan_job_file(job_file)
+    job_file_stat = os.stat(job_file)
+    # same size, different lines
+    with open(job_file, "w") as f:
+        f.write("echo 00\necho 1\necho 2\n")
+    os.utime(job_file, ns=(job_file_stat.st_atime_ns, job_file_stat.st_mtime_ns))
+    assert _lookup_offsets(job_file, [0]) is not None
+    assert read_lines(job_file, [0, 1]) == {0: "echo 00", 1: "echo 1"}
+    # and the index was made again
+    assert _lookup_offsets(job_file, [1])[0] == {1: (8, 15)}
+    assert read_lines(job_file, [1, 2]) == {1: "echo 1", 2: "echo 2"}
+
+
+def test_count_jobs_checks_the_crc(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 1\n#  s\n")
+    scan_job_file(job_file)
+    job_file_stat = os.stat(job_file)
+    with open(job_file, "w") as f:
+        f.write("echo 0\necho 1\necho 2\n")
+    os.utime(job_file, ns=(job_file_stat.st_atime_ns, job_file_stat.st_mtime_ns))
+    assert count_jobs(job_file) == 3
+    with open(index_file_name(job_file), "rb") as index_file:
+        assert INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))[5] == 3
+
+
+def test_without_index(tmp_path):
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 1\necho 2\n")
+    scan_job_file(job_file, write_index_file=False)
+    assert not os.path.exists(index_file_name(job_file))
+    assert read_lines(job_file, [2]) == {2: "echo 2"}
+
+
+def age(file_name, seconds):
+    old = time.time() - seconds
+    os.utime(file_name, (old, old))
+
+
+def test_staged_copies_are_removed_once_unused(tmp_path):
+    stage_dir = tmp_path / "stage"
+    stage_dir.mkdir()
+    job_file = write(tmp_path, "jobs.txt", "echo 0\necho 1\n")
+    scan_job_file(job_file)
+    staged = stage_job_file(job_file, str(stage_dir))
+    assert staged != job_file
+    assert read_lines(staged, [1]) == {1: "echo 1"}
+    assert os.path.isfile(index_file_name(staged))
+    local_dir = os.path.dirname(staged)
+
+    # this task still holds its lock, so even an old copy stays
+    age(staged + ".lock", STAGE_KEEP + 60)
+    remove_unused_copies(local_dir)
+    assert os.path.isfile(staged)
+
+    # once it exits it goes, with its index and lock file
+    os.close(_stage_locks.pop())
+    remove_unused_copies(local_dir)
+    assert os.listdir(local_dir) == []
+
+
+def test_recently_used_copies_are_kept(tmp_path):
+    stage_dir = tmp_path / "stage"
+    stage_dir.mkdir()
+    job_file = write(tmp_path, "jobs.txt", "echo 0\n")
+    staged = stage_job_file(job_file, str(stage_dir))
+    os.close(_stage_locks.pop())
+    remove_unused_copies(os.path.dirname(staged))
+    assert os.path.isfile(staged)
+    # a later task uses the same copy
+    assert stage_job_file(job_file, str(stage_dir)) == staged
+    os.close(_stage_locks.pop())
+
+
+def write_compressed_jobs(tmp_path, compression, blocked, monkeypatch):
+    lines = ["# jobs"] + ["echo {}".format(i) * (i % 5 + 1) for i in range(500)]
+    job_file = write(tmp_path, "jobs.txt", "\n".join(lines) + "\n")
+    compressed = str(tmp_path / "jobs.txt.{}".format(compression))
+    if blocked:
+        monkeypatch.setattr(dSQJobFile, "COMPRESS_BLOCK", 256)
+        dSQJobFile.compress_job_file(job_file, compressed, compression)
+    else:
+        compress = gzip.compress if compression == "gzip" else lzma.compress
+        with open(job_file, "rb") as f, open(compressed, "wb") as out:
+            out.write(compress(f.read()))
+    return compressed, lines
+
+
+@pytest.mark.parametrize("compression", ["gzip", "xz"])
+@pytest.mark.parametrize("blocked", [True, False])
+def test_compressed_job_files(tmp_path, monkeypatch, compression, blocked):
+    job_file, lines = write_compressed_jobs(tmp_path, compression, blocked, monkeypatch)
+    assert scan_job_file(job_file) == list(range(1, 501))
+    wanted = [500, 1, 250, 251, 7]
+    blocks = _lookup_offsets(job_file, wanted)[1]
+    # where every block starts in the file and in the text
+    assert blocks[0] == (0, 0)
+    assert (len(blocks) > 1) == blocked
+    assert read_lines(job_file, wanted) == dict((n, lines[n]) for n in wanted)
+    assert read_lines(job_file, [501]) == {501: ""}
+
+
+@pytest.mark.parametrize("compression", ["gzip", "xz"])
+def test_compressed_job_files_without_index(tmp_path, monkeypatch, compression):
+    job_file, lines = write_compressed_jobs(tmp_path, compression, True, monkeypatch)
+    assert count_jobs(job_file) == 500
+    assert not os.path.exists(index_file_name(job_file))
+    assert read_lines(job_file, [3, 400]) == {3: lines[3], 400: lines[400]}
@@ -0,0 +1,64 @@
+from dSQQueue import (
+    QUEUE_MAX_ATTEMPTS,
+    claim_chunk,
+    close_queue,
+    finish_chunk,
+    given_up_chunks,
+    open_queue,
+    queue_dir_name,
+)
+import os
+import threading
+
+
+def test_every_chunk_is_claimed_once(tmp_path):
+    claimed = []
+
+    def work(w):
+        queue = open_queue(str(tmp_path), 7, 200)
+        while True:
+            chunk = claim_chunk(queue, "worker{}".format(w))
+            if chunk is None:
+                break
+            claimed.append(chunk)
+            finish_chunk(queue, chunk)
+        close_queue(queue)
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(200))
+    # a lease per chunk, and a done log per worker rather than a file per chunk
+    names = os.listdir(queue_dir_name(str(tmp_path), 7))
+    assert len([n for n in names if n.endswith(".lease")]) == 200
+    done_logs = [n for n in names if n.endswith(".done")]
+    assert 0 < len(done_logs) <= 8
+    done = []
+    for name in done_logs:
+        with open(os.path.join(queue_dir_name(str(tmp_path), 7), name)) as f:
+            done.extend(int(l) for l in f)
+    assert sorted(done) == list(range(200))
+
+
+def test_stale_leases_are_handed_out_again_then_given_up(tmp_path):
+    dead = open_queue(str(tmp_path), 7, 2)
+    assert claim_chunk(dead, "dead") == 0
+    assert claim_chunk(dead, "dead") == 1
+    finish_chunk(dead, 1)
+
+    # a lease of -1 seconds is always stale
+    attempts = 1
+    while attempts < QUEUE_MAX_ATTEMPTS:
+        queue = open_queue(str(tmp_path), 7, 2)
+        assert claim_chunk(queue, "worker{}".format(attempts), lease=-1) == 0
+        attempts += 1
+
+    queue = open_queue(str(tmp_path), 7, 2)
+    assert claim_chunk(queue, "last", lease=-1) is None
+    assert given_up_chunks(queue) == [0]
+    # only one worker reports it
+    other = open_queue(str(tmp_path), 7, 2)
+    assert claim_chunk(other, "other", lease=-1) is None
+    assert given_up_chunks(other) == []
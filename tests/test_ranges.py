@@ -0,0 +1,120 @@
+from collections import defaultdict
+from dSQ import format_range, split_array
+from dSQAutopsy import (
+    collapse_ranges,
+    job_id_key,
+    merge_ranges,
+    parse_ranges,
+    range_members,
+    range_size,
+    tally_states,
+)
+from dSQJobFile import MAP_HEADER, MAP_MAGIC, MAP_VERSION
+import pytest
+import struct
+
+
+def expand(ranges):
+    return [i for low, high, step in ranges for i in range(low, high + 1, step)]
+
+
+@pytest.mark.parametrize(
+    "task_ids, formatted",
+    [
+        ([5], "5"),
+        (range(0, 10), "0-9"),
+        (range(0, 10, 3), "0-9:3"),
+        ([0, 2, 4, 6, 7, 8, 20], "0-6:2,7-8,20"),
+        ([1, 3, 10], "1,3,10"),
+        ([0, 1, 2, 10, 20, 30, 31], "0-2,10-30:10,31"),
+    ],
+)
+def test_format_range_round_trips(task_ids, formatted):
+    assert format_range(task_ids) == formatted
+    # sacct prints pending ranges the way they were submitted
+    ranges = list(parse_ranges("[{}%4]".format(formatted)))
+    assert expand(ranges) == list(task_ids)
+
+
+def test_stepped_ranges_stay_compact():
+    ranges = list(parse_ranges("[0-1000000:2]"))
+    assert ranges == [(0, 1000000, 2)]
+    assert range_size(*ranges[0]) == 500001
+    # the last index is the last one the step reaches
+    assert list(parse_ranges("[10-20:3]")) == [(10, 19, 3)]
+    assert list(parse_ranges("12")) == [(12, 12, 1)]
+
+
+def test_job_ids_sort_by_their_numbers():
+    job_ids = ["123_4", "99", "123", "1000", "123+1", "123_10", "abc"]
+    assert sorted(job_ids, key=job_id_key) == [
+        "99",
+        "123",
+        "123+1",
+        "123_4",
+        "123_10",
+        "1000",
+        "abc",
+    ]
+
+
+def test_collapse_ranges():
+    ranges = [(4, 6, 1), (0, 3, 1), (10, 20, 5), (8, 8, 3), (30, 30, 1)]
+    assert list(collapse_ranges(ranges)) == ["0-6", "8", "10-20:5", "30"]
+
+
+def test_tally_states_counts_and_reruns_stepped_ranges():
+    tally = {
+        "states": defaultdict(list),
+        "summary": defaultdict(int),
+        "reruns": [],
+        "rerun_states": ["FAILED"],
+        "lines_read": 0,
+    }
+    manifests = {"8": {"offset": 100, "pack": 2}}
+    tally_states(
+        ["7_[0-4:2]|FAILED\n", "8_[0-1]|COMPLETED\n", "8_3|FAILED\n"], manifests, tally
+    )
+    assert tally["summary"] == {"FAILED": 4, "COMPLETED": 2}
+    assert list(collapse_ranges(tally["states"]["FAILED"])) == ["0-4:2", "103"]
+    assert merge_ranges(tally["reruns"]) == [(0, 4, 2), (206, 207, 1)]
+
+
+def test_stepped_reruns_of_packed_and_mapped_arrays(tmp_path):
+    line_map = tmp_path / "jobs.map"
+    line_nums = [3, 4, 6, 7, 8, 11]
+    line_map.write_bytes(
+        MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, len(line_nums))
+        + struct.pack("<{}Q".format(len(line_nums)), *line_nums)
+    )
+    tally = {
+        "states": defaultdict(list),
+        "summary": defaultdict(int),
+        "reruns": [],
+        "rerun_states": ["FAILED"],
+        "lines_read": 0,
+    }
+    manifests = {
+        "7": {"pack": 2},
+        "8": {"pack": 2, "line_map": str(line_map)},
+    }
+    tally_states(["7_[0-1000:500]|FAILED\n", "8_[0-2:2]|FAILED\n"], manifests, tally)
+    # one range per place in the pack, however many tasks failed
+    assert merge_ranges(tally["reruns"]) == [
+        (0, 2000, 1000),
+        (1, 2001, 1000),
+        (3, 4, 1),
+        (8, 8, 1),
+        (11, 11, 1),
+    ]
+    assert list(range_members(merge_ranges(tally["reruns"])))[:5] == [0, 1, 3, 4, 8]
+
+
+def test_split_array_keeps_every_index():
+    task_ids = list(range(0, 50, 2)) + list(range(50, 60))
+    parts = split_array(task_ids, 20, 8, max_range_length=10)
+    assert sorted(offset + i for offset, ids in parts for i in ids) == task_ids
+    for offset, ids in parts:
+        assert max(ids) < 20 and len(ids) <= 8
+        # unless one range is longer than that
+        assert len(format_range(ids)) <= 10 or "," not in format_range(ids)
@@ -0,0 +1,21 @@
+from os import path
+from dSQSlurm import slurm_conf_cache_name, slurm_limits
+import os
+
+FAKE_SLURM_DIR = path.join(
+    path.dirname(path.dirname(path.abspath(__file__))), "benchmarks", "fake_slurm"
+)
+
+
+def test_cache_is_kept_per_scontrol(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("PATH", str(tmp_path))
+    without = slurm_conf_cache_name()
+    monkeypatch.setenv("PATH", FAKE_SLURM_DIR)
+    assert slurm_conf_cache_name() != without
+
+
+def test_limits_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("DSQ_MAX_ARRAY_SIZE", "7")
+    monkeypatch.setenv("DSQ_MAX_JOB_COUNT", "9")
+    assert slurm_limits() == {"MaxArraySize": 7, "MaxJobCount": 9}
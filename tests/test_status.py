@@ -0,0 +1,110 @@
+from os import path
+from dSQStatus import (
+    MERGE_LOCK_NAME,
+    STATUS_SHARD_DIR,
+    STATUS_TSV_NAME,
+    format_status_row,
+    merge_status,
+    shard_files,
+    succeeded_lines,
+    write_status_row,
+)
+from dSQWatch import new_watch_state, read_new_status
+import os
+import pytest
+
+
+def status_row(line_num, exit_code=0):
+    return {
+        "Array_Task_ID": line_num,
+        "Exit_Code": exit_code,
+        "Hostname": "node1",
+        "T_Start": "2024-01-01 00:00:00",
+        "T_End": "2024-01-01 00:00:01",
+        "T_Elapsed": 1.0,
+        "Task": "echo {}".format(line_num),
+    }
+
+
+def read_tsv(status_dir, job_id):
+    with open(path.join(status_dir, STATUS_TSV_NAME.format(job_id))) as tsv_file:
+        return [l.split("\t")[:2] for l in tsv_file]
+
+
+def test_shards_are_one_file_per_task(tmp_path):
+    status_dir = str(tmp_path)
+    for i in range(5):
+        write_status_row("shard", status_dir, 7, "node1", status_row(i))
+    shards = shard_files(status_dir, 7)
+    assert len(shards) == 1
+    assert os.listdir(path.join(status_dir, STATUS_SHARD_DIR.format(7))) == [
+        path.basename(shards[0])
+    ]
+    with open(shards[0]) as shard_file:
+        assert [l.split("\t")[0] for l in shard_file] == ["0", "1", "2", "3", "4"]
+
+
+@pytest.mark.parametrize("backend", ["shard", "sqlite"])
+def test_merge(tmp_path, backend):
+    status_dir = str(tmp_path)
+    for i in range(3):
+        write_status_row(backend, status_dir, 7, "node1", status_row(i, i % 2))
+    assert merge_status(status_dir, 7) == 3
+    assert sorted(read_tsv(status_dir, 7)) == [["0", "0"], ["1", "1"], ["2", "0"]]
+    # merging again adds nothing new
+    assert merge_status(status_dir, 7) == 0
+    write_status_row(backend, status_dir, 7, "node1", status_row(3))
+    assert merge_status(status_dir, 7) == 1
+    assert len(read_tsv(status_dir, 7)) == 4
+    assert list(succeeded_lines([path.join(status_dir, "job_7_status.tsv")])) == [
+        1,
+        0,
+        1,
+        1,
+    ]
+
+
+def test_tasks_keep_saving_to_shards_while_merging(tmp_path):
+    status_dir = str(tmp_path)
+    write_status_row("shard", status_dir, 7, "node1", status_row(0))
+    shard_dir = path.join(status_dir, STATUS_SHARD_DIR.format(7))
+    # a task that died in the middle of a line
+    with open(path.join(shard_dir, "node2.1.1.tsv"), "w") as shard_file:
+        shard_file.write(format_status_row(status_row(1)) + "2\t0\tpartial")
+    assert merge_status(status_dir, 7) == 2
+    assert os.listdir(shard_dir) == [MERGE_LOCK_NAME]
+    # the task that is still running starts a new shard
+    write_status_row("shard", status_dir, 7, "node1", status_row(3))
+    assert len(shard_files(status_dir, 7)) == 1
+    assert merge_status(status_dir, 7) == 1
+    assert read_tsv(status_dir, 7) == [["0", "0"], ["1", "0"], ["3", "0"]]
+
+
+def test_merge_picks_up_after_one_that_died(tmp_path):
+    status_dir = str(tmp_path)
+    shard_dir = path.join(status_dir, STATUS_SHARD_DIR.format(7))
+    write_status_row("shard", status_dir, 7, "node1", status_row(0))
+    shard = shard_files(status_dir, 7)[0]
+    os.rename(shard, shard + ".1.merging")
+    with open(path.join(status_dir, STATUS_TSV_NAME.format(7)) + ".1.tmp", "w") as f:
+        f.write("partial")
+    assert merge_status(status_dir, 7) == 1
+    assert read_tsv(status_dir, 7) == [["0", "0"]]
+    assert os.listdir(shard_dir) == [MERGE_LOCK_NAME]
+
+
+def test_watch_counts_shards_once(tmp_path):
+    status_dir = str(tmp_path)
+    state = new_watch_state(4)
+    for i in range(2):
+        write_status_row("shard", status_dir, 7, "node1", status_row(i))
+    read_new_status(state, status_dir, 7)
+    assert state["done"] == 2
+    write_status_row("shard", status_dir, 7, "node1", status_row(2, 1))
+    read_new_status(state, status_dir, 7)
+    assert (state["done"], state["failed"]) == (3, 1)
+    # merged lines move to the tsv, they were already counted
+    merge_status(status_dir, 7)
+    write_status_row("shard", status_dir, 7, "node1", status_row(3))
+    read_new_status(state, status_dir, 7)
+    assert (state["done"], state["failed"]) == (4, 1)
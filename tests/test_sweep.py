@@ -0,0 +1,80 @@
+from dSQSweep import load_sweep, sweep_line, sweep_lines, sweep_size
+import itertools
+import json
+import pytest
+
+
+def write_spec(tmp_path, spec):
+    spec_file = tmp_path / "sweep.json"
+    spec_file.write_text(json.dumps(spec))
+    return str(spec_file)
+
+
+def test_lines_are_nested_loops(tmp_path):
+    (tmp_path / "data.txt").write_text("a.csv\n\nb.csv\n")
+    sweep = load_sweep(
+        write_spec(
+            tmp_path,
+            {
+                "command": "fit --lr {lr} --seed {seed} --data {data}",
+                "axes": [
+                    {"name": "lr", "range": [0.1, 0.3, 0.1]},
+                    {"name": "seed", "range": [1, 7, 3]},
+                    {"name": "data", "file": "data.txt"},
+                ],
+            },
+        )
+    )
+    assert sweep_size(sweep) == 3 * 3 * 2
+    expected = [
+        "fit --lr {} --seed {} --data {}".format(lr, seed, data)
+        for lr, seed, data in itertools.product(
+            [0.1, 0.2, 0.3], [1, 4, 7], ["a.csv", "b.csv"]
+        )
+    ]
+    assert [sweep_line(sweep, n) for n in range(sweep_size(sweep))] == expected
+
+
+def test_doubled_braces_are_literal(tmp_path):
+    sweep = load_sweep(
+        write_spec(
+            tmp_path,
+            {
+                "command": "echo ${{HOME}} {x} | awk '{{print $1}}'",
+                "axes": [{"name": "x", "range": [1, 2]}],
+            },
+        )
+    )
+    assert sweep_line(sweep, 1) == "echo ${HOME} 2 | awk '{print $1}'"
+
+
+def test_sweep_lines_past_the_end_are_empty(tmp_path):
+    sweep = load_sweep(
+        write_spec(
+            tmp_path,
+            {"command": "run {x}", "axes": [{"name": "x", "values": ["p", "q"]}]},
+        )
+    )
+    assert sweep_lines(sweep, [1, 2, -1]) == {1: "run q", 2: "", -1: ""}
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"command": "run {x}"},
+        {"command": "run {x}", "axes": [{"name": "x", "range": [5, 1]}]},
+        {"command": "run {x}", "axes": [{"name": "x", "values": []}]},
+        {"command": "run {y}", "axes": [{"name": "x", "values": [1]}]},
+        {"command": "run {x}", "axes": [{"values": [1]}]},
+        {"command": "run {x}", "axes": [{"name": "x", "range": ["a", 3]}]},
+        {"command": "run {x}", "axes": [{"name": "x", "range": [1, 3, None]}]},
+        {"command": "run {x}", "axes": [{"name": "x", "range": [True, 3]}]},
+        {"command": "run {x}", "axes": [{"name": "x", "range": "1-3"}]},
+        {"command": "awk '{print}' {x}", "axes": [{"name": "x", "values": [1]}]},
+        {"command": "run {x} }", "axes": [{"name": "x", "values": [1]}]},
+        {"command": "run {x.y}", "axes": [{"name": "x", "values": [1]}]},
+    ],
+)
+def test_bad_specs(tmp_path, spec):
+    with pytest.raises(ValueError):
+        load_sweep(write_spec(tmp_path, spec))